@@ -4,9 +4,8 @@ from pydantic_core.core_schema import ExpectedSerializationTypes
 import uvicorn 
 
 #项目
-from src.services.file_services import schedule_task
 from src.config import config
-from src.services.exec_services import close_executer
+from src.data.db.sqlinit import init_db
 
 
 # 配置日志
@@ -14,10 +13,8 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 if __name__ == "__main__":
-    try:
-        schedule_task()
-    except Exception as e:
-        logger.error(f"定时任务启动失败: {e}")
+    # 定时任务随应用生命周期启动（见 src/api/base.py），这里只执行数据库迁移
+    init_db()
     
     """启动API服务器"""
     uvicorn.run(
@@ -27,4 +24,3 @@ if __name__ == "__main__":
         reload=True,
         log_level=config.LOG_LEVEL,
     )
-    close_executer()
\ No newline at end of file
@@ -1,24 +1,90 @@
 from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import AsyncGenerator, Callable, Optional
 import uuid
+import time
+import asyncio
 import logging
 import json
 
 from src.api.ApiModel import ApiResponse
 from src.config import config
 from src.services.ai.chat_service import ChatCompletionRequest, ai_service
+from src.services.ai.llm import llm_pool
+from src.services.ai.sse import DONE, HEARTBEAT, error_frame
+from src.services.ai.admission import PRIORITIES, AdmissionRejected, admission
+from src.services.ai.rag import rag_service, server_timing
 from src.utils.kkutils import timestamp
 
 logger = logging.getLogger(__name__)
 
 ai_chat_router = APIRouter()
 
+def _request_priority(request: Request, chat_request: ChatCompletionRequest) -> str:
+    """
+    请求优先级：优先使用 X-Priority 请求头（high/normal/low），user 以 batch 开头的批处理任务为 low，
+    其余流式（交互式）请求为 high，非流式请求为 normal
+    """
+    priority = (request.headers.get("X-Priority") or "").lower()
+    if priority in PRIORITIES:
+        return priority
+    if chat_request.user and chat_request.user.startswith("batch"):
+        return "low"
+    return "high" if chat_request.stream else "normal"
+
+async def _guard_stream(request: Request, stream: AsyncGenerator[str, None],
+                        on_close: Optional[Callable[[], None]] = None) -> AsyncGenerator[str, None]:
+    """
+    包装流式响应：空闲时发送心跳帧避免代理断开，检测到客户端断开后取消服务端生成（进而中止上游请求），
+    生成过程抛出异常时发送错误帧和结束标记
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=64)
+    finished = object()
+    
+    async def _pump():
+        try:
+            async for frame in stream:
+                await queue.put(frame)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(finished)
+    
+    task = asyncio.create_task(_pump())
+    try:
+        while True:
+            try:
+                frame = await asyncio.wait_for(queue.get(), config.AI_STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                if task.done() or await request.is_disconnected():
+                    break
+                yield HEARTBEAT
+                continue
+            if frame is finished:
+                break
+            if isinstance(frame, Exception):
+                logger.error(f"流式响应生成失败: {str(frame)}")
+                yield error_frame(str(frame) or frame.__class__.__name__)
+                yield DONE
+                break
+            yield frame
+    finally:
+        # 正常结束时任务已完成；客户端断开时取消生成任务
+        task.cancel()
+        if task.done() and not task.cancelled() and task.exception() is not None:
+            logger.error(f"流式响应生成失败: {str(task.exception())}")
+        if on_close is not None:
+            on_close()
+
 @ai_chat_router.post("/chat/completions", tags=["AI"])
 async def chat_completions(request: Request):
     """
     AI 聊天完成接口，与 OpenAI /v1/chat/completions 兼容
-    支持流式和非流式调用
+    支持流式和非流式调用；携带 ids 时在这些文档内检索参考资料注入提示词，
+    响应头 Server-Timing 返回检索（retrieve）和生成（generate）耗时
     """
+    rag_task = None
     try:
         # API 请求头
         if config.AI_KEY:
@@ -32,34 +98,84 @@ async def chat_completions(request: Request):
         # 构建请求对象
         chat_request = ChatCompletionRequest(**body)
         
+        # 准入控制：按 API Key 限流，并按优先级排队获取在途名额
+        admission.check_rate(
+            request.headers.get("Authorization") or (request.client.host if request.client else "unknown")
+        )
+        priority = _request_priority(request, chat_request)
+        
+        # 通过限流后再开始检索（被限流的请求不调用向量化服务），与准入排队并行
+        rag_task = rag_service.start(chat_request)
+        
         # 检查是否为流式请求
         if chat_request.stream:
-            # 流式响应
-            async def generate_stream():
-                async for chunk in ai_service.chat_completion_stream(chat_request):
-                    yield chunk
+            await admission.acquire(priority)
+            start = time.monotonic()
+            released = False
+            
+            def _release():
+                # 流结束或客户端断开时归还名额（只归还一次）
+                nonlocal released
+                if not released:
+                    released = True
+                    admission.release(time.monotonic() - start)
             
+            headers = {
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+                "Content-Type": "text/event-stream",
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Allow-Headers": "*"
+            }
+            # 流式响应头先于生成发出，只能携带检索耗时
+            if rag_task is not None:
+                try:
+                    context = await rag_task
+                except BaseException:
+                    _release()
+                    raise
+                headers["Server-Timing"] = server_timing({"retrieve": context.seconds}, context)
+            
+            # 流式响应
             return StreamingResponse(
-                generate_stream(),
+                _guard_stream(request, ai_service.chat_completion_stream(chat_request, rag_task), on_close=_release),
                 media_type="text/plain",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "Content-Type": "text/event-stream",
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Headers": "*"
-                }
+                headers=headers,
+                # 响应在开始迭代前被取消时，由后台任务兜底归还名额
+                background=BackgroundTask(_release)
             )
         else:
             # 非流式响应
-            response = ai_service.chat_completion(chat_request)
+            timings = {}
+            async with admission.slot(priority):
+                response = await ai_service.achat_completion(chat_request, rag_task, timings)
             
             # 返回响应
             return JSONResponse(
                 status_code=200,
-                content=response.dict(exclude_none=True)
+                content=response.dict(exclude_none=True),
+                headers={"Server-Timing": server_timing(timings, rag_task.result() if rag_task else None)}
             )
         
+    except AdmissionRejected as e:
+        logger.warning(f"请求被拒绝: {str(e)}，建议 {e.retry_after} 秒后重试")
+        response = ApiResponse(
+            success=False,
+            message=str(e),
+            messagecode=429,
+            data={"retry_after": e.retry_after}
+        ).toJsonResponse(status_code=429)
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    except asyncio.TimeoutError:
+        _message = f"AI 聊天调用超时: 超过 {config.AI_TIMEOUT} 秒未返回"
+        logger.error(_message)
+        return ApiResponse(
+            success=False,
+            message=_message,
+            messagecode=504,
+            data={}
+        )
     except ValueError as e:
         _message = f"请求参数验证失败: {str(e)}"
         logger.error(_message)
@@ -78,6 +194,10 @@ async def chat_completions(request: Request):
             messagecode=500,
             data={}
         )
+    finally:
+        # 请求在等待检索结果前失败（校验失败、被限流等）时取消检索
+        if rag_task is not None and not rag_task.done():
+            rag_task.cancel()
 
 @ai_chat_router.get("/completions", response_model=ApiResponse, tags=["AI"])
 async def completions(request: Request):
@@ -98,11 +218,12 @@ async def list_models():
     try:
         models = [
             {
-                "id": "Qwen3-32B",
+                "id": model,
                 "object": "model",
                 "created": timestamp(),
                 "owned_by": "vllm"
-            },
+            }
+            for model in llm_pool().models()
         ]
         
         return JSONResponse(
@@ -0,0 +1,42 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from fastapi import APIRouter
+from pydantic import BaseModel, Field
+
+from src.api.ApiModel import ApiResponse
+from src.config import config
+from src.services.ai.retrieval import retriever
+
+logger = logging.getLogger(__name__)
+
+ai_search_router = APIRouter()
+
+
+class SearchRequest(BaseModel):
+    query: str = Field(..., min_length=1)
+    top_k: int = Field(config.SEARCH_TOP_K, ge=1, le=100)
+    ids: Optional[List[str]] = None # 限定检索的文档UID，为空时检索全部文档
+
+
+@ai_search_router.post("/search", response_model=ApiResponse, tags=["AI"])
+async def search(request: SearchRequest):
+    """
+    文档分块向量检索：返回与查询最相近的 top_k 个分块及所属文档
+    """
+    try:
+        # 查询向量化和矩阵计算都是阻塞操作，放到线程中执行
+        results = await asyncio.to_thread(retriever().search, request.query, request.top_k, request.ids)
+    except Exception as e:
+        logger.error(f"检索失败: {str(e)}")
+        return ApiResponse(
+            success=False,
+            message=f"检索失败: {str(e)}",
+            data={}
+        )
+    return ApiResponse(
+        success=True,
+        message="检索成功",
+        data={"results": results}
+    )
@@ -1,4 +1,6 @@
+import asyncio
 from ast import Str
+from contextlib import asynccontextmanager
 from fastapi import APIRouter, FastAPI, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
@@ -12,6 +14,41 @@ from typing import Any, Dict, Optional
 from src.config import config
 from src.api.ApiModel import ApiResponse
 from src.utils.sqlite_utils import SQLiteUtils
+from src.services.ai.llm import init_llm, close_llm
+from src.services.db_services import open_database, close_database
+from src.data.db.sqlinit import init_db
+from src.services.file_services import ingest_pool, job_scheduler
+from src.services.downloader import close_download_client
+from src.services.exec_services import task_manager, close_task_manager
+from src.services.ai.embedding import close_embedding_service
+from src.services.ai.retrieval import close_retriever
+from src.services.notifier import notification_dispatcher
+
+
+# 应用生命周期：启动时创建共享资源，关闭时释放
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    open_database()
+    init_llm()
+    await notification_dispatcher().start()
+    # 后台任务池（下载线程池、解析进程池）
+    task_manager()
+    ingest_pool().start()
+    # 定时任务（队列轮询、无引用文件清理）只在持有主节点锁的进程执行
+    job_scheduler().start()
+    yield
+    # 先停止调度并释放主节点锁，再等待处理中的文档完成，最后投递剩余的完成通知
+    await asyncio.to_thread(job_scheduler().stop)
+    await asyncio.to_thread(ingest_pool().stop, config.INGEST_DRAIN_TIMEOUT)
+    await notification_dispatcher().stop()
+    close_download_client()
+    # 取消排队中的后台任务，等待运行中的任务结束
+    await asyncio.to_thread(close_task_manager)
+    close_retriever()
+    close_embedding_service()
+    await close_llm()
+    await close_database()
 
 
 # 创建FastAPI应用实例
@@ -20,7 +57,8 @@ app = FastAPI(
     description="博日科技AI服务中心",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # 添加CORS中间件
@@ -38,6 +76,12 @@ app.include_router(doc_router, prefix="", tags=["文档"])
 from src.api.ai.chat import ai_chat_router
 app.include_router(ai_chat_router, prefix="/v1", tags=["实现 Ai 聊天"])
 
+from src.api.ai.search import ai_search_router
+app.include_router(ai_search_router, prefix="/v1", tags=["文档检索"])
+
+from src.api.tasks import task_router
+app.include_router(task_router, prefix="/tasks", tags=["后台任务"])
+
 from src.api.demo import demo_router
 app.include_router(demo_router, prefix="/demo", tags=["Demo 示例"])
 
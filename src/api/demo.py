@@ -1,4 +1,8 @@
+import hashlib
+from typing import List, Union
+
 from fastapi import APIRouter, Request
+from pydantic import BaseModel
 
 from src.api.ApiModel import ApiResponse
 
@@ -24,3 +28,29 @@ async def post(request: Request):
     )
 
 
+class EmbeddingRequest(BaseModel):
+    model: str = "demo"
+    input: Union[str, List[str]]
+    dimensions: int = 64
+
+
+@demo_router.post("/v1/embeddings", tags=["Demo 示例"])
+async def embeddings(request: EmbeddingRequest):
+    """
+    OpenAI 兼容的向量化桩接口：按文本哈希生成确定性的单位向量，用于本地联调（EMBED_URL 指向 /demo/v1）
+    """
+    texts = [request.input] if isinstance(request.input, str) else request.input
+    data = []
+    for index, text in enumerate(texts):
+        digest = b""
+        while len(digest) < request.dimensions:
+            digest += hashlib.sha256(digest + text.encode("utf-8")).digest()
+        vector = [(b - 127.5) / 127.5 for b in digest[:request.dimensions]]
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        data.append({"object": "embedding", "index": index, "embedding": [v / norm for v in vector]})
+    return {
+        "object": "list",
+        "data": data,
+        "model": request.model,
+        "usage": {"prompt_tokens": sum(len(t) for t in texts), "total_tokens": sum(len(t) for t in texts)}
+    }
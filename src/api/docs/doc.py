@@ -1,25 +1,36 @@
 import asyncio
+import json
+import sqlite3
+import time
 import urllib
-from fastapi import APIRouter
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple, Union
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, field_validator
 
 #项目库
 from src.config import config
-from src.utils.sqlite_utils import SQLiteUtils
+from src.services.db_services import database
 from src.api.ApiModel import ApiResponse
-from src.services.file_services import vectorize_document_by_uid
-from src.services.exec_services import run_async
+from src.services.file_services import ingest_pool, blob_store, job_scheduler, wake_ingest
+from src.services.ai.embedding import embedding_service
+from src.services.ai.retrieval import retriever
+from src.services.notifier import notification_dispatcher
+from src.services.exec_services import task_manager
+from src.services.doc_events import FINAL_STATUSES, document_events
 
 doc_router = APIRouter()
 
 @doc_router.get("/docVector", response_model=ApiResponse, tags=["文件向量化"])
 async def docVector(docid: str, filename: str, filesize: str, downloadUrl: str, finishUrl: str):
     # 向数据库中插入文件信息
-    db = SQLiteUtils(config.DB_PATH)
+    db = database()
     # 对 downloadUrl 进行URL解码
     _downloadUrl = urllib.parse.unquote(downloadUrl)
     _finishUrl = urllib.parse.unquote(finishUrl)
     # 根据docid查询文件是否存在
-    file = db.fetchone("SELECT * FROM documents WHERE UID=?", (docid,))
+    file = await db.fetchone("SELECT * FROM documents WHERE UID=?", (docid,))
     if file:
         return ApiResponse(
             success=False,
@@ -27,11 +38,20 @@ async def docVector(docid: str, filename: str, filesize: str, downloadUrl: str,
             data={}
         )
     #插入文件信息
-    db.execute("INSERT INTO documents (UID, title, download_url, finish_url, status, file_size) VALUES (?, ?, ?, ?, ?, ?)"
-        , (docid, filename, _downloadUrl, _finishUrl, "init", filesize))
+    try:
+        await db.execute("INSERT INTO documents (UID, title, download_url, finish_url, status, file_size) VALUES (?, ?, ?, ?, ?, ?)"
+            , (docid, filename, _downloadUrl, _finishUrl, "init", filesize))
+    except sqlite3.IntegrityError:
+        # 并发重复登记由 UID 唯一索引拦截
+        return ApiResponse(
+            success=False,
+            message="文件已存在，请勿重复上传",
+            data={}
+        )
     
-    #向量化服务发送请求
-    run_async(vectorize_document_by_uid, docid)
+    #唤醒文档处理线程认领新文档
+    document_events().publish(docid, "init", None, 0)
+    wake_ingest()
     
     """文件向量化"""
     return ApiResponse(
@@ -41,6 +61,329 @@ async def docVector(docid: str, filename: str, filesize: str, downloadUrl: str,
     )
 
 
+class DocRegistration(BaseModel):
+    docid: str = Field(..., min_length=1)
+    filename: str
+    filesize: Union[int, str] = ""
+    downloadUrl: str = Field(..., min_length=1)
+    finishUrl: str = ""
+
+    @field_validator("docid", mode="before")
+    @classmethod
+    def _docid_to_str(cls, value: Any) -> Any:
+        # 与 filesize 一样接受 JSON 中的数字
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        return value
+
+
+def _parse_line(line: bytes) -> Tuple[Any, Optional[str]]:
+    try:
+        return json.loads(line), None
+    except ValueError:
+        return None, "JSON 解析失败"
+
+
+async def _iter_batch_items(request: Request):
+    """
+    逐条读取批量登记的请求体，产出 (item, error)：application/x-ndjson 按行流式解析，
+    解析失败的行单独返回错误，不影响其它行；其余按 JSON 数组解析，请求体不超过 DOC_BATCH_MAX_BYTES
+    """
+    limit = config.DOC_BATCH_MAX_BYTES
+    if "ndjson" in (request.headers.get("content-type") or ""):
+        buffer = b""
+        async for data in request.stream():
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield _parse_line(line)
+            if len(buffer) > limit:
+                raise ValueError(f"单行超过 {limit} 字节")
+        if buffer.strip():
+            yield _parse_line(buffer)
+        return
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > limit:
+        raise ValueError(f"请求体超过 {limit} 字节")
+    body = bytearray()
+    async for data in request.stream():
+        body += data
+        if len(body) > limit:
+            raise ValueError(f"请求体超过 {limit} 字节")
+    items = json.loads(body)
+    if not isinstance(items, list):
+        raise ValueError("请求体应为 JSON 数组")
+    for item in items:
+        yield item, None
+
+
+def _insert_batch(conn: sqlite3.Connection, rows: List[Tuple[Any, ...]]) -> set:
+    """
+    在一个事务中批量插入，返回实际插入的 UID（并发登记的重复 UID 由唯一索引忽略）
+    """
+    last_id = conn.execute("SELECT coalesce(max(id), 0) FROM documents").fetchone()[0]
+    before = conn.total_changes
+    conn.executemany(
+        """INSERT INTO documents (UID, title, download_url, finish_url, status, file_size) VALUES (?, ?, ?, ?, 'init', ?)
+        ON CONFLICT(UID) DO NOTHING""",
+        rows
+    )
+    if conn.total_changes - before == len(rows):
+        return {row[0] for row in rows}
+    return {row[0] for row in conn.execute("SELECT UID FROM documents WHERE id>?", (last_id,)).fetchall()}
+
+
+@doc_router.post("/docVector/batch", response_model=ApiResponse, tags=["文件向量化"])
+async def docVectorBatch(request: Request):
+    """
+    批量登记文档：请求体为 JSON 数组或 NDJSON（每行一个对象），字段与 /docVector 相同（URL 无需编码）
+    校验后用一次索引查询排除已存在的 UID，在一个事务中批量插入，再统一唤醒处理线程，返回每条的登记结果
+    """
+    db = database()
+    results: List[Dict[str, Any]] = []
+    pending: Dict[str, Tuple[int, DocRegistration]] = {}
+    try:
+        async for item, error in _iter_batch_items(request):
+            index = len(results)
+            if index >= config.DOC_BATCH_MAX:
+                raise ValueError(f"单次最多登记 {config.DOC_BATCH_MAX} 个文档")
+            result: Dict[str, Any] = {"index": index, "docid": item.get("docid") if isinstance(item, dict) else None}
+            results.append(result)
+            if error is not None:
+                result.update(success=False, message=error)
+                continue
+            try:
+                doc = DocRegistration(**item) if isinstance(item, dict) else DocRegistration.model_validate(item)
+            except ValidationError as e:
+                result.update(success=False, message="参数错误: " + "; ".join(
+                    f"{'.'.join(str(loc) for loc in error['loc'])} {error['msg']}" for error in e.errors()))
+                continue
+            result["docid"] = doc.docid
+            if doc.docid in pending:
+                result.update(success=False, message="批次内 UID 重复")
+                continue
+            pending[doc.docid] = (index, doc)
+    except ValueError as e:
+        # json.JSONDecodeError 也是 ValueError
+        return ApiResponse(
+            success=False,
+            message=f"请求体解析失败: {str(e)}",
+            data={}
+        )
+
+    if pending:
+        # 一次查询排除已存在的 UID（json_each 展开参数列表，走 UID 唯一索引）
+        existing = {row["UID"] for row in await db.fetchall(
+            "SELECT UID FROM documents WHERE UID IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(pending), ensure_ascii=False),)
+        )}
+        rows = [
+            (doc.docid, doc.filename, doc.downloadUrl, doc.finishUrl, doc.filesize)
+            for uid, (_, doc) in pending.items() if uid not in existing
+        ]
+        inserted = await db.write(lambda conn: _insert_batch(conn, rows)) if rows else set()
+        for uid, (index, _) in pending.items():
+            if uid in inserted:
+                results[index].update(success=True, message="文件向量化调用成功")
+            else:
+                results[index].update(success=False, message="文件已存在，请勿重复上传")
+        if inserted:
+            #唤醒文档处理线程认领新文档
+            for uid in inserted:
+                document_events().publish(uid, "init", None, 0)
+            wake_ingest()
+
+    accepted = sum(1 for result in results if result["success"])
+    return ApiResponse(
+        success=accepted > 0 or not results,
+        message=f"登记 {len(results)} 个文档，成功 {accepted} 个",
+        data={"total": len(results), "accepted": accepted, "rejected": len(results) - accepted, "results": results}
+    )
+
+
+# 状态查询返回的字段
+STATUS_COLUMNS = "UID AS docid, title, status, status_message AS message, attempts, next_run_at, created_at, updated_at"
+# 状态流去重时记住的文档状态数（订阅全部文档时）
+STREAM_KNOWN_MAX = 10000
+# 状态流每次查询数据库的最大行数，超过时立即查询下一页
+STREAM_POLL_PAGE = 1000
+
+
+async def _fetch_status(uids: List[str], since: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    按 UID 批量查询文档状态（json_each 展开参数列表，走 UID 唯一索引），
+    since 只返回变更序号大于它的文档（结果带 change_seq）
+    """
+    sql = f"SELECT {STATUS_COLUMNS} FROM documents WHERE UID IN (SELECT value FROM json_each(?))"
+    params: Tuple[Any, ...] = (json.dumps(uids, ensure_ascii=False),)
+    if since is not None:
+        sql = sql.replace(" FROM", ", change_seq FROM", 1) + " AND change_seq>?"
+        params += (since,)
+    return await database().fetchall(sql, params)
+
+
+@doc_router.get("/docStatus", response_model=ApiResponse, tags=["文件向量化"])
+async def docStatus(docid: str):
+    """
+    查询文档的处理状态：init 待处理（next_run_at 为失败重试时间），doing 处理中，ok 完成，failed 失败
+    """
+    file = await database().fetchone(f"SELECT {STATUS_COLUMNS} FROM documents WHERE UID=?", (docid,))
+    if not file:
+        return ApiResponse(
+            success=False,
+            message="文件不存在",
+            data={}
+        )
+    return ApiResponse(
+        success=True,
+        message="查询成功",
+        data=file
+    )
+
+
+class DocStatusRequest(BaseModel):
+    docids: List[str] = Field(..., min_length=1)
+
+
+@doc_router.post("/docStatus/batch", response_model=ApiResponse, tags=["文件向量化"])
+async def docStatusBatch(request: DocStatusRequest):
+    """
+    批量查询文档的处理状态，一次查询返回全部结果，不存在的 UID 列在 missing 中
+    """
+    if len(request.docids) > config.DOC_BATCH_MAX:
+        return ApiResponse(
+            success=False,
+            message=f"单次最多查询 {config.DOC_BATCH_MAX} 个文档",
+            data={}
+        )
+    uids = list(dict.fromkeys(request.docids))
+    found = {row["docid"]: row for row in await _fetch_status(uids)}
+    return ApiResponse(
+        success=True,
+        message="查询成功",
+        data={
+            "total": len(uids),
+            "found": len(found),
+            "missing": [uid for uid in uids if uid not in found],
+            "documents": [found[uid] for uid in uids if uid in found],
+        }
+    )
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _status_stream(request: Request, uids: Optional[List[str]]) -> AsyncGenerator[str, None]:
+    """
+    文档状态流：先发送订阅文档的当前状态，再推送进程内的状态变更事件，
+    并定期按变更序号分页查询数据库补上其它进程中的变更；同一文档的相同状态只发送一次，
+    指定 docid 时所有文档到达最终状态（ok/failed）后发送 end 事件并结束
+    """
+    db = database()
+    # 先订阅再查询当前状态，查询期间发生的变更不会丢失
+    subscription = document_events().subscribe(uids)
+    try:
+        since = (await db.fetchone("SELECT coalesce(max(change_seq), 0) AS seq FROM documents"))["seq"]
+        known: "OrderedDict[str, Tuple[str, Any]]" = OrderedDict()
+        pending = None
+        updates: List[Dict[str, Any]] = []
+        if uids:
+            updates = await _fetch_status(uids)
+            found = {row["docid"] for row in updates}
+            for uid in uids:
+                if uid not in found:
+                    yield _sse("error", {"docid": uid, "message": "文件不存在"})
+            pending = found
+        last_poll = last_sent = time.monotonic()
+        while pending is None or pending:
+            for update in updates:
+                state = (update["status"], update["attempts"])
+                if known.get(update["docid"]) == state:
+                    continue
+                known[update["docid"]] = state
+                known.move_to_end(update["docid"])
+                if len(known) > STREAM_KNOWN_MAX:
+                    known.popitem(last=False)
+                yield _sse("status", {key: update[key] for key in ("docid", "status", "message", "attempts")})
+                last_sent = time.monotonic()
+                if pending is not None and update["status"] in FINAL_STATUSES:
+                    pending.discard(update["docid"])
+            if pending is not None and not pending:
+                break
+            updates = []
+            wait = min(last_poll + config.DOC_STATUS_POLL_INTERVAL, last_sent + config.DOC_STATUS_HEARTBEAT) - time.monotonic()
+            event = await subscription.get(max(wait, 0))
+            if event is not None:
+                updates.append(event)
+                # 一次取出已到达的全部事件
+                while not subscription.queue.empty():
+                    updates.append(subscription.queue.get_nowait())
+            if time.monotonic() - last_poll >= config.DOC_STATUS_POLL_INTERVAL:
+                last_poll = time.monotonic()
+                if uids:
+                    rows = await _fetch_status(list(pending), since)
+                else:
+                    rows = await db.fetchall(
+                        f"SELECT {STATUS_COLUMNS}, change_seq FROM documents WHERE change_seq>? ORDER BY change_seq LIMIT ?",
+                        (since, STREAM_POLL_PAGE)
+                    )
+                    if len(rows) >= STREAM_POLL_PAGE:
+                        # 还有下一页，下一轮立即继续查询
+                        last_poll = 0.0
+                if rows:
+                    since = max(row["change_seq"] for row in rows)
+                updates.extend(rows)
+            if not updates and time.monotonic() - last_sent >= config.DOC_STATUS_HEARTBEAT:
+                if await request.is_disconnected():
+                    break
+                yield ": ping\n\n"
+                last_sent = time.monotonic()
+        if uids:
+            yield _sse("end", {"docids": uids})
+    finally:
+        document_events().unsubscribe(subscription)
+
+
+@doc_router.get("/docStatus/stream", tags=["文件向量化"])
+async def docStatusStream(request: Request, docid: Optional[List[str]] = Query(None)):
+    """
+    文档状态变更的 SSE 流（EventSource）：docid 可重复指定，不指定时推送全部文档的状态变更
+    事件：status（docid、status、message、attempts），error（文件不存在），end（指定的文档全部处理结束）
+    """
+    uids = list(dict.fromkeys(docid)) if docid else None
+    if uids and len(uids) > config.DOC_BATCH_MAX:
+        return ApiResponse(
+            success=False,
+            message=f"单次最多订阅 {config.DOC_BATCH_MAX} 个文档",
+            data={}
+        )
+    return StreamingResponse(
+        _status_stream(request, uids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "X-Accel-Buffering": "no"}
+    )
+
+
+@doc_router.get("/docQueue", response_model=ApiResponse, tags=["文件向量化"])
+async def docQueue():
+    """文档处理队列的吞吐和深度指标，以及内容寻址存储的去重统计、向量化和检索统计、完成通知的积压和投递耗时、定时任务调度状态、后台任务池占用、状态流订阅"""
+    stats = await asyncio.to_thread(ingest_pool().stats)
+    stats["store"] = await asyncio.to_thread(blob_store().stats)
+    stats["embedding"] = embedding_service().stats()
+    stats["vectors"] = retriever().stats()
+    stats["notifications"] = await notification_dispatcher().stats()
+    stats["scheduler"] = job_scheduler().stats()
+    stats["tasks"] = task_manager().stats()
+    stats["status_stream"] = document_events().stats()
+    return ApiResponse(
+        success=True,
+        message="查询成功",
+        data=stats
+    )
+
+
 @doc_router.get("/finish", response_model=ApiResponse, tags=["路由测试"])
 async def finish(success: bool, message: str):
     return ApiResponse(
@@ -0,0 +1,40 @@
+from typing import Optional
+from fastapi import APIRouter
+
+#项目库
+from src.api.ApiModel import ApiResponse
+from src.services.exec_services import task_manager
+
+task_router = APIRouter()
+
+
+@task_router.get("", response_model=ApiResponse, tags=["后台任务"])
+async def list_tasks(status: Optional[str] = None, kind: Optional[str] = None, limit: int = 100):
+    """
+    最近的后台任务（新的在前）和任务池统计，可按状态（queued/running/done/failed/cancelled/rejected）和类型（io/cpu）过滤
+    """
+    manager = task_manager()
+    return ApiResponse(
+        success=True,
+        message="查询成功",
+        data={"stats": manager.stats(), "tasks": manager.list(status, kind, max(min(limit, 1000), 1))}
+    )
+
+
+@task_router.get("/{task_id}", response_model=ApiResponse, tags=["后台任务"])
+async def get_task(task_id: str):
+    """
+    查询任务状态，失败的任务包含异常信息和堆栈
+    """
+    task = task_manager().get(task_id)
+    if task is None:
+        return ApiResponse(
+            success=False,
+            message="任务不存在或记录已过期",
+            data={}
+        )
+    return ApiResponse(
+        success=True,
+        message="查询成功",
+        data=task.to_dict(with_traceback=True)
+    )
@@ -6,6 +6,8 @@ class Config:
         "DB_PATH",
         os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "db", "sqlite.db")
     )
+    DB_READ_THREADS = int(os.environ.get("DB_READ_THREADS", 4)) # 异步数据库访问的读线程数
+    DB_WRITE_BATCH = int(os.environ.get("DB_WRITE_BATCH", 64)) # 单个事务合并提交的最大写操作数
 
     # 日志配置
     LOG_LEVEL = os.environ.get("LOG_LEVEL", "info") # 日志级别 默认info 可选debug info warning error critical
@@ -21,13 +23,131 @@ class Config:
 
     # 文件路径
     DOC_PATH = os.environ.get("DOC_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "docs"))
+    BLOB_PATH = os.environ.get("BLOB_PATH", os.path.join(DOC_PATH, "objects")) # 内容寻址存储目录，文件按 md5 分片存放
+    BLOB_GC_GRACE = float(os.environ.get("BLOB_GC_GRACE", 86400)) # 引用计数为 0 的文件保留时长（秒），超过后清理
+
+    # 文件下载配置
+    DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", 1024 * 1024)) # 流式下载每次读取的字节数
+    DOWNLOAD_CONNECT_TIMEOUT = float(os.environ.get("DOWNLOAD_CONNECT_TIMEOUT", 10)) # 建连超时（秒）
+    DOWNLOAD_READ_TIMEOUT = float(os.environ.get("DOWNLOAD_READ_TIMEOUT", 60)) # 读超时（秒，两次收到数据的最大间隔）
+    DOWNLOAD_MAX_CONNECTIONS = int(os.environ.get("DOWNLOAD_MAX_CONNECTIONS", 20)) # 下载连接池最大连接数
+    DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", 3)) # 网络中断后断点续传的次数
+
+    # 文档解析分块配置
+    CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 500)) # 分块最大字符数
+    CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", 50)) # 相邻分块重叠的最大字符数（按完整句子重叠）
+    PARSE_PROCESSES = int(os.environ.get("PARSE_PROCESSES", 2)) # 解析进程数，0 表示在处理线程中直接解析
+
+    # 后台任务配置
+    TASK_IO_WORKERS = int(os.environ.get("TASK_IO_WORKERS", 16)) # io 线程池（文件下载等）线程数
+    TASK_IO_QUEUE = int(os.environ.get("TASK_IO_QUEUE", 256)) # io 线程池最多排队的任务数
+    TASK_CPU_QUEUE = int(os.environ.get("TASK_CPU_QUEUE", 64)) # cpu 进程池（文档解析，进程数为 PARSE_PROCESSES）最多排队的任务数
+    TASK_REJECT_POLICY = os.environ.get("TASK_REJECT_POLICY", "reject") # 队列满时的拒绝策略：reject 拒绝、block 等待、caller_runs 在提交线程中执行
+    TASK_HISTORY = int(os.environ.get("TASK_HISTORY", 1000)) # 保留的已结束任务记录数
+
+    # 向量检索配置
+    VECTOR_PATH = os.environ.get("VECTOR_PATH", os.path.join(os.path.dirname(DB_PATH), "vectors")) # 本地向量库目录
+    VECTOR_METRIC = os.environ.get("VECTOR_METRIC", "cosine") # 相似度：cosine 或 ip（内积）
+    VECTOR_SEGMENT_ROWS = int(os.environ.get("VECTOR_SEGMENT_ROWS", 262144)) # 每个向量段文件的最大行数
+    VECTOR_IVF_MIN_ROWS = int(os.environ.get("VECTOR_IVF_MIN_ROWS", 100000)) # 向量数达到该值后构建 IVF 索引，之前全量检索
+    VECTOR_NPROBE = int(os.environ.get("VECTOR_NPROBE", 16)) # IVF 查询扫描的簇数，越大召回率越高、越慢
+    SEARCH_TOP_K = int(os.environ.get("SEARCH_TOP_K", 5)) # 默认返回的分块数
+
+    # 文档向量化任务队列配置
+    INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 4)) # 并发处理文档的工作线程数
+    INGEST_LEASE_SECONDS = float(os.environ.get("INGEST_LEASE_SECONDS", 600)) # 认领租约时长（秒），超时未完成视为工作线程崩溃，文档重新入队
+    INGEST_MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", 5)) # 最大尝试次数，超过后标记为 failed
+    INGEST_RETRY_BASE = float(os.environ.get("INGEST_RETRY_BASE", 30)) # 失败重试的初始退避时间（秒），每次翻倍
+    INGEST_RETRY_MAX = float(os.environ.get("INGEST_RETRY_MAX", 3600)) # 退避时间上限（秒）
+    INGEST_POLL_INTERVAL = float(os.environ.get("INGEST_POLL_INTERVAL", 5)) # 工作线程异常后的等待间隔（秒）
+    INGEST_DRAIN_TIMEOUT = float(os.environ.get("INGEST_DRAIN_TIMEOUT", 60)) # 关闭时等待处理中文档完成的最长时间（秒）
+    DOC_BATCH_MAX = int(os.environ.get("DOC_BATCH_MAX", 10000)) # 批量登记接口单次最多登记的文档数
+    DOC_BATCH_MAX_BYTES = int(os.environ.get("DOC_BATCH_MAX_BYTES", 16 * 1024 * 1024)) # 批量登记接口 JSON 数组请求体（NDJSON 为单行）的最大字节数
+    DOC_EVENTS_QUEUE = int(os.environ.get("DOC_EVENTS_QUEUE", 1000)) # 每个状态流订阅者缓存的事件数，满时丢弃最旧的事件
+    DOC_STATUS_POLL_INTERVAL = float(os.environ.get("DOC_STATUS_POLL_INTERVAL", 5)) # 状态流查询数据库兜底的间隔（秒），补上其它进程中的状态变更
+    DOC_STATUS_HEARTBEAT = float(os.environ.get("DOC_STATUS_HEARTBEAT", 15)) # 状态流无事件时发送心跳的间隔（秒）
+
+    # 定时任务调度配置（多进程时只有持有主节点锁的进程执行）
+    SCHEDULER_LOCK_TTL = float(os.environ.get("SCHEDULER_LOCK_TTL", 30)) # 主节点锁租约（秒），主节点退出后其它进程最迟在此时间后接管
+    SCHEDULER_POLL_MIN = float(os.environ.get("SCHEDULER_POLL_MIN", 1)) # 队列有待处理文档时的轮询间隔（秒）
+    SCHEDULER_POLL_MAX = float(os.environ.get("SCHEDULER_POLL_MAX", 60)) # 队列持续为空时轮询间隔逐步加倍的上限（秒）
+    BLOB_GC_INTERVAL = float(os.environ.get("BLOB_GC_INTERVAL", 3600)) # 清理无引用文件的间隔（秒）
+
+    # 完成通知（finish_url 回调）配置
+    NOTIFY_CONCURRENCY = int(os.environ.get("NOTIFY_CONCURRENCY", 32)) # 同时进行的回调请求总数
+    NOTIFY_PER_HOST = int(os.environ.get("NOTIFY_PER_HOST", 4)) # 同一主机同时进行的回调请求数
+    NOTIFY_BATCH_SIZE = int(os.environ.get("NOTIFY_BATCH_SIZE", 100)) # 每轮从发件箱认领的通知数
+    NOTIFY_TIMEOUT = float(os.environ.get("NOTIFY_TIMEOUT", 10)) # 单次回调超时（秒）
+    NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", 10)) # 最大投递次数，超过后标记为 dead
+    NOTIFY_RETRY_BASE = float(os.environ.get("NOTIFY_RETRY_BASE", 5)) # 重试初始退避时间（秒），每次翻倍并加随机抖动
+    NOTIFY_RETRY_MAX = float(os.environ.get("NOTIFY_RETRY_MAX", 1800)) # 退避时间上限（秒）
+    NOTIFY_POLL_INTERVAL = float(os.environ.get("NOTIFY_POLL_INTERVAL", 5)) # 发件箱为空时的轮询间隔（秒）
+    NOTIFY_RETENTION = float(os.environ.get("NOTIFY_RETENTION", 7 * 86400)) # 已投递通知的保留时长（秒）
 
     # vLLM 配置
     #AI_URL = os.environ.get("AI_URL", "http://ds.kaoxve.com:9999/v1")
     AI_URL = os.environ.get("AI_URL", "http://192.168.222.210:8000/v1")
     AI_MODEL = os.environ.get("AI_MODEL", "Qwen3-32B")
     AI_KEY = os.environ.get("AI_KEY", "bori-qwen3-2012")
-   
+    AI_MAX_CONCURRENCY = int(os.environ.get("AI_MAX_CONCURRENCY", 32)) # 单个 worker 同时发往 vLLM 的非流式请求上限
+    AI_TIMEOUT = float(os.environ.get("AI_TIMEOUT", 300)) # 单次非流式请求超时时间（秒）
+
+    # vLLM 连接池配置
+    AI_MAX_CONNECTIONS = int(os.environ.get("AI_MAX_CONNECTIONS", 100)) # 最大连接数
+    AI_MAX_KEEPALIVE = int(os.environ.get("AI_MAX_KEEPALIVE", 20)) # 最大保活连接数
+    AI_KEEPALIVE_EXPIRY = float(os.environ.get("AI_KEEPALIVE_EXPIRY", 60)) # 保活连接空闲过期时间（秒）
+    AI_CONNECT_TIMEOUT = float(os.environ.get("AI_CONNECT_TIMEOUT", 5)) # 建连超时（秒）
+    AI_READ_TIMEOUT = float(os.environ.get("AI_READ_TIMEOUT", 120)) # 读超时（秒）
+    AI_HTTP2 = os.environ.get("AI_HTTP2", "false").lower() == "true" # 是否启用 HTTP/2，需要安装 h2（uv sync --extra http2）
+    AI_CONNECT_RETRIES = int(os.environ.get("AI_CONNECT_RETRIES", 3)) # 建连失败重试次数
+    AI_MAX_RETRIES = int(os.environ.get("AI_MAX_RETRIES", 2)) # 请求失败重试次数（指数退避）
+
+    # vLLM 多实例配置
+    AI_BACKENDS = os.environ.get("AI_BACKENDS", "") # 格式：url|model|weight|key，多个实例逗号分隔；为空时使用 AI_URL
+    AI_LB_POLICY = os.environ.get("AI_LB_POLICY", "least_outstanding") # 负载均衡策略：least_outstanding / weighted_round_robin
+    AI_EJECT_ERRORS = int(os.environ.get("AI_EJECT_ERRORS", 3)) # 连续失败多少次后摘除实例
+    AI_EJECT_SECONDS = float(os.environ.get("AI_EJECT_SECONDS", 30)) # 摘除时长（秒），到期后重新探测
+
+    # 聊天响应缓存配置（仅缓存 temperature=0 的请求）
+    AI_CACHE_ENABLED = os.environ.get("AI_CACHE_ENABLED", "true").lower() == "true"
+    AI_CACHE_MAX_ENTRIES = int(os.environ.get("AI_CACHE_MAX_ENTRIES", 1024)) # 内存缓存条数
+    AI_CACHE_TTL = float(os.environ.get("AI_CACHE_TTL", 3600)) # 缓存有效期（秒）
+    AI_CACHE_PERSIST = os.environ.get("AI_CACHE_PERSIST", "false").lower() == "true" # 是否启用 SQLite 持久化缓存
+    AI_CACHE_DB_PATH = os.environ.get("AI_CACHE_DB_PATH", os.path.join(os.path.dirname(DB_PATH), "ai_cache.db"))
+    AI_CACHE_MAX_ROWS = int(os.environ.get("AI_CACHE_MAX_ROWS", 100000)) # 持久化缓存最大条数
+    AI_SINGLE_FLIGHT = os.environ.get("AI_SINGLE_FLIGHT", "true").lower() == "true" # 合并并发的相同确定性请求
+    AI_MAX_N = int(os.environ.get("AI_MAX_N", 8)) # 单次请求最多生成的 choice 数
+    AI_STREAM_COALESCE_MS = float(os.environ.get("AI_STREAM_COALESCE_MS", 0)) # 流式输出合并小块的最长等待（毫秒），0 表示不合并
+    AI_STREAM_COALESCE_CHARS = int(os.environ.get("AI_STREAM_COALESCE_CHARS", 32)) # 合并后单帧最多字符数
+    AI_STREAM_HEARTBEAT = float(os.environ.get("AI_STREAM_HEARTBEAT", 15)) # 流式输出空闲多少秒后发送心跳帧
+
+    # 聊天接口准入控制配置
+    AI_ADMISSION_MAX_INFLIGHT = int(os.environ.get("AI_ADMISSION_MAX_INFLIGHT", 64)) # 单个 worker 最大在途请求数（含流式）
+    AI_ADMISSION_MAX_QUEUE = int(os.environ.get("AI_ADMISSION_MAX_QUEUE", 256)) # 最大排队请求数
+    AI_ADMISSION_MAX_WAIT = float(os.environ.get("AI_ADMISSION_MAX_WAIT", 10)) # 最长排队等待（秒），预计超过时直接返回 429
+    AI_RATE_LIMIT = float(os.environ.get("AI_RATE_LIMIT", 0)) # 每个 API Key 每秒请求数，0 表示不限流
+    AI_RATE_BURST = float(os.environ.get("AI_RATE_BURST", 20)) # 每个 API Key 允许的突发请求数
+    AI_RATE_MAX_KEYS = int(os.environ.get("AI_RATE_MAX_KEYS", 10000)) # 最多保留的限流令牌桶数（按 API Key），超出时淘汰最久未使用的
+
+    # token 计数配置
+    AI_TOKENIZER_PATH = os.environ.get("AI_TOKENIZER_PATH", "") # 模型 tokenizer.json 本地路径，为空时估算
+    AI_TOKENIZER_CACHE_SIZE = int(os.environ.get("AI_TOKENIZER_CACHE_SIZE", 4096)) # 系统提示词计数缓存条数
+    AI_PREFIX_CACHE_BLOCK = int(os.environ.get("AI_PREFIX_CACHE_BLOCK", 16)) # vLLM 前缀缓存块大小（token）
+
+    # 向量化（OpenAI 兼容 /v1/embeddings）配置
+    EMBED_URL = os.environ.get("EMBED_URL", AI_URL) # 向量化服务地址，测试时可指向 http://127.0.0.1:8000/demo/v1
+    EMBED_MODEL = os.environ.get("EMBED_MODEL", "bge-m3")
+    EMBED_KEY = os.environ.get("EMBED_KEY", AI_KEY)
+    EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 64)) # 单次请求最多合并的文本数
+    EMBED_FLUSH_MS = float(os.environ.get("EMBED_FLUSH_MS", 20)) # 批次未满时最长等待时间（毫秒）
+    EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", 4)) # 并发请求数
+
+    # 检索增强（聊天请求携带 ids 时按文档检索）配置
+    RAG_TOP_K = int(os.environ.get("RAG_TOP_K", 5)) # 每次检索的分块数
+    RAG_CONTEXT_TOKENS = int(os.environ.get("RAG_CONTEXT_TOKENS", 2000)) # 注入提示词的参考资料最大 token 数
+    RAG_CACHE_SIZE = int(os.environ.get("RAG_CACHE_SIZE", 1024)) # 检索结果缓存条数，0 表示不缓存
+    RAG_CACHE_TTL = float(os.environ.get("RAG_CACHE_TTL", 300)) # 检索结果缓存有效期（秒）
+
     # 其它自定义配置可在此添加
 
 config = Config()
@@ -1,16 +1,42 @@
+import logging
 import os
+import sqlite3
 import sys
+import time
+from typing import Callable, List, Tuple
 #项目包
 from src.config import config
 from src.utils.sqlite_utils import SQLiteUtils
 
+logger = logging.getLogger(__name__)
 
 DB_PATH = config.DB_PATH
 
-def init_db():
-    db = SQLiteUtils(DB_PATH)
-    # 创建文档表
-    db.execute("""
+# 待处理状态的过滤条件：部分索引 idx_documents_pending 只收录这些行，
+# SQLite 只有在查询条件中原样包含该条件时才会使用部分索引，查询待处理文档时请拼接此条件
+PENDING_STATUSES = ("init", "doing")
+PENDING_FILTER = "status IN ('init', 'doing')"
+# 完成通知发件箱中待投递的通知，对应部分索引 idx_notifications_pending
+OUTBOX_PENDING_FILTER = "status='pending'"
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """
+    列不存在时才添加（旧库可能已手工加过）
+    """
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _v1_documents(conn: sqlite3.Connection):
+    """
+    创建文档表
+    """
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS documents (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             UID varchar(255) NOT NULL,
@@ -26,7 +52,256 @@ def init_db():
             hash_code varchar(256)
         )
     """)
-    print("数据库初始化完成，文档表已创建。")
+
+
+def _v2_documents_state(conn: sqlite3.Connection):
+    """
+    状态机字段和索引：失败信息、尝试次数、租约到期时间（时间戳），UID 唯一索引，待处理状态部分索引
+    """
+    _add_column(conn, "documents", "status_message", "TEXT")
+    _add_column(conn, "documents", "attempts", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "documents", "lease_until", "REAL")
+    # 旧数据中重复登记的 UID 只保留最早的一条，与 /docVector 拒绝重复登记的语义一致；
+    # 其余记录（含 local_path、hash_code）原样移入 documents_duplicates 备查，不直接删除
+    duplicates = "SELECT * FROM documents WHERE id NOT IN (SELECT min(id) FROM documents GROUP BY UID)"
+    conn.execute("CREATE TABLE IF NOT EXISTS documents_duplicates AS SELECT * FROM documents WHERE 0")
+    moved = conn.execute(f"INSERT INTO documents_duplicates {duplicates}").rowcount
+    if moved:
+        conn.execute("DELETE FROM documents WHERE id IN (SELECT id FROM documents_duplicates)")
+        logger.warning(f"{moved} 条 UID 重复的文档记录已移入 documents_duplicates 表")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_documents_uid ON documents(UID)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_documents_pending ON documents(status, id) WHERE {PENDING_FILTER}")
+
+
+def _v3_documents_queue(conn: sqlite3.Connection):
+    """
+    任务队列字段：下次可执行时间（失败退避，时间戳）、认领者
+    """
+    _add_column(conn, "documents", "next_run_at", "REAL")
+    _add_column(conn, "documents", "claimed_by", "TEXT")
+
+
+def _v4_blobs(conn: sqlite3.Connection):
+    """
+    内容寻址存储：按 md5 记录文件大小、引用计数、是否已向量化及复用次数
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash_code varchar(64) PRIMARY KEY,
+            file_size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            vectorized INTEGER NOT NULL DEFAULT 0,
+            reuse_count INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT (datetime('now', 'localtime')),
+            updated_at REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents(hash_code)")
+
+
+def _v5_doc_chunks(conn: sqlite3.Connection):
+    """
+    文档分块：按文件 hash 存储，相同内容的文档共享分块
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS doc_chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            hash_code varchar(64) NOT NULL,
+            seq INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            UNIQUE (hash_code, seq)
+        )
+    """)
+
+
+def _v6_embeddings(conn: sqlite3.Connection):
+    """
+    向量缓存：按模型和分块文本哈希存储 float32 向量，分块通过 text_hash 关联
+    """
+    _add_column(conn, "doc_chunks", "text_hash", "varchar(64)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            model varchar(255) NOT NULL,
+            text_hash varchar(64) NOT NULL,
+            dim INTEGER NOT NULL,
+            vector BLOB NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (model, text_hash)
+        )
+    """)
+
+
+def _v7_notifications(conn: sqlite3.Connection):
+    """
+    完成通知发件箱：通知先落库再异步投递，失败按退避重试
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doc_id INTEGER,
+            url TEXT NOT NULL,
+            params TEXT,
+            host varchar(255) NOT NULL,
+            status varchar(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_run_at REAL NOT NULL,
+            lease_until REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            sent_at REAL
+        )
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_notifications_pending ON notifications(next_run_at) WHERE {OUTBOX_PENDING_FILTER}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_status ON notifications(status, created_at)")
+
+
+def _v8_leader_locks(conn: sqlite3.Connection):
+    """
+    主节点锁：多进程部署时只有持有锁的进程执行定时任务，锁按租约续期，进程退出后由其它进程接管
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS leader_locks (
+            name varchar(100) PRIMARY KEY,
+            owner varchar(255) NOT NULL,
+            expires_at REAL NOT NULL,
+            acquired_at REAL NOT NULL
+        )
+    """)
+
+
+def _v9_documents_updated(conn: sqlite3.Connection):
+    """
+    文档更新时间索引：状态流按 updated_at 查询最近变更的文档（多进程部署时兜底轮询）
+    """
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_updated ON documents(updated_at)")
+
+
+def _v10_documents_change_seq(conn: sqlite3.Connection):
+    """
+    文档变更序号：登记或状态、尝试次数、状态信息变化时由触发器取当前最大序号加一，
+    写入串行执行，序号按提交顺序单调递增，状态流按序号分页查询变更（替代一秒精度的 updated_at）
+    """
+    _add_column(conn, "documents", "change_seq", "INTEGER")
+    conn.execute("UPDATE documents SET change_seq=id WHERE change_seq IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_change ON documents(change_seq)")
+    conn.execute("DROP INDEX IF EXISTS idx_documents_updated")
+    next_seq = "(SELECT coalesce(max(change_seq), 0) + 1 FROM documents)"
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS documents_change_insert AFTER INSERT ON documents
+        BEGIN
+            UPDATE documents SET change_seq={next_seq} WHERE id=NEW.id;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS documents_change_update AFTER UPDATE OF status, attempts, status_message ON documents
+        BEGIN
+            UPDATE documents SET change_seq={next_seq} WHERE id=NEW.id;
+        END
+    """)
+
+
+# 版本号 -> 迁移函数，版本号记录在 PRAGMA user_version 中，只能追加不能修改已发布的迁移
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Connection], None]]] = [
+    (1, _v1_documents),
+    (2, _v2_documents_state),
+    (3, _v3_documents_queue),
+    (4, _v4_blobs),
+    (5, _v5_doc_chunks),
+    (6, _v6_embeddings),
+    (7, _v7_notifications),
+    (8, _v8_leader_locks),
+    (9, _v9_documents_updated),
+    (10, _v10_documents_change_seq),
+]
+
+
+def schema_version(db: SQLiteUtils) -> int:
+    return db.fetchone("PRAGMA user_version")["user_version"]
+
+
+def migrate(db: SQLiteUtils, target: int = None) -> int:
+    """
+    依次执行未应用的迁移，每个迁移和版本号更新在同一个事务中完成，返回迁移后的版本号
+    """
+    target = MIGRATIONS[-1][0] if target is None else target
+    version = schema_version(db)
+    for number, migration in MIGRATIONS:
+        if number <= version or number > target:
+            continue
+        with db.transaction() as conn:
+            # 多进程同时启动时，拿到写锁后再确认一次版本
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version={number}")
+        logger.info(f"数据库迁移到版本 {number}: {migration.__doc__.strip()}")
+        version = number
+    return version
+
+
+def init_db(db_path: str = None):
+    db = SQLiteUtils(db_path or DB_PATH)
+    version = migrate(db)
+    print(f"数据库初始化完成，当前版本: {version}")
+
+
+def benchmark(db_path: str, rows: int = 1000000, pending: int = 1000, samples: int = 200):
+    """
+    在 rows 行数据上对比迁移前后按 UID 查询、扫描待处理文档、认领一批待处理文档的耗时
+    待处理文档位于表尾（最新登记），其余为已完成
+    """
+    import random
+
+    db = SQLiteUtils(db_path)
+    migrate(db, target=1)
+    start = time.perf_counter()
+    db.executemany(
+        "INSERT INTO documents (UID, title, status) VALUES (?, ?, ?)",
+        ((f"doc-{i}", f"文档{i}.pdf", "init" if i >= rows - pending else "ok") for i in range(rows))
+    )
+    print(f"写入 {rows} 行: {time.perf_counter() - start:.1f}s")
+
+    def _measure(name: str, func: Callable[[int], None], count: int):
+        start = time.perf_counter()
+        for i in range(count):
+            func(i)
+        print(f"  {name}: {(time.perf_counter() - start) / count * 1000:.3f} ms/次")
+
+    uids = [f"doc-{random.randrange(rows)}" for _ in range(samples)]
+
+    def _lookup(i: int):
+        db.fetchone("SELECT * FROM documents WHERE UID=?", (uids[i],))
+
+    def _scan(i: int):
+        db.fetchall(f"SELECT id FROM documents WHERE {PENDING_FILTER} AND status='init' LIMIT 100")
+
+    print("迁移前:")
+    _measure("按 UID 查询", _lookup, 20)
+    _measure("扫描待处理文档", _scan, 20)
+
+    start = time.perf_counter()
+    migrate(db)
+    print(f"迁移到最新版本: {time.perf_counter() - start:.1f}s")
+
+    def _claim(i: int):
+        db.fetchall(
+            f"""UPDATE documents SET status='doing', attempts=attempts+1, lease_until=?
+            WHERE id IN (SELECT id FROM documents WHERE {PENDING_FILTER} AND status='init' ORDER BY id LIMIT 10)
+            RETURNING id""",
+            (time.time() + 300,)
+        )
+
+    print("迁移后:")
+    _measure("按 UID 查询", _lookup, samples)
+    _measure("扫描待处理文档", _scan, samples)
+    _measure("认领 10 个待处理文档", _claim, min(samples, pending // 10))
+    db.close()
+
 
 if __name__ == "__main__":
-    init_db()
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        import tempfile
+        benchmark(os.path.join(tempfile.mkdtemp(), "bench.db"), rows=int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    else:
+        init_db()
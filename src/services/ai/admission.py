@@ -0,0 +1,157 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+#项目库
+from src.config import config
+
+logger = logging.getLogger(__name__)
+
+# 优先级：数值越小越优先
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class AdmissionRejected(Exception):
+    """
+    请求被准入控制拒绝（限流或排队超时），retry_after 为建议的重试等待秒数
+    """
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+
+
+class TokenBucket:
+    """
+    令牌桶：以 rate 个/秒的速度补充，最多积累 capacity 个
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        取一个令牌，成功返回 0，否则返回需要等待的秒数
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    聊天接口准入控制：限制在途请求数，超出时按优先级排队，预计等待超过期限时直接拒绝；按 API Key 令牌桶限流，
+    最多保留 max_keys 个令牌桶，超出时淘汰最久未使用的（闲置足够久的桶已补满，淘汰后重建不影响限流）
+    """
+    def __init__(self, max_inflight: int, max_queue: int, max_wait: float, rate: float = 0, burst: float = 1,
+                 max_keys: int = 10000):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.inflight = 0
+        self.avg_service_time = 1.0 # 单个请求平均占用时长（秒，指数滑动平均）
+        self.rejected = 0
+        self._waiters: List[tuple] = []
+        self._counter = itertools.count()
+        self.max_keys = max(max_keys, 1)
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def check_rate(self, key: str):
+        """
+        按 API Key 限流，超出时抛出 AdmissionRejected
+        """
+        if self.rate <= 0:
+            return
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        wait = bucket.take()
+        if wait > 0:
+            self.rejected += 1
+            raise AdmissionRejected("请求过于频繁，请稍后重试", wait)
+
+    def _estimate_wait(self, priority: int) -> float:
+        """
+        估算排队等待时间：排在前面（同级或更高优先级）的请求数 × 平均占用时长 / 并发数
+        """
+        ahead = sum(1 for waiter in self._waiters if waiter[0] <= priority and not waiter[2].done())
+        return (ahead + 1) * self.avg_service_time / self.max_inflight
+
+    async def acquire(self, priority: str = "normal"):
+        level = PRIORITIES.get(priority, PRIORITIES["normal"])
+        if self.inflight < self.max_inflight and not self._waiters:
+            self.inflight += 1
+            return
+        estimate = self._estimate_wait(level)
+        if len(self._waiters) >= self.max_queue or estimate > self.max_wait:
+            self.rejected += 1
+            raise AdmissionRejected("服务繁忙，请稍后重试", estimate)
+        future = asyncio.get_running_loop().create_future()
+        waiter = (level, next(self._counter), future)
+        heapq.heappush(self._waiters, waiter)
+        try:
+            # 被唤醒时名额已由 release 转交
+            await asyncio.wait_for(future, self.max_wait)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 名额已转交但调用方已放弃（如客户端断开），归还名额
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise AdmissionRejected("排队等待超时，请稍后重试", self.avg_service_time)
+            raise
+
+    def release(self, duration: Optional[float] = None):
+        if duration is not None:
+            self.avg_service_time += 0.2 * (duration - self.avg_service_time)
+        # 名额直接转交给优先级最高的等待者
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.inflight -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "normal"):
+        await self.acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    @classmethod
+    def from_config(cls) -> "AdmissionController":
+        return cls(
+            max_inflight=config.AI_ADMISSION_MAX_INFLIGHT,
+            max_queue=config.AI_ADMISSION_MAX_QUEUE,
+            max_wait=config.AI_ADMISSION_MAX_WAIT,
+            rate=config.AI_RATE_LIMIT,
+            burst=config.AI_RATE_BURST,
+            max_keys=config.AI_RATE_MAX_KEYS
+        )
+
+
+# 全局准入控制实例
+admission = AdmissionController.from_config()
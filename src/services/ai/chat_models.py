@@ -13,6 +13,7 @@ class ChatCompletionRequest(BaseModel):
     top_p: Optional[float] = 1.0
     n: Optional[int] = 1
     stream: Optional[bool] = False
+    stream_options: Optional[Dict[str, Any]] = None # {"include_usage": true} 时在流末尾返回用量
     stop: Optional[List[str]] = None
     max_tokens: Optional[int] = None
     presence_penalty: Optional[float] = 0.0
@@ -1,24 +1,47 @@
 import os
+import asyncio
 import json
 import logging
 import datetime
+import time
 import uuid
-from typing import AsyncGenerator, Dict, List, Optional, Any
+from typing import AsyncGenerator, Awaitable, Dict, List, Optional, Any
 from pydantic import BaseModel
 
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.outputs import LLMResult
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_openai import ChatOpenAI
 
 #项目库
 from src.config import config
 from src.services.ai.chat_models import ChatCompletionChoice, ChatCompletionRequest, ChatCompletionResponse, ChatMessage
-from src.services.ai.llm import llm
+from src.services.ai.llm import llm_pool
+from src.services.ai.response_cache import ResponseCache
+from src.services.ai.singleflight import SingleFlight
+from src.services.ai.tokenizer import usage_calculator
+from src.services.ai.sse import DONE, ChunkEncoder, coalesce
+from src.services.ai.rag import RetrievedContext, rag_service
 
 logger = logging.getLogger(__name__)
 
 
 class AIService:
+    def __init__(self, max_concurrency: int = config.AI_MAX_CONCURRENCY):
+        # 限制同时进行的上游非流式请求数
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # 确定性请求的响应缓存
+        self.cache = ResponseCache.from_config()
+        # 合并并发的相同确定性请求
+        self.single_flight = SingleFlight() if config.AI_SINGLE_FLIGHT else None
+        # 流式请求中止统计
+        self.stream_stats = {
+            "aborted": 0, # 因客户端断开而中止的上游流数
+            "aborted_generated_tokens": 0, # 中止前已生成的 token 数
+            "saved_tokens": 0, # 预计节省的 token 数
+            "avg_completion_tokens": 0.0 # 正常结束的流平均输出 token 数
+        }
+    
     def _convert_messages_to_langchain(self, messages: List[ChatMessage]) -> List:
         """
         将 OpenAI 格式的消息转换为 LangChain 格式
@@ -44,24 +67,93 @@ class AIService:
             content=content
         )
     
-    def _calculate_usage(self, messages: List[ChatMessage], response_content: str) -> Dict[str, int]:
+    def _calculate_usage(self, request: ChatCompletionRequest, completions: List[str], response_cached: bool = False) -> Dict[str, Any]:
         """
-        计算 token 使用量（简化版本）
+        计算 token 使用量（使用分词器计数，未配置分词器时估算），completions 为每个 choice 的输出
         """
-        # 这里是一个简化的 token 计算，实际项目中可能需要更精确的计算
-        prompt_tokens = sum(len(msg.content.split()) for msg in messages)
-        completion_tokens = len(response_content.split())
-        total_tokens = prompt_tokens + completion_tokens
-        
-        return {
-            "prompt_tokens": prompt_tokens,
-            "completion_tokens": completion_tokens,
-            "total_tokens": total_tokens
+        usage = usage_calculator().usage(request.messages, completions, response_cached)
+        logger.debug(
+            f"token 用量 user={request.user} model={request.model} prompt={usage['prompt_tokens']} "
+            f"completion={usage['completion_tokens']} cached={usage['prompt_tokens_details']['cached_tokens']}"
+        )
+        return usage
+    
+    def _build_generation_kwargs(self, request: ChatCompletionRequest) -> Dict[str, Any]:
+        """
+        构建生成参数
+        """
+        generation_kwargs = {
+            "temperature": request.temperature,
+            "top_p": request.top_p,
+            "max_tokens": request.max_tokens,
+            "stop": request.stop or None,
+            "presence_penalty": request.presence_penalty,
+            "frequency_penalty": request.frequency_penalty,
+            "logit_bias": request.logit_bias,
         }
+        
+        # 移除 None 值
+        return {k: v for k, v in generation_kwargs.items() if v is not None}
+    
+    def _build_response(self, request: ChatCompletionRequest, outputs: List[Dict[str, Any]], response_cached: bool = False) -> ChatCompletionResponse:
+        """
+        根据模型输出构建 OpenAI 格式的响应，outputs 为每个 choice 的 {"content", "finish_reason"}
+        """
+        choices = [
+            ChatCompletionChoice(
+                index=index,
+                message=self._convert_langchain_to_openai_format(output["content"]),
+                finish_reason=output["finish_reason"] or "stop"
+            )
+            for index, output in enumerate(outputs)
+        ]
+        
+        # 计算使用量
+        usage = self._calculate_usage(request, [output["content"] for output in outputs], response_cached)
+        
+        return ChatCompletionResponse(
+            id=f"chatcmpl-{uuid.uuid4().hex}",
+            created=int(datetime.datetime.now().timestamp()),
+            model=request.model,
+            choices=choices,
+            usage=usage
+        )
+    
+    def _outputs_from_result(self, result: LLMResult) -> List[Dict[str, Any]]:
+        """
+        从 LangChain 生成结果中提取每个 choice 的内容和结束原因
+        """
+        return [
+            {
+                "content": generation.message.content,
+                "finish_reason": (generation.generation_info or {}).get("finish_reason") or "stop"
+            }
+            for generation in result.generations[0]
+        ]
+    
+    def _request_key(self, request: ChatCompletionRequest) -> Optional[str]:
+        """
+        确定性请求返回用于缓存和请求合并的键，否则返回 None
+        """
+        if not ResponseCache.cacheable(request):
+            return None
+        return ResponseCache.make_key(request)
+    
+    async def _apply_context(self, request: ChatCompletionRequest, context: Optional[Awaitable[RetrievedContext]],
+                             timings: Optional[Dict[str, float]] = None) -> ChatCompletionRequest:
+        """
+        等待检索结果（由接口层在校验前启动）并注入参考资料，返回用于生成的请求
+        """
+        if context is None:
+            return request
+        retrieved = await context
+        if timings is not None:
+            timings["retrieve"] = retrieved.seconds
+        return rag_service.augment(request, retrieved)
     
     def chat_completion(self, request: ChatCompletionRequest) -> ChatCompletionResponse:
         """
-        执行聊天完成请求（非流式）
+        执行聊天完成请求（非流式，同步阻塞，仅供脚本等非事件循环场景使用）
         """
         try:
             # 验证请求
@@ -71,152 +163,286 @@ class AIService:
             langchain_messages = self._convert_messages_to_langchain(request.messages)
             
             # 设置生成参数
-            generation_kwargs = {
-                "temperature": request.temperature,
-                # "max_new_tokens": request.max_tokens or 2048,
-                "top_p": request.top_p,
-                #"repetition_penalty": 1.0 + request.frequency_penalty
-            }
+            generation_kwargs = self._build_generation_kwargs(request)
+            
+            # 查询缓存
+            request_key = self._request_key(request)
+            if request_key and self.cache:
+                cached = self.cache.get(request_key)
+                if cached:
+                    return self._build_response(request, cached["choices"], response_cached=True)
             
-            # 移除 None 值
-            generation_kwargs = {k: v for k, v in generation_kwargs.items() if v is not None}
+            def _complete() -> List[Dict[str, Any]]:
+                # 调用 vLLM，n>1 时由上游一次生成多个 choice
+                result = llm_pool().invoke(
+                    request.model,
+                    lambda client: client.generate([langchain_messages], n=request.n, **generation_kwargs)
+                )
+                outputs = self._outputs_from_result(result)
+                if request_key and self.cache:
+                    self.cache.set(request_key, {"choices": outputs})
+                return outputs
             
-            # 调用 vLLM
-            response = llm().invoke(langchain_messages, **generation_kwargs)
+            # 相同的并发请求只调用一次上游
+            if request_key and self.single_flight:
+                outputs = self.single_flight.do_sync(request_key, _complete)
+            else:
+                outputs = _complete()
             
             # 构建响应
-            assistant_message = self._convert_langchain_to_openai_format(response.content)
+            return self._build_response(request, outputs)
             
-            choice = ChatCompletionChoice(
-                index=0,
-                message=assistant_message,
-                finish_reason="stop"
-            )
+        except Exception as e:
+            logger.error(f"AI 服务调用失败: {str(e)}")
+            raise e
+    
+    async def achat_completion(self, request: ChatCompletionRequest, context: Optional[Awaitable[RetrievedContext]] = None,
+                               timings: Optional[Dict[str, float]] = None) -> ChatCompletionResponse:
+        """
+        执行聊天完成请求（非流式，异步）
+        通过信号量限制同时发往 vLLM 的请求数，并为每个请求设置超时，避免阻塞事件循环
+        context 为已启动的检索任务（携带 ids 时），timings 用于返回各阶段耗时（秒）
+        """
+        try:
+            # 验证请求（检索已在后台并行进行）
+            self._validate_request(request)
             
-            # 计算使用量
-            usage = self._calculate_usage(request.messages, response.content)
+            # 注入检索到的参考资料
+            request = await self._apply_context(request, context, timings)
+            generate_start = time.perf_counter()
             
-            return ChatCompletionResponse(
-                id=f"chatcmpl-{uuid.uuid4().hex}",
-                created=int(datetime.datetime.now().timestamp()),
-                model=request.model,
-                choices=[choice],
-                usage=usage
-            )
+            # 转换消息格式
+            langchain_messages = self._convert_messages_to_langchain(request.messages)
+            
+            # 设置生成参数
+            generation_kwargs = self._build_generation_kwargs(request)
+            
+            # 查询缓存
+            request_key = self._request_key(request)
+            if request_key and self.cache:
+                cached = await self.cache.aget(request_key)
+                if cached:
+                    if timings is not None:
+                        timings["generate"] = time.perf_counter() - generate_start
+                    return self._build_response(request, cached["choices"], response_cached=True)
             
+            async def _complete() -> List[Dict[str, Any]]:
+                # 调用 vLLM（按模型路由，实例故障时自动切换），n>1 时由上游一次生成多个 choice
+                async with self._semaphore:
+                    result = await llm_pool().ainvoke(
+                        request.model,
+                        lambda client: asyncio.wait_for(
+                            client.agenerate([langchain_messages], n=request.n, **generation_kwargs),
+                            timeout=config.AI_TIMEOUT
+                        )
+                    )
+                outputs = self._outputs_from_result(result)
+                if request_key and self.cache:
+                    await self.cache.aset(request_key, {"choices": outputs})
+                return outputs
+            
+            # 相同的并发请求只调用一次上游
+            if request_key and self.single_flight:
+                outputs = await self.single_flight.do(request_key, _complete)
+            else:
+                outputs = await _complete()
+            if timings is not None:
+                timings["generate"] = time.perf_counter() - generate_start
+            
+            # 构建响应
+            return self._build_response(request, outputs)
+            
+        except asyncio.TimeoutError:
+            logger.error(f"AI 服务调用超时: 超过 {config.AI_TIMEOUT} 秒")
+            raise
         except Exception as e:
             logger.error(f"AI 服务调用失败: {str(e)}")
             raise e
     
-    async def chat_completion_stream(self, request: ChatCompletionRequest) -> AsyncGenerator[str, None]:
+    async def _astream_choice(self, index: int, model: str, langchain_messages: List,
+                              generation_kwargs: Dict[str, Any]) -> AsyncGenerator[tuple, None]:
+        """
+        流式调用 vLLM 生成单个 choice，逐块返回 (index, 文本, 结束原因)
+        """
+        async for chunk in llm_pool().astream(
+            model,
+            lambda client: client.astream(langchain_messages, **generation_kwargs)
+        ):
+            finish_reason = chunk.response_metadata.get("finish_reason")
+            if chunk.content or finish_reason:
+                yield index, chunk.content, finish_reason
+    
+    async def _merge_streams(self, streams: List[AsyncGenerator]) -> AsyncGenerator[tuple, None]:
+        """
+        并发消费多个流，按到达顺序合并输出
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+        
+        async def _pump(stream):
+            try:
+                async for item in stream:
+                    await queue.put(item)
+                await queue.put(finished)
+            except Exception as e:
+                await queue.put(e)
+        
+        tasks = [asyncio.create_task(_pump(stream)) for stream in streams]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                item = await queue.get()
+                if item is finished:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def _astream_content(self, request: ChatCompletionRequest, langchain_messages: List, generation_kwargs: Dict[str, Any],
+                               request_key: Optional[str] = None) -> AsyncGenerator[tuple, None]:
+        """
+        流式调用 vLLM，逐块返回 (index, 文本, 结束原因)，完整结束后写入缓存
+        LangChain 的流式接口只解析第一个 choice，n>1 时改为并发发起 n 个流再合并
+        """
+        if request.n > 1:
+            source = self._merge_streams([
+                self._astream_choice(index, request.model, langchain_messages, generation_kwargs)
+                for index in range(request.n)
+            ])
+        else:
+            source = self._astream_choice(0, request.model, langchain_messages, generation_kwargs)
+        
+        outputs = [{"content": "", "finish_reason": None} for _ in range(request.n)]
+        try:
+            async for index, content, finish_reason in source:
+                outputs[index]["content"] += content
+                if finish_reason:
+                    outputs[index]["finish_reason"] = finish_reason
+                yield index, content, finish_reason
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端已断开（或所有合并的订阅者都已离开），关闭上游请求以中止生成
+            await source.aclose()
+            self._record_stream_abort(request, outputs)
+            raise
+        self._record_stream_complete(outputs)
+        if request_key and self.cache:
+            await self.cache.aset(request_key, {"choices": outputs})
+    
+    def _record_stream_complete(self, outputs: List[Dict[str, Any]]):
+        """
+        记录正常结束的流式输出长度（指数滑动平均），用于估算中止时节省的 token
+        """
+        counter = usage_calculator()
+        for output in outputs:
+            tokens = counter.count(output["content"])
+            self.stream_stats["avg_completion_tokens"] += 0.1 * (tokens - self.stream_stats["avg_completion_tokens"])
+    
+    def _record_stream_abort(self, request: ChatCompletionRequest, outputs: List[Dict[str, Any]]):
         """
-        执行流式聊天完成请求
+        记录被中止的上游流：已生成的 token 数，以及按平均输出长度（不超过 max_tokens）估算的节省 token 数
         """
+        counter = usage_calculator()
+        expected = self.stream_stats["avg_completion_tokens"]
+        if request.max_tokens:
+            expected = min(expected, request.max_tokens) if expected else request.max_tokens
+        generated = saved = 0
+        for output in outputs:
+            if output["finish_reason"]:
+                continue
+            tokens = counter.count(output["content"])
+            generated += tokens
+            saved += max(int(expected) - tokens, 0)
+        self.stream_stats["aborted"] += 1
+        self.stream_stats["aborted_generated_tokens"] += generated
+        self.stream_stats["saved_tokens"] += saved
+        logger.info(f"客户端断开，已中止上游生成: user={request.user} 已生成 {generated} token，预计节省 {saved} token")
+    
+    async def _replay(self, cached: Dict[str, Any]) -> AsyncGenerator[tuple, None]:
+        """
+        以流式块的形式回放缓存的响应
+        """
+        for index, output in enumerate(cached["choices"]):
+            yield index, output["content"], output["finish_reason"] or "stop"
+    
+    async def chat_completion_stream(self, request: ChatCompletionRequest,
+                                     context: Optional[Awaitable[RetrievedContext]] = None) -> AsyncGenerator[str, None]:
+        """
+        执行流式聊天完成请求，context 为已启动的检索任务（携带 ids 时）
+        """
+        # 生成响应 ID，固定字段由编码器一次性序列化
+        encoder = ChunkEncoder(
+            f"chatcmpl-{uuid.uuid4().hex}",
+            int(datetime.datetime.now().timestamp()),
+            request.model
+        )
         try:
             # 验证请求
             self._validate_request(request)
             
+            # 注入检索到的参考资料
+            request = await self._apply_context(request, context)
+            
             # 转换消息格式
             langchain_messages = self._convert_messages_to_langchain(request.messages)
             
             # 设置生成参数
-            generation_kwargs = {
-                "temperature": request.temperature,
-                #"max_new_tokens": request.max_tokens or 2048,
-                "top_p": request.top_p,
-                #"repetition_penalty": 1.0 + request.frequency_penalty
-            }
+            generation_kwargs = self._build_generation_kwargs(request)
             
-            # 移除 None 值
-            generation_kwargs = {k: v for k, v in generation_kwargs.items() if v is not None}
+            # 发送开始标记
+            for index in range(request.n):
+                yield encoder.role(index)
             
-            # 生成响应 ID
-            response_id = f"chatcmpl-{uuid.uuid4().hex}"
-            created_time = int(datetime.datetime.now().timestamp())
+            # 流式调用 vLLM，缓存命中时直接回放缓存内容，相同的并发请求共享同一个上游流
+            request_key = self._request_key(request)
+            cached = await self.cache.aget(request_key) if request_key and self.cache else None
+            if cached:
+                source = self._replay(cached)
+            elif request_key and self.single_flight:
+                source = self.single_flight.stream(
+                    request_key,
+                    lambda: self._astream_content(request, langchain_messages, generation_kwargs, request_key)
+                )
+            else:
+                source = self._astream_content(request, langchain_messages, generation_kwargs)
             
-            # 发送开始标记
-            start_chunk = {
-                "id": response_id,
-                "object": "chat.completion.chunk",
-                "created": created_time,
-                "model": request.model,
-                "choices": [
-                    {
-                        "index": 0,
-                        "delta": {
-                            "role": "assistant"
-                        },
-                        "finish_reason": None
-                    }
-                ]
-            }
-            yield f"data: {json.dumps(start_chunk)}\n\n"
-            
-            # 流式调用 vLLM
-            full_response = ""
-            async for chunk in llm().astream(langchain_messages, **generation_kwargs):
-                if chunk.content:
-                    full_response += chunk.content
-                    
+            # 按时间/大小合并相邻的小块，减少帧数
+            if config.AI_STREAM_COALESCE_MS > 0:
+                source = coalesce(source, config.AI_STREAM_COALESCE_CHARS, config.AI_STREAM_COALESCE_MS / 1000)
+            
+            completions = [""] * request.n
+            finished = [False] * request.n
+            async for index, content, finish_reason in source:
+                if content:
+                    completions[index] += content
                     # 发送内容块
-                    content_chunk = {
-                        "id": response_id,
-                        "object": "chat.completion.chunk",
-                        "created": created_time,
-                        "model": request.model,
-                        "choices": [
-                            {
-                                "index": 0,
-                                "delta": {
-                                    "content": chunk.content
-                                },
-                                "finish_reason": None
-                            }
-                        ]
-                    }
-                    yield f"data: {json.dumps(content_chunk)}\n\n"
+                    yield encoder.content(index, content)
+                if finish_reason:
+                    finished[index] = True
+                    # 发送结束标记
+                    yield encoder.finish(index, finish_reason)
             
-            # 发送结束标记
-            end_chunk = {
-                "id": response_id,
-                "object": "chat.completion.chunk",
-                "created": created_time,
-                "model": request.model,
-                "choices": [
-                    {
-                        "index": 0,
-                        "delta": {},
-                        "finish_reason": "stop"
-                    }
-                ]
-            }
-            yield f"data: {json.dumps(end_chunk)}\n\n"
+            # 上游未返回结束原因的 choice 补发结束标记
+            for index in range(request.n):
+                if not finished[index]:
+                    yield encoder.finish(index, "stop")
+            
+            # 统计用量，客户端要求时（stream_options.include_usage）单独发送用量块
+            usage = self._calculate_usage(request, completions, response_cached=cached is not None)
+            if request.stream_options and request.stream_options.get("include_usage"):
+                yield encoder.usage(usage)
             
             # 发送结束标记
-            yield "data: [DONE]\n\n"
+            yield DONE
             
         except Exception as e:
             logger.error(f"流式 AI 服务调用失败: {str(e)}")
             # 发送错误信息
-            error_chunk = {
-                "id": response_id if 'response_id' in locals() else f"chatcmpl-{uuid.uuid4().hex}",
-                "object": "chat.completion.chunk",
-                "created": created_time if 'created_time' in locals() else int(datetime.datetime.now().timestamp()),
-                "model": request.model,
-                "choices": [
-                    {
-                        "index": 0,
-                        "delta": {},
-                        "finish_reason": "error"
-                    }
-                ],
-                "error": {
-                    "message": str(e),
-                    "type": "server_error"
-                }
-            }
-            yield f"data: {json.dumps(error_chunk)}\n\n"
-            yield "data: [DONE]\n\n"
+            yield encoder.error(str(e))
+            yield DONE
     
     def _validate_request(self, request: ChatCompletionRequest) -> bool:
         """
@@ -242,6 +468,20 @@ class AIService:
         if request.top_p is not None and (request.top_p < 0 or request.top_p > 1):
             raise ValueError("top_p 必须在 0-1 之间")
         
+        if request.n is None or request.n < 1 or request.n > config.AI_MAX_N:
+            raise ValueError(f"n 必须在 1-{config.AI_MAX_N} 之间")
+        
+        if request.max_tokens is not None and request.max_tokens < 1:
+            raise ValueError("max_tokens 必须大于 0")
+        
+        if request.stop and len(request.stop) > 4:
+            raise ValueError("stop 最多支持 4 个")
+        
+        for name in ("presence_penalty", "frequency_penalty"):
+            value = getattr(request, name)
+            if value is not None and (value < -2 or value > 2):
+                raise ValueError(f"{name} 必须在 -2-2 之间")
+        
         return True
 
 # 创建全局 AI 服务实例
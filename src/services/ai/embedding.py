@@ -0,0 +1,268 @@
+import hashlib
+import logging
+import queue
+import threading
+import time
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+#项目库
+from src.config import config
+from src.services.ai.http_client import http_client
+from src.utils.sqlite_utils import SQLiteUtils
+
+logger = logging.getLogger(__name__)
+
+# 单条 SQL 中 IN 列表的最大参数个数（SQLite 默认上限 999）
+_SQL_IN_LIMIT = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def pack_vector(vector: Iterable[float]) -> bytes:
+    """
+    向量存储为 float32 二进制（每维 4 字节）
+    """
+    return array("f", vector).tobytes()
+
+
+def unpack_vector(blob: bytes) -> array:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector
+
+
+class EmbeddingClosed(RuntimeError):
+    """
+    向量化服务已关闭（应用关闭中），不再接收请求
+    """
+
+
+class EmbeddingBatcher:
+    """
+    跨文档合并 /v1/embeddings 请求：各处理线程提交的文本进入同一队列，
+    凑满 batch_size 条或最早一条等待超过 flush_ms 时发出一个批次，批次由 concurrency 个线程并发请求上游；
+    embed 最多等待 result_timeout 秒，关闭后未发出的文本以 EmbeddingClosed 失败
+    """
+    def __init__(self, url: str, model: str, api_key: str, batch_size: int = 64, flush_ms: float = 20, concurrency: int = 4,
+                 result_timeout: float = 300):
+        self.url = url.rstrip("/") + "/embeddings"
+        self.model = model
+        self.api_key = api_key
+        self.batch_size = max(batch_size, 1)
+        self.flush_delay = flush_ms / 1000
+        self.result_timeout = result_timeout
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._senders = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed")
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.requests = 0
+        self.texts = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._collect, name="embed-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._senders.submit(self._send, batch)
+            except RuntimeError:
+                # 发送线程池已关闭：批次中的文本直接失败，不让收集线程退出、等待方永远阻塞
+                self._abort(batch)
+
+    def _abort(self, batch: List[Tuple[str, Future]]):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(EmbeddingClosed("向量化服务已关闭"))
+
+    def _send(self, batch: List[Tuple[str, Future]]):
+        try:
+            response = http_client().post(
+                self.url,
+                json={"model": self.model, "input": [text for text, _ in batch]},
+                headers={"Authorization": f"Bearer {self.api_key}"}
+            )
+            response.raise_for_status()
+            data = sorted(response.json()["data"], key=lambda item: item["index"])
+            if len(data) != len(batch):
+                raise ValueError(f"向量数量不匹配：请求 {len(batch)} 条，返回 {len(data)} 条")
+            with self._lock:
+                self.requests += 1
+                self.texts += len(batch)
+            for (_, future), item in zip(batch, data):
+                future.set_result(item["embedding"])
+        except Exception as e:
+            logger.error(f"向量化请求失败（{len(batch)} 条）: {str(e)}")
+            for _, future in batch:
+                future.set_exception(e)
+
+    def submit(self, texts: List[str]) -> List[Future]:
+        if self._closed:
+            raise EmbeddingClosed("向量化服务已关闭")
+        self._ensure_started()
+        futures = []
+        for text in texts:
+            future: Future = Future()
+            self._queue.put((text, future))
+            futures.append(future)
+        return futures
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        futures = self.submit(texts)
+        deadline = time.monotonic() + self.result_timeout
+        try:
+            return [future.result(timeout=max(deadline - time.monotonic(), 0)) for future in futures]
+        except FutureTimeout:
+            raise TimeoutError(f"向量化等待超过 {self.result_timeout} 秒（{len(texts)} 条）") from None
+
+    def close(self):
+        """
+        停止接收请求，等待已发出的批次结束，队列中未发出的文本以 EmbeddingClosed 失败
+        """
+        self._closed = True
+        self._senders.shutdown(wait=True)
+        pending = []
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._abort(pending)
+
+
+class EmbeddingService:
+    """
+    文档分块向量化：按分块文本哈希查询 embedding_cache，只对未缓存的文本调用上游，
+    向量以 float32 二进制存入缓存表（分块通过 text_hash 关联向量）
+    """
+    def __init__(self, db: SQLiteUtils, batcher: EmbeddingBatcher, page_size: int = 256):
+        self.db = db
+        self.batcher = batcher
+        self.page_size = page_size
+        self.model = batcher.model
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _cached(self, hashes: List[str]) -> set:
+        found = set()
+        for start in range(0, len(hashes), _SQL_IN_LIMIT):
+            part = hashes[start:start + _SQL_IN_LIMIT]
+            rows = self.db.fetchall(
+                f"SELECT text_hash FROM embedding_cache WHERE model=? AND text_hash IN ({','.join('?' * len(part))})",
+                (self.model, *part)
+            )
+            found.update(row["text_hash"] for row in rows)
+        return found
+
+    def embed_missing(self, items: List[Tuple[str, str]]) -> int:
+        """
+        items 为 (text_hash, 文本)，对未缓存的文本请求向量并写入缓存，返回新向量化的条数
+        """
+        cached = self._cached(list({h for h, _ in items}))
+        missing: Dict[str, str] = {h: text for h, text in items if h not in cached}
+        self.cache_hits += len(items) - len(missing)
+        self.cache_misses += len(missing)
+        if not missing:
+            return 0
+        vectors = self.batcher.embed(list(missing.values()))
+        now = time.time()
+        self.db.executemany(
+            "INSERT OR REPLACE INTO embedding_cache (text_hash, model, dim, vector, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(h, self.model, len(vector), pack_vector(vector), now) for h, vector in zip(missing.keys(), vectors)]
+        )
+        return len(missing)
+
+    def embed_document(self, hash_code: str) -> Dict[str, int]:
+        """
+        对一个文件的全部分块向量化，按页读取分块，内存占用与文档大小无关
+        """
+        chunks = embedded = 0
+        last_seq = -1
+        while True:
+            rows = self.db.fetchall(
+                "SELECT seq, text_hash, content FROM doc_chunks WHERE hash_code=? AND seq>? ORDER BY seq LIMIT ?",
+                (hash_code, last_seq, self.page_size)
+            )
+            if not rows:
+                break
+            last_seq = rows[-1]["seq"]
+            chunks += len(rows)
+            embedded += self.embed_missing([(row["text_hash"], row["content"]) for row in rows])
+        return {"chunks": chunks, "embedded": embedded, "cached": chunks - embedded}
+
+    def embed_query(self, text: str) -> array:
+        """
+        查询文本向量化（走缓存）
+        """
+        h = text_hash(text)
+        self.embed_missing([(h, text)])
+        return self.get_vector(h)
+
+    def get_vector(self, h: str) -> Optional[array]:
+        row = self.db.fetchone("SELECT vector FROM embedding_cache WHERE model=? AND text_hash=?", (self.model, h))
+        return unpack_vector(row["vector"]) if row else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "requests": self.batcher.requests,
+            "embedded_texts": self.batcher.texts,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+        }
+
+    @classmethod
+    def from_config(cls, db: SQLiteUtils) -> "EmbeddingService":
+        batcher = EmbeddingBatcher(
+            url=config.EMBED_URL,
+            model=config.EMBED_MODEL,
+            api_key=config.EMBED_KEY,
+            batch_size=config.EMBED_BATCH_SIZE,
+            flush_ms=config.EMBED_FLUSH_MS,
+            concurrency=config.EMBED_CONCURRENCY,
+            # 排队等待前面的批次 + 本批次的建连和读取，按上游超时的两倍估算
+            result_timeout=2 * (config.AI_CONNECT_TIMEOUT + config.AI_READ_TIMEOUT)
+        )
+        return cls(db, batcher)
+
+
+_embedding_service: Optional[EmbeddingService] = None
+_embedding_closed = False
+_embedding_lock = threading.Lock()
+def embedding_service() -> EmbeddingService:
+    """
+    获取全局的向量化服务，关闭后抛出 EmbeddingClosed（不在关闭过程中重新创建）
+    """
+    global _embedding_service
+    with _embedding_lock:
+        if _embedding_closed:
+            raise EmbeddingClosed("向量化服务已关闭")
+        if _embedding_service is None:
+            _embedding_service = EmbeddingService.from_config(SQLiteUtils(config.DB_PATH))
+        return _embedding_service
+
+
+def close_embedding_service():
+    global _embedding_service, _embedding_closed
+    with _embedding_lock:
+        _embedding_closed = True
+        service, _embedding_service = _embedding_service, None
+    if service is not None:
+        service.batcher.close()
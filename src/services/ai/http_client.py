@@ -0,0 +1,108 @@
+import logging
+from typing import Optional
+
+import httpx
+
+#项目库
+from src.config import config
+
+logger = logging.getLogger(__name__)
+
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _limits() -> httpx.Limits:
+    """
+    连接池限制：最大连接数、最大保活连接数、保活过期时间
+    """
+    return httpx.Limits(
+        max_connections=config.AI_MAX_CONNECTIONS,
+        max_keepalive_connections=config.AI_MAX_KEEPALIVE,
+        keepalive_expiry=config.AI_KEEPALIVE_EXPIRY
+    )
+
+
+def http_timeout() -> httpx.Timeout:
+    """
+    上游请求超时：连接超时与读超时分开配置，读超时按单次读取计算（流式推理停顿也受其约束）
+    """
+    return httpx.Timeout(
+        connect=config.AI_CONNECT_TIMEOUT,
+        read=config.AI_READ_TIMEOUT,
+        write=config.AI_CONNECT_TIMEOUT,
+        pool=config.AI_CONNECT_TIMEOUT
+    )
+
+
+def _http2_enabled() -> bool:
+    """
+    是否启用 HTTP/2（需要安装 h2 包）
+    """
+    if not config.AI_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("未安装 h2 包（uv sync --extra http2），vLLM 客户端回退为 HTTP/1.1")
+        return False
+
+
+def http_client() -> httpx.Client:
+    """
+    获取共享的同步 HTTP 连接池
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.Client(
+            timeout=http_timeout(),
+            # 传输层仅对建连失败进行带退避的重试，HTTP 层的重试由 openai SDK 的 max_retries 负责
+            transport=httpx.HTTPTransport(
+                limits=_limits(),
+                http2=_http2_enabled(),
+                retries=config.AI_CONNECT_RETRIES
+            )
+        )
+        logger.info(f"vLLM 同步连接池已创建，最大连接数: {config.AI_MAX_CONNECTIONS}")
+    return _http_client
+
+
+def async_http_client() -> httpx.AsyncClient:
+    """
+    获取共享的异步 HTTP 连接池
+    """
+    global _async_http_client
+    if _async_http_client is None or _async_http_client.is_closed:
+        _async_http_client = httpx.AsyncClient(
+            timeout=http_timeout(),
+            transport=httpx.AsyncHTTPTransport(
+                limits=_limits(),
+                http2=_http2_enabled(),
+                retries=config.AI_CONNECT_RETRIES
+            )
+        )
+        logger.info(f"vLLM 异步连接池已创建，最大连接数: {config.AI_MAX_CONNECTIONS}")
+    return _async_http_client
+
+
+def open_http_clients():
+    """
+    应用启动时预先创建连接池
+    """
+    http_client()
+    async_http_client()
+
+
+async def close_http_clients():
+    """
+    应用关闭时释放连接池
+    """
+    global _http_client, _async_http_client
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+        _async_http_client = None
+    if _http_client is not None:
+        _http_client.close()
+        _http_client = None
+    logger.info("vLLM 连接池已关闭")
@@ -1,24 +1,44 @@
-
+from typing import Optional
 from langchain_openai import ChatOpenAI
 from src.config import config
+from src.services.ai.http_client import open_http_clients, close_http_clients
+from src.services.ai.llm_pool import LLMPool
 import logging
 
 logger = logging.getLogger(__name__)
 
-_llm = None
-def llm():
-    global _llm
-    if _llm is None:
+_llm_pool = None
+def llm_pool() -> LLMPool:
+    """
+    获取 vLLM 实例池
+    """
+    global _llm_pool
+    if _llm_pool is None:
         try:
-            _llm = ChatOpenAI(
-                base_url=config.AI_URL,
-                model=config.AI_MODEL,
-                api_key=config.AI_KEY
-            )
-            logger.info(f"vLLM 客户端初始化成功，模型: {config.AI_MODEL}")
+            _llm_pool = LLMPool.from_config()
+            logger.info(f"vLLM 实例池初始化成功，实例数: {len(_llm_pool.backends)}，模型: {_llm_pool.models()}")
         except Exception as e:
-            logger.error(f"vLLM 客户端初始化失败: {str(e)}")
+            logger.error(f"vLLM 实例池初始化失败: {str(e)}")
             raise e
-    return _llm
+    return _llm_pool
+
+def llm(model: Optional[str] = None) -> ChatOpenAI:
+    """
+    获取指定模型的一个 vLLM 客户端（不做在途统计和故障转移，业务调用请使用 llm_pool()）
+    """
+    return llm_pool().select(model).client
+
+def init_llm():
+    """
+    应用启动时创建连接池和 vLLM 实例池
+    """
+    open_http_clients()
+    llm_pool()
 
-    
+async def close_llm():
+    """
+    应用关闭时释放 vLLM 客户端和连接池
+    """
+    if _llm_pool is not None:
+        _llm_pool.reset_clients()
+    await close_http_clients()
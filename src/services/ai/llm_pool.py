@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncGenerator, Awaitable, Callable, Iterable, List, Optional
+
+import httpx
+import openai
+from langchain_openai import ChatOpenAI
+
+#项目库
+from src.config import config
+from src.services.ai.http_client import http_client, async_http_client, http_timeout
+
+logger = logging.getLogger(__name__)
+
+# 视为上游实例故障的异常：建连失败、超时、5xx、限流；其余（如 4xx 参数错误）直接抛给调用方，不做故障转移
+BACKEND_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+    openai.RateLimitError,
+    httpx.TransportError,
+    asyncio.TimeoutError,
+)
+
+
+def is_backend_error(e: BaseException) -> bool:
+    """
+    判断异常是否由上游实例故障引起
+    """
+    return isinstance(e, BACKEND_ERRORS)
+
+
+class LLMBackend:
+    """
+    单个 vLLM 上游实例，记录在途请求数和被动健康状态
+    """
+    def __init__(self, url: str, model: str, api_key: str = "", weight: int = 1):
+        self.url = url
+        self.model = model
+        self.api_key = api_key or config.AI_KEY
+        self.weight = max(int(weight), 1)
+        self.inflight = 0 # 在途请求数
+        self.consecutive_errors = 0 # 连续失败次数
+        self.ejected_until = 0.0 # 摘除截止时间，过期后放行请求进行重新探测
+        self.current_weight = 0 # 平滑加权轮询的当前权重
+        self._client: Optional[ChatOpenAI] = None
+
+    @property
+    def client(self) -> ChatOpenAI:
+        if self._client is None:
+            self._client = ChatOpenAI(
+                base_url=self.url,
+                model=self.model,
+                api_key=self.api_key,
+                timeout=http_timeout(),
+                max_retries=config.AI_MAX_RETRIES,
+                http_client=http_client(),
+                http_async_client=async_http_client()
+            )
+            logger.info(f"vLLM 客户端初始化成功，地址: {self.url}，模型: {self.model}")
+        return self._client
+
+    def reset_client(self):
+        self._client = None
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def __repr__(self) -> str:
+        return f"LLMBackend({self.url}, {self.model})"
+
+
+class LLMPool:
+    """
+    vLLM 多实例池：按模型路由，最少在途请求 / 平滑加权轮询选择实例，连续失败后摘除并定期重新探测
+    """
+    def __init__(self, backends: List[LLMBackend], policy: str = "least_outstanding",
+                 eject_errors: int = 3, eject_seconds: float = 30):
+        if not backends:
+            raise ValueError("vLLM 实例列表不能为空")
+        self.backends = backends
+        self.policy = policy
+        self.eject_errors = eject_errors
+        self.eject_seconds = eject_seconds
+        self.default_model = backends[0].model
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> "LLMPool":
+        """
+        从配置构建实例池，AI_BACKENDS 格式：url|model|weight|key，多个实例用逗号分隔，
+        未配置时使用 AI_URL / AI_MODEL / AI_KEY 作为唯一实例
+        """
+        backends = []
+        for item in filter(None, (s.strip() for s in config.AI_BACKENDS.split(","))):
+            parts = [p.strip() for p in item.split("|")]
+            url = parts[0]
+            model = parts[1] if len(parts) > 1 and parts[1] else config.AI_MODEL
+            weight = int(parts[2]) if len(parts) > 2 and parts[2] else 1
+            api_key = parts[3] if len(parts) > 3 else config.AI_KEY
+            backends.append(LLMBackend(url, model, api_key, weight))
+        if not backends:
+            backends.append(LLMBackend(config.AI_URL, config.AI_MODEL, config.AI_KEY))
+        return cls(backends, config.AI_LB_POLICY, config.AI_EJECT_ERRORS, config.AI_EJECT_SECONDS)
+
+    def models(self) -> List[str]:
+        """
+        实例池实际提供的模型列表
+        """
+        return list(dict.fromkeys(b.model for b in self.backends))
+
+    def _candidates(self, model: Optional[str]) -> List[LLMBackend]:
+        candidates = [b for b in self.backends if b.model == model]
+        if not candidates:
+            # 未知模型回退到默认模型，兼容客户端传入的任意模型名
+            candidates = [b for b in self.backends if b.model == self.default_model]
+        return candidates
+
+    def size(self, model: Optional[str] = None) -> int:
+        return len(self._candidates(model))
+
+    def select(self, model: Optional[str] = None, exclude: Iterable[LLMBackend] = ()) -> Optional[LLMBackend]:
+        """
+        为模型选择一个实例，exclude 为本次请求已失败的实例
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self._candidates(model) if b not in exclude]
+            if not candidates:
+                return None
+            healthy = [b for b in candidates if b.available(now)]
+            if not healthy:
+                # 全部被摘除时选择最早恢复的实例，避免直接拒绝服务
+                return min(candidates, key=lambda b: b.ejected_until)
+            if self.policy == "weighted_round_robin":
+                total = 0
+                for b in healthy:
+                    b.current_weight += b.weight
+                    total += b.weight
+                chosen = max(healthy, key=lambda b: b.current_weight)
+                chosen.current_weight -= total
+                return chosen
+            return min(healthy, key=lambda b: b.inflight / b.weight)
+
+    def record_success(self, backend: LLMBackend):
+        with self._lock:
+            if backend.consecutive_errors >= self.eject_errors:
+                logger.info(f"vLLM 实例已恢复: {backend.url}")
+            backend.consecutive_errors = 0
+            backend.ejected_until = 0.0
+
+    def record_failure(self, backend: LLMBackend):
+        with self._lock:
+            backend.consecutive_errors += 1
+            if backend.consecutive_errors >= self.eject_errors:
+                backend.ejected_until = time.monotonic() + self.eject_seconds
+                logger.warning(f"vLLM 实例连续失败 {backend.consecutive_errors} 次，摘除 {self.eject_seconds} 秒: {backend.url}")
+
+    @contextmanager
+    def track(self, backend: LLMBackend):
+        """
+        统计实例在途请求数
+        """
+        with self._lock:
+            backend.inflight += 1
+        try:
+            yield backend
+        finally:
+            with self._lock:
+                backend.inflight -= 1
+
+    def _next(self, model: Optional[str], tried: List[LLMBackend], error: Optional[BaseException]) -> LLMBackend:
+        backend = self.select(model, exclude=tried)
+        if backend is None:
+            raise error
+        if error is not None:
+            logger.warning(f"vLLM 调用失败，切换实例 {backend.url}: {str(error)}")
+        return backend
+
+    def invoke(self, model: Optional[str], call: Callable[[ChatOpenAI], Any]) -> Any:
+        """
+        同步调用，实例故障时切换到其它实例重试
+        """
+        tried, error = [], None
+        while True:
+            backend = self._next(model, tried, error)
+            with self.track(backend):
+                try:
+                    result = call(backend.client)
+                except Exception as e:
+                    if not is_backend_error(e):
+                        raise
+                    self.record_failure(backend)
+                    tried.append(backend)
+                    error = e
+                    continue
+            self.record_success(backend)
+            return result
+
+    async def ainvoke(self, model: Optional[str], call: Callable[[ChatOpenAI], Awaitable[Any]]) -> Any:
+        """
+        异步调用，实例故障时切换到其它实例重试
+        """
+        tried, error = [], None
+        while True:
+            backend = self._next(model, tried, error)
+            with self.track(backend):
+                try:
+                    result = await call(backend.client)
+                except Exception as e:
+                    if not is_backend_error(e):
+                        raise
+                    self.record_failure(backend)
+                    tried.append(backend)
+                    error = e
+                    continue
+            self.record_success(backend)
+            return result
+
+    async def astream(self, model: Optional[str], call: Callable[[ChatOpenAI], AsyncGenerator]) -> AsyncGenerator:
+        """
+        流式调用，仅在尚未输出任何内容前进行故障转移
+        """
+        tried, error = [], None
+        while True:
+            backend = self._next(model, tried, error)
+            started = False
+            with self.track(backend):
+                try:
+                    async for chunk in call(backend.client):
+                        started = True
+                        yield chunk
+                except Exception as e:
+                    if started or not is_backend_error(e):
+                        if is_backend_error(e):
+                            self.record_failure(backend)
+                        raise
+                    self.record_failure(backend)
+                    tried.append(backend)
+                    error = e
+                    continue
+            self.record_success(backend)
+            return
+
+    def reset_clients(self):
+        for backend in self.backends:
+            backend.reset_client()
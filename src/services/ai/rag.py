@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+#项目库
+from src.config import config
+from src.services.ai.chat_models import ChatCompletionRequest, ChatMessage
+from src.services.ai.retrieval import retriever
+from src.services.ai.tokenizer import usage_calculator
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_PROMPT = "请参考以下资料回答用户的问题，资料中没有相关内容时请如实说明。\n\n"
+
+
+class RetrievedContext(NamedTuple):
+    chunks: List[Dict[str, Any]]
+    seconds: float # 检索耗时
+    cached: bool # 是否命中检索缓存
+    error: Optional[str] = None # 检索失败时的错误信息（失败时按无参考资料继续生成）
+
+
+class RagService:
+    """
+    检索增强：聊天请求携带 ids（文档UID）时，以最后一条用户消息为查询在这些文档内检索 top-k 分块，
+    按 token 预算注入为系统消息；检索结果按 (查询, ids, 向量库版本) 缓存，文档重新向量化后自动失效
+    """
+    def __init__(self, top_k: int = 5, context_tokens: int = 2000, cache_size: int = 1024, cache_ttl: float = 300):
+        self.top_k = top_k
+        self.context_tokens = context_tokens
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def query_of(request: ChatCompletionRequest) -> Optional[str]:
+        for message in reversed(request.messages):
+            if message.role == "user" and message.content:
+                return message.content
+        return None
+
+    def _cache_key(self, query: str, ids: List[str]) -> tuple:
+        store = retriever().store
+        # 向量库的总行数和有效行数在写入或删除后都会变化，作为版本号使旧结果失效
+        return query, tuple(sorted(set(ids))), self.top_k, store.rows, len(store)
+
+    def _cache_get(self, key: tuple) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None:
+                return None
+            expires_at, chunks = item
+            if expires_at < time.time():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return chunks
+
+    def _cache_set(self, key: tuple, chunks: List[Dict[str, Any]]):
+        with self._lock:
+            self._cache[key] = (time.time() + self.cache_ttl, chunks)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    async def retrieve(self, query: str, ids: List[str]) -> RetrievedContext:
+        """
+        在指定文档内检索，失败时返回空结果和错误信息，不影响生成
+        """
+        start = time.perf_counter()
+        try:
+            key = self._cache_key(query, ids) if self.cache_size > 0 else None
+            chunks = self._cache_get(key) if key else None
+            if chunks is not None:
+                self.hits += 1
+                return RetrievedContext(chunks, time.perf_counter() - start, True)
+            self.misses += 1
+            # 查询向量化和向量计算都是阻塞操作，放到线程中执行
+            chunks = await asyncio.to_thread(retriever().search, query, self.top_k, ids)
+            if key:
+                self._cache_set(key, chunks)
+            return RetrievedContext(chunks, time.perf_counter() - start, False)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"文档检索失败，按无参考资料继续生成: {str(e)}")
+            return RetrievedContext([], time.perf_counter() - start, False, str(e))
+
+    def start(self, request: ChatCompletionRequest) -> Optional["asyncio.Task[RetrievedContext]"]:
+        """
+        请求携带 ids 时立即在后台开始检索，与请求校验、准入排队并行进行；不需要检索时返回 None
+        """
+        query = self.query_of(request)
+        if not request.ids or not query:
+            return None
+        return asyncio.create_task(self.retrieve(query, request.ids))
+
+    def augment(self, request: ChatCompletionRequest, context: RetrievedContext) -> ChatCompletionRequest:
+        """
+        把检索到的分块按相似度顺序加入参考资料，不超过 context_tokens；
+        资料作为系统消息插入在原有系统消息之后，返回新的请求对象
+        """
+        if not context.chunks:
+            return request
+        counter = usage_calculator()
+        budget = self.context_tokens - counter.count(CONTEXT_PROMPT)
+        sections: List[str] = []
+        for chunk in context.chunks:
+            section = f"[{len(sections) + 1}]《{chunk['title']}》\n{chunk['content']}\n\n"
+            tokens = counter.count(section)
+            # 放不下的分块跳过，后面更短的分块仍可能放下
+            if tokens > budget:
+                continue
+            sections.append(section)
+            budget -= tokens
+        if not sections:
+            return request
+        messages = list(request.messages)
+        position = 0
+        while position < len(messages) and messages[position].role == "system":
+            position += 1
+        messages.insert(position, ChatMessage(role="system", content=CONTEXT_PROMPT + "".join(sections).rstrip()))
+        return request.model_copy(update={"messages": messages})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cache_entries": len(self._cache),
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "errors": self.errors,
+        }
+
+    @classmethod
+    def from_config(cls) -> "RagService":
+        return cls(
+            top_k=config.RAG_TOP_K,
+            context_tokens=config.RAG_CONTEXT_TOKENS,
+            cache_size=config.RAG_CACHE_SIZE,
+            cache_ttl=config.RAG_CACHE_TTL
+        )
+
+
+def server_timing(timings: Dict[str, float], context: Optional[RetrievedContext] = None) -> str:
+    """
+    生成 Server-Timing 响应头，timings 为 {阶段: 秒}
+    """
+    parts = []
+    for name, seconds in timings.items():
+        part = f"{name};dur={seconds * 1000:.1f}"
+        if name == "retrieve" and context is not None:
+            part += ';desc="error"' if context.error else (';desc="cache hit"' if context.cached else "")
+        parts.append(part)
+    return ", ".join(parts)
+
+
+rag_service = RagService.from_config()
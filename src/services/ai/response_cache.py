@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+#项目库
+from src.config import config
+from src.services.ai.chat_models import ChatCompletionRequest
+from src.utils.sqlite_utils import SQLiteUtils
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    聊天响应缓存：内存 LRU 一级缓存 + 可选的 SQLite 持久化二级缓存，均支持 TTL 和容量淘汰
+    仅缓存确定性请求（temperature=0），缓存值为 {"choices": [{"content": ..., "finish_reason": ...}]}
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, db_path: Optional[str] = None, max_rows: int = 100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if db_path:
+            self.db = SQLiteUtils(db_path)
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    cache_key varchar(64) PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_created ON response_cache(created_at)")
+
+    @staticmethod
+    def cacheable(request: ChatCompletionRequest) -> bool:
+        """
+        判断请求是否可以缓存：只有确定性采样的请求结果可复用
+        """
+        return request.temperature == 0
+
+    @staticmethod
+    def make_key(request: ChatCompletionRequest) -> str:
+        """
+        根据影响生成结果的字段计算规范化哈希
+        """
+        payload = {
+            "model": request.model,
+            "messages": [[m.role, m.content, m.name] for m in request.messages],
+            "temperature": request.temperature,
+            "top_p": request.top_p,
+            "stop": request.stop,
+            "max_tokens": request.max_tokens,
+            "n": request.n,
+            "presence_penalty": request.presence_penalty,
+            "frequency_penalty": request.frequency_penalty,
+            "logit_bias": request.logit_bias,
+        }
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _memory_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _memory_set(self, key: str, value: Dict[str, Any], expires_at: float):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _db_get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self.db.fetchone(
+            "SELECT value, expires_at FROM response_cache WHERE cache_key=? AND expires_at>=?",
+            (key, time.time())
+        )
+        if not row:
+            return None
+        value = json.loads(row["value"])
+        # 回填内存缓存
+        self._memory_set(key, value, row["expires_at"])
+        return value
+
+    def _db_set(self, key: str, value: Dict[str, Any], expires_at: float):
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO response_cache (cache_key, value, expires_at, created_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), expires_at, now)
+        )
+        self._writes += 1
+        # 每写入一定次数清理一次过期和超量数据
+        if self._writes % 100 == 0:
+            self.db.execute("DELETE FROM response_cache WHERE expires_at<?", (now,))
+            self.db.execute(
+                """DELETE FROM response_cache WHERE cache_key IN (
+                    SELECT cache_key FROM response_cache ORDER BY created_at
+                    LIMIT max((SELECT count(*) FROM response_cache) - ?, 0)
+                )""",
+                (self.max_rows,)
+            )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._memory_get(key)
+        if value is None and self.db is not None:
+            try:
+                value = self._db_get(key)
+            except Exception as e:
+                logger.error(f"读取持久化响应缓存失败: {str(e)}")
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]):
+        expires_at = time.time() + self.ttl
+        self._memory_set(key, value, expires_at)
+        if self.db is not None:
+            try:
+                self._db_set(key, value, expires_at)
+            except Exception as e:
+                logger.error(f"写入持久化响应缓存失败: {str(e)}")
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        异步读取：内存命中直接返回，持久化缓存在线程中读取，避免阻塞事件循环
+        """
+        if self.db is None:
+            return self.get(key)
+        value = self._memory_get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: Dict[str, Any]):
+        if self.db is None:
+            self.set(key, value)
+        else:
+            await asyncio.to_thread(self.set, key, value)
+
+    @classmethod
+    def from_config(cls) -> Optional["ResponseCache"]:
+        if not config.AI_CACHE_ENABLED:
+            return None
+        return cls(
+            max_entries=config.AI_CACHE_MAX_ENTRIES,
+            ttl=config.AI_CACHE_TTL,
+            db_path=config.AI_CACHE_DB_PATH if config.AI_CACHE_PERSIST else None,
+            max_rows=config.AI_CACHE_MAX_ROWS
+        )
@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+#项目库
+from src.config import config
+from src.services.ai.embedding import EmbeddingService, embedding_service
+from src.utils.sqlite_utils import SQLiteUtils
+from src.utils.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+# 单条 SQL 中 IN 列表的最大参数个数（SQLite 默认上限 999）
+_SQL_IN_LIMIT = 500
+
+
+class Retriever:
+    """
+    分块向量检索：向量库中以 doc_chunks.id 为向量ID，文档向量化后按分块写入，重新分块前删除旧分块的向量；
+    查询时向量化查询文本，取 top-k 分块并关联分块内容和文档信息
+    """
+    def __init__(self, db: SQLiteUtils, store: VectorStore, embeddings: EmbeddingService,
+                 nprobe: int = 16, ivf_min_rows: int = 100000, page_size: int = 1024):
+        self.db = db
+        self.store = store
+        self.embeddings = embeddings
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        self.page_size = page_size
+        self._building = threading.Lock()
+        self.searches = 0
+        self.search_seconds = 0.0
+
+    def _in_query(self, sql: str, values: List[Any], params: tuple = ()) -> List[Dict[str, Any]]:
+        """
+        分批执行 IN 查询，sql 中以 {marks} 作为占位符列表
+        """
+        rows: List[Dict[str, Any]] = []
+        for start in range(0, len(values), _SQL_IN_LIMIT):
+            part = values[start:start + _SQL_IN_LIMIT]
+            rows.extend(self.db.fetchall(sql.format(marks=",".join("?" * len(part))), (*params, *part)))
+        return rows
+
+    def remove_document(self, hash_code: str) -> int:
+        """
+        删除文件现有分块的向量（重新分块会生成新的分块ID）
+        """
+        ids = [row["id"] for row in self.db.fetchall("SELECT id FROM doc_chunks WHERE hash_code=?", (hash_code,))]
+        return self.store.delete(ids) if ids else 0
+
+    def index_document(self, hash_code: str) -> int:
+        """
+        把文件分块的向量（取自 embedding_cache）写入向量库，返回写入条数
+        """
+        count = 0
+        last_seq = -1
+        while True:
+            rows = self.db.fetchall(
+                """SELECT c.id, c.seq, e.vector FROM doc_chunks c
+                JOIN embedding_cache e ON e.model=? AND e.text_hash=c.text_hash
+                WHERE c.hash_code=? AND c.seq>? ORDER BY c.seq LIMIT ?""",
+                (self.embeddings.model, hash_code, last_seq, self.page_size)
+            )
+            if not rows:
+                break
+            last_seq = rows[-1]["seq"]
+            vectors = np.stack([np.frombuffer(row["vector"], dtype=np.float32) for row in rows])
+            self.store.add([row["id"] for row in rows], vectors)
+            count += len(rows)
+        self.maybe_build_index()
+        return count
+
+    def maybe_build_index(self):
+        """
+        向量数达到阈值后构建（或在新增较多后重建）IVF 索引；同一时间只构建一次
+        """
+        if not self.store.needs_ivf(self.ivf_min_rows):
+            return
+        if not self._building.acquire(blocking=False):
+            return
+        try:
+            self.store.build_ivf()
+        finally:
+            self._building.release()
+
+    def _chunk_ids(self, uids: List[str]) -> List[int]:
+        """
+        文档UID -> 已完成文档的文件hash -> 分块ID
+        """
+        hashes = {row["hash_code"] for row in self._in_query(
+            "SELECT hash_code FROM documents WHERE status='ok' AND UID IN ({marks})", uids)}
+        return [row["id"] for row in self._in_query(
+            "SELECT id FROM doc_chunks WHERE hash_code IN ({marks})", list(hashes))]
+
+    def search(self, query: str, top_k: int = 5, uids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        检索与查询最相近的 top_k 个分块，uids 限定在指定文档内检索
+        返回 [{chunk_id, score, content, seq, uid, title}]，按相似度降序
+        """
+        start = time.perf_counter()
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        if uids is not None:
+            ids = self._chunk_ids(uids)
+            hits = self.store.search(vector, top_k, ids=ids) if ids else []
+        else:
+            nprobe = self.nprobe if self.store.has_ivf else None
+            hits = self.store.search(vector, top_k, nprobe=nprobe)
+        results = self._join(hits, uids)
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - start
+        return results
+
+    def _join(self, hits: List[tuple], uids: Optional[List[str]]) -> List[Dict[str, Any]]:
+        if not hits:
+            return []
+        chunks = {row["id"]: row for row in self._in_query(
+            "SELECT id, hash_code, seq, content FROM doc_chunks WHERE id IN ({marks})", [i for i, _ in hits])}
+        # 相同内容的文件可能对应多个文档，优先取检索范围内的文档
+        docs: Dict[str, Dict[str, Any]] = {}
+        for row in self._in_query(
+                "SELECT UID, title, hash_code FROM documents WHERE status='ok' AND hash_code IN ({marks}) ORDER BY id",
+                list({chunk["hash_code"] for chunk in chunks.values()})):
+            if row["hash_code"] not in docs or (uids and row["UID"] in uids and docs[row["hash_code"]]["UID"] not in uids):
+                docs[row["hash_code"]] = row
+        results = []
+        for chunk_id, score in hits:
+            chunk = chunks.get(chunk_id)
+            doc = docs.get(chunk["hash_code"]) if chunk else None
+            # 分块已被删除或没有已完成的文档引用（文件已清理）时跳过
+            if doc is None:
+                continue
+            results.append({
+                "chunk_id": chunk_id,
+                "score": round(score, 6),
+                "content": chunk["content"],
+                "seq": chunk["seq"],
+                "uid": doc["UID"],
+                "title": doc["title"],
+            })
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = self.store.stats()
+        stats["searches"] = self.searches
+        stats["avg_search_ms"] = round(self.search_seconds / self.searches * 1000, 2) if self.searches else 0
+        return stats
+
+    @classmethod
+    def from_config(cls, db: SQLiteUtils) -> "Retriever":
+        store = VectorStore(config.VECTOR_PATH, metric=config.VECTOR_METRIC, segment_rows=config.VECTOR_SEGMENT_ROWS)
+        return cls(db, store, embedding_service(), nprobe=config.VECTOR_NPROBE, ivf_min_rows=config.VECTOR_IVF_MIN_ROWS)
+
+
+_retriever: Optional[Retriever] = None
+_retriever_lock = threading.Lock()
+def retriever() -> Retriever:
+    """
+    获取全局的分块检索服务
+    """
+    global _retriever
+    with _retriever_lock:
+        if _retriever is None:
+            _retriever = Retriever.from_config(SQLiteUtils(config.DB_PATH))
+        return _retriever
+
+
+def close_retriever():
+    global _retriever
+    with _retriever_lock:
+        _retriever = None
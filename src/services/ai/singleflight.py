@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import threading
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StreamFlight:
+    """
+    一次进行中的上游流式调用：后台任务拉取上游内容块并缓存，所有订阅者从头读取已产生的块并继续接收后续块
+    """
+    def __init__(self, source: AsyncIterator[str], on_done: Callable[["StreamFlight"], None]):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._on_done = on_done
+        self._event = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self._pump(source))
+
+    def _notify(self):
+        self._event.set()
+        self._event = asyncio.Event()
+
+    async def _pump(self, source: AsyncIterator[str]):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._on_done(self)
+            self._notify()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._event.wait()
+        finally:
+            self.subscribers -= 1
+            # 所有订阅者都已离开时取消上游调用
+            if self.subscribers == 0 and not self.done:
+                self._on_done(self)
+                self.task.cancel()
+
+
+class SingleFlight:
+    """
+    合并并发的相同请求：同一个 key 在途时，后来者复用同一次上游调用的结果
+    """
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, StreamFlight] = {}
+        self._sync_calls: Dict[str, "_SyncCall"] = {}
+        self._sync_lock = threading.Lock()
+        self.shared = 0 # 被合并的请求数
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        非流式合并：上游调用在独立任务中执行，单个调用方取消不影响其它等待者
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish_call(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _finish_call(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 标记异常已读取，避免所有等待者都取消时出现未读取异常告警
+        if not task.cancelled():
+            task.exception()
+
+    def stream(self, key: str, fn: Callable[[], AsyncIterator[str]]) -> AsyncGenerator[str, None]:
+        """
+        流式合并：后来者挂到在途的流上，先收到已产生的块，再继续接收剩余块
+        """
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = StreamFlight(fn(), lambda f: self._finish_stream(key, f))
+            self._streams[key] = flight
+        else:
+            self.shared += 1
+        return flight.subscribe()
+
+    def _finish_stream(self, key: str, flight: StreamFlight):
+        if self._streams.get(key) is flight:
+            del self._streams[key]
+
+    def do_sync(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        同步版本的非流式合并，供线程中调用
+        """
+        with self._sync_lock:
+            call = self._sync_calls.get(key)
+            leader = call is None
+            if leader:
+                call = _SyncCall()
+                self._sync_calls[key] = call
+            else:
+                self.shared += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._sync_lock:
+                del self._sync_calls[key]
+            call.event.set()
+
+
+class _SyncCall:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Optional
+
+try:
+    import orjson
+    JSON_BACKEND = "orjson"
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:
+    JSON_BACKEND = "json"
+
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+DONE = "data: [DONE]\n\n"
+# SSE 注释帧，客户端会忽略，用于在长时间无输出时保持连接
+HEARTBEAT = ": ping\n\n"
+
+
+def error_frame(message: str) -> str:
+    """
+    不属于任何 choice 的错误帧（流在编码器之外失败时发送）
+    """
+    return f'data: {{"error":{{"message":{dumps(message)},"type":"server_error"}}}}\n\n'
+
+
+class ChunkEncoder:
+    """
+    chat.completion.chunk 的 SSE 编码器：id/created/model 等固定部分每个响应只序列化一次，
+    每个 token 只转义增量内容
+    """
+    def __init__(self, response_id: str, created: int, model: str):
+        self.response_id = response_id
+        self.created = created
+        self.model = model
+        self._envelope = (
+            f'data: {{"id":{dumps(response_id)},"object":"chat.completion.chunk",'
+            f'"created":{int(created)},"model":{dumps(model)},'
+        )
+        self._prefixes: Dict[int, str] = {}
+
+    def _prefix(self, index: int) -> str:
+        prefix = self._prefixes.get(index)
+        if prefix is None:
+            prefix = self._prefixes[index] = f'{self._envelope}"choices":[{{"index":{index},"delta":'
+        return prefix
+
+    def role(self, index: int = 0, role: str = "assistant") -> str:
+        return f'{self._prefix(index)}{{"role":{dumps(role)}}},"finish_reason":null}}]}}\n\n'
+
+    def content(self, index: int, text: str) -> str:
+        return f'{self._prefix(index)}{{"content":{dumps(text)}}},"finish_reason":null}}]}}\n\n'
+
+    def finish(self, index: int, finish_reason: str = "stop") -> str:
+        return f'{self._prefix(index)}{{}},"finish_reason":{dumps(finish_reason)}}}]}}\n\n'
+
+    def usage(self, usage: Dict[str, Any]) -> str:
+        return f'{self._envelope}"choices":[],"usage":{dumps(usage)}}}\n\n'
+
+    def error(self, message: str, index: int = 0) -> str:
+        return (
+            f'{self._prefix(index)}{{}},"finish_reason":"error"}}],'
+            f'"error":{{"message":{dumps(message)},"type":"server_error"}}}}\n\n'
+        )
+
+
+async def coalesce(source: AsyncIterator[tuple], max_chars: int, max_delay: float) -> AsyncGenerator[tuple, None]:
+    """
+    按 choice 合并连续的文本块：累计达到 max_chars 个字符或等待超过 max_delay 秒时输出一帧，
+    收到结束原因时立即冲刷该 choice 的缓冲区。source 逐项产出 (index, 文本, 结束原因)
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    async def _pump():
+        try:
+            async for item in source:
+                await queue.put(item)
+            await queue.put(finished)
+        except Exception as e:
+            await queue.put(e)
+
+    task = asyncio.create_task(_pump())
+    # index -> [文本片段列表, 字符数, 截止时间]
+    buffers: Dict[int, list] = {}
+
+    def _flush(index: int) -> tuple:
+        parts = buffers.pop(index)[0]
+        return index, "".join(parts), None
+
+    try:
+        while True:
+            timeout = None
+            if buffers:
+                timeout = max(min(b[2] for b in buffers.values()) - time.monotonic(), 0)
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                now = time.monotonic()
+                for index in [i for i, b in buffers.items() if b[2] <= now]:
+                    yield _flush(index)
+                continue
+            if item is finished or isinstance(item, Exception):
+                for index in sorted(buffers):
+                    yield _flush(index)
+                if isinstance(item, Exception):
+                    raise item
+                return
+            index, content, finish_reason = item
+            if content:
+                buffer = buffers.setdefault(index, [[], 0, time.monotonic() + max_delay])
+                buffer[0].append(content)
+                buffer[1] += len(content)
+                if buffer[1] >= max_chars:
+                    yield _flush(index)
+            if finish_reason:
+                if index in buffers:
+                    yield _flush(index)
+                yield index, "", finish_reason
+    finally:
+        task.cancel()
+
+
+def _legacy_chunk(response_id: str, created: int, model: str, text: str) -> str:
+    """
+    旧实现：每个 token 重建完整字典再 json.dumps，仅用于基准对比
+    """
+    chunk = {
+        "id": response_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "delta": {
+                    "content": text
+                },
+                "finish_reason": None
+            }
+        ]
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+def benchmark(chunks: int = 200000):
+    """
+    对比旧实现与 ChunkEncoder 的单块编码耗时
+    """
+    tokens = ["你好", "，", "world", "\n", "\"引号\"", "电能表接线"]
+    response_id, created, model = "chatcmpl-0123456789abcdef0123456789abcdef", int(time.time()), "Qwen3-32B"
+
+    start = time.perf_counter()
+    for i in range(chunks):
+        _legacy_chunk(response_id, created, model, tokens[i % len(tokens)])
+    legacy = (time.perf_counter() - start) / chunks * 1e6
+
+    encoder = ChunkEncoder(response_id, created, model)
+    start = time.perf_counter()
+    for i in range(chunks):
+        encoder.content(0, tokens[i % len(tokens)])
+    current = (time.perf_counter() - start) / chunks * 1e6
+
+    # 编码结果必须是等价的 JSON
+    for token in tokens:
+        assert json.loads(encoder.content(0, token)[6:]) == json.loads(_legacy_chunk(response_id, created, model, token)[6:])
+
+    print(f"JSON 后端: {JSON_BACKEND}")
+    print(f"旧实现: {legacy:.2f} us/块")
+    print(f"ChunkEncoder: {current:.2f} us/块（{legacy / current:.1f}x）")
+
+
+if __name__ == "__main__":
+    benchmark()
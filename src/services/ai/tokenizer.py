@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+#项目库
+from src.config import config
+from src.services.ai.chat_models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# Qwen 等 ChatML 模板中每条消息的固定开销：<|im_start|>role\n ... <|im_end|>\n
+MESSAGE_OVERHEAD_TOKENS = 4
+# 回复起始 <|im_start|>assistant\n 的开销
+REPLY_PRIMING_TOKENS = 3
+
+_CJK_RANGES = "\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef"
+_CJK_PATTERN = re.compile(f"[{_CJK_RANGES}]")
+_WORD_PATTERN = re.compile(f"[A-Za-z]+|\\d|[^\\sA-Za-z\\d{_CJK_RANGES}]")
+
+
+class TokenCounter(ABC):
+    """
+    token 计数器基类
+    """
+    name = "base"
+
+    @abstractmethod
+    def count(self, text: str) -> int:
+        """
+        统计文本的 token 数
+        """
+
+
+class EstimateTokenCounter(TokenCounter):
+    """
+    未配置分词器时的估算：中日韩字符每字计 1 个 token，英文单词按 4 个字母 1 个 token，数字和标点各计 1 个
+    """
+    name = "estimate"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        tokens = len(_CJK_PATTERN.findall(text))
+        for word in _WORD_PATTERN.findall(text):
+            tokens += (len(word) + 3) // 4 if word.isalpha() else 1
+        return tokens
+
+
+class HFTokenCounter(TokenCounter):
+    """
+    基于 HuggingFace tokenizers 的精确计数，从本地 tokenizer.json 加载
+    """
+    name = "tokenizers"
+
+    def __init__(self, path: str):
+        from tokenizers import Tokenizer
+        self._tokenizer = Tokenizer.from_file(path)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+class UsageCalculator:
+    """
+    计算请求的 token 用量：缓存重复出现的系统提示词的计数结果，并记录出现过的提示词前缀用于估算 vLLM 前缀缓存命中
+    """
+    def __init__(self, counter: TokenCounter, cache_size: int = 4096, block_size: int = 16):
+        self.counter = counter
+        self.block_size = block_size
+        self._count_cached = lru_cache(maxsize=cache_size)(counter.count)
+        self._prefixes: "OrderedDict[str, int]" = OrderedDict()
+        self._prefix_limit = cache_size
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        return self.counter.count(text)
+
+    def count_messages(self, messages: List[ChatMessage]) -> int:
+        tokens = REPLY_PRIMING_TOKENS
+        for msg in messages:
+            # 系统提示词通常被大量请求重复发送，计数结果走缓存
+            if msg.role == "system":
+                tokens += self._count_cached(msg.content)
+            else:
+                tokens += self.counter.count(msg.content)
+            tokens += MESSAGE_OVERHEAD_TOKENS
+        return tokens
+
+    def _prefix_cached_tokens(self, messages: List[ChatMessage]) -> int:
+        """
+        以开头的系统提示词作为前缀：曾经发送过的前缀大概率命中 vLLM 前缀缓存（按整块计）
+        """
+        if not messages or messages[0].role != "system":
+            return 0
+        prefix = messages[0].content
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        tokens = self._count_cached(prefix) + MESSAGE_OVERHEAD_TOKENS
+        with self._lock:
+            seen = key in self._prefixes
+            self._prefixes[key] = tokens
+            self._prefixes.move_to_end(key)
+            while len(self._prefixes) > self._prefix_limit:
+                self._prefixes.popitem(last=False)
+        if not seen:
+            return 0
+        return tokens // self.block_size * self.block_size
+
+    def usage(self, messages: List[ChatMessage], completions: List[str], response_cached: bool = False) -> Dict:
+        """
+        计算 OpenAI 格式的 usage，completions 为每个 choice 的输出，response_cached 表示响应来自本地响应缓存（未调用上游）
+        """
+        prompt_tokens = self.count_messages(messages)
+        completion_tokens = sum(self.counter.count(completion) for completion in completions)
+        cached_tokens = prompt_tokens if response_cached else min(self._prefix_cached_tokens(messages), prompt_tokens)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {
+                "cached_tokens": cached_tokens,
+                "audio_tokens": 0
+            }
+        }
+
+
+def _load_counter() -> TokenCounter:
+    if config.AI_TOKENIZER_PATH:
+        try:
+            counter = HFTokenCounter(config.AI_TOKENIZER_PATH)
+            logger.info(f"分词器加载成功: {config.AI_TOKENIZER_PATH}")
+            return counter
+        except ImportError:
+            logger.warning("未安装 tokenizers 包，token 计数回退为估算")
+        except Exception as e:
+            logger.error(f"分词器加载失败，token 计数回退为估算: {str(e)}")
+    return EstimateTokenCounter()
+
+
+_usage_calculator: Optional[UsageCalculator] = None
+def usage_calculator() -> UsageCalculator:
+    """
+    获取全局的 token 用量计算器（分词器只加载一次）
+    """
+    global _usage_calculator
+    if _usage_calculator is None:
+        _usage_calculator = UsageCalculator(
+            _load_counter(),
+            cache_size=config.AI_TOKENIZER_CACHE_SIZE,
+            block_size=config.AI_PREFIX_CACHE_BLOCK
+        )
+    return _usage_calculator
@@ -0,0 +1,107 @@
+import logging
+import os
+import time
+from typing import Any, Dict, NamedTuple
+
+#项目库
+from src.config import config
+from src.utils.sqlite_utils import SQLiteUtils
+
+logger = logging.getLogger(__name__)
+
+
+class Blob(NamedTuple):
+    path: str
+    hash_code: str
+    file_size: int
+    existed: bool # 存储中已有相同内容的文件
+    vectorized: bool # 相同内容已完成向量化，可直接复用分块和向量
+
+
+class BlobStore:
+    """
+    内容寻址文件存储：文件按 md5 存放在 root/ab/cd/<md5>，相同内容只保存一份
+    blobs 表记录引用计数（完成处理且指向该文件的文档数）和向量化状态，引用计数为 0 的文件超过保留期后被清理
+    """
+    def __init__(self, db: SQLiteUtils, root: str, gc_grace: float = 86400):
+        self.db = db
+        self.root = root
+        self.gc_grace = gc_grace
+
+    def path_for(self, hash_code: str) -> str:
+        return os.path.join(self.root, hash_code[:2], hash_code[2:4], hash_code)
+
+    def put(self, src_path: str, hash_code: str, file_size: int) -> Blob:
+        """
+        把已下载的文件移入存储；已有相同内容时删除 src_path，复用已有文件。
+        先登记（刷新 updated_at）再检查文件是否存在，登记后 gc 不会再清理该文件
+        """
+        row = self.db.fetchall(
+            """INSERT INTO blobs (hash_code, file_size, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(hash_code) DO UPDATE SET updated_at=excluded.updated_at
+            RETURNING vectorized""",
+            (hash_code, file_size, time.time())
+        )[0]
+        path = self.path_for(hash_code)
+        existed = os.path.exists(path)
+        if existed:
+            os.remove(src_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(src_path, path)
+        return Blob(path, hash_code, file_size, existed, bool(row["vectorized"]))
+
+    def mark_vectorized(self, hash_code: str):
+        self.db.execute("UPDATE blobs SET vectorized=1, updated_at=? WHERE hash_code=?", (time.time(), hash_code))
+
+    def record_reuse(self, hash_code: str):
+        """
+        记录一次复用（跳过了下载后的解析和向量化）
+        """
+        self.db.execute("UPDATE blobs SET reuse_count=reuse_count+1, updated_at=? WHERE hash_code=?", (time.time(), hash_code))
+
+    def gc(self) -> int:
+        """
+        清理引用计数为 0 且超过保留期的文件，返回清理数量
+        """
+        rows = self.db.fetchall(
+            "SELECT hash_code FROM blobs WHERE refcount=0 AND updated_at<?",
+            (time.time() - self.gc_grace,)
+        )
+        removed = 0
+        for row in rows:
+            # 条件删除，避免与刚刚增加引用或重新登记的文档竞争；删除文件时持有写锁，
+            # put 的登记要等文件删除后才能执行，之后看到的是文件不存在
+            with self.db.transaction() as conn:
+                if not conn.execute(
+                    "DELETE FROM blobs WHERE hash_code=? AND refcount=0 AND updated_at<?",
+                    (row["hash_code"], time.time() - self.gc_grace)
+                ).rowcount:
+                    continue
+                try:
+                    os.remove(self.path_for(row["hash_code"]))
+                except FileNotFoundError:
+                    pass
+            removed += 1
+        if removed:
+            logger.info(f"内容寻址存储清理了 {removed} 个无引用文件")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        存储和去重统计：stored_bytes 实际占用，dedup_bytes 因去重少存的字节，
+        reused_bytes 复用已有向量而跳过处理的字节数
+        """
+        row = self.db.fetchone(
+            """SELECT count(*) AS blobs,
+                coalesce(sum(file_size), 0) AS stored_bytes,
+                coalesce(sum(file_size * max(refcount - 1, 0)), 0) AS dedup_bytes,
+                coalesce(sum(reuse_count), 0) AS reused_documents,
+                coalesce(sum(file_size * reuse_count), 0) AS reused_bytes
+            FROM blobs"""
+        )
+        return dict(row)
+
+    @classmethod
+    def from_config(cls, db: SQLiteUtils) -> "BlobStore":
+        return cls(db, config.BLOB_PATH, gc_grace=config.BLOB_GC_GRACE)
@@ -0,0 +1,38 @@
+import logging
+from typing import Optional
+
+#项目库
+from src.config import config
+from src.utils.async_sqlite_utils import AsyncSQLiteUtils
+
+logger = logging.getLogger(__name__)
+
+_database: Optional[AsyncSQLiteUtils] = None
+def database() -> AsyncSQLiteUtils:
+    """
+    获取全局的异步数据库访问实例（供路由使用，不阻塞事件循环）
+    """
+    global _database
+    if _database is None:
+        _database = AsyncSQLiteUtils(
+            config.DB_PATH,
+            read_threads=config.DB_READ_THREADS,
+            write_batch=config.DB_WRITE_BATCH
+        )
+    return _database
+
+def open_database():
+    """
+    应用启动时创建异步数据库访问实例
+    """
+    database()
+    logger.info(f"数据库已打开: {config.DB_PATH}")
+
+async def close_database():
+    """
+    应用关闭时提交剩余写入并停止数据库线程
+    """
+    global _database
+    if _database is not None:
+        await _database.close()
+        _database = None
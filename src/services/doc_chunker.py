@@ -0,0 +1,359 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import uuid
+from typing import Any, Iterator, List, Optional, Tuple
+
+#项目库
+from src.config import config
+from src.services.exec_services import task_manager
+
+logger = logging.getLogger(__name__)
+
+# 一个句子：到句末标点（含后随的引号、括号）、英文句点后的空白或换行为止，保留句末标点和空白
+_SENTENCE = re.compile(r".+?(?:[。！？；!?;…]+[”’」』）)\]]*|\.(?=\s)|\n+|$)\s*", re.S)
+# 超长段落按此长度切成多段再分句，避免单段读入过多内容
+MAX_SEGMENT_CHARS = 64 * 1024
+# 写入分块表的批量大小
+INSERT_BATCH = 256
+
+TEXT_FORMATS = {".txt", ".md", ".markdown", ".csv", ".log"}
+# 旧版 Office 复合文档（doc/xls/ppt）的文件头
+OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+# 外部转换工具（antiword / LibreOffice）的超时时间（秒）
+CONVERT_TIMEOUT = 300
+
+
+class UnsupportedFormat(Exception):
+    """
+    不支持的文件格式或缺少对应的解析库
+    """
+
+
+def detect_format(path: str, title: str = "") -> str:
+    """
+    先按文件头识别二进制格式（扩展名可能与内容不符），其余按标题扩展名判断
+    （内容寻址存储中的文件没有扩展名），都无法判断时视为纯文本
+    """
+    ext = os.path.splitext(title or path)[1].lower()
+    with open(path, "rb") as f:
+        head = f.read(8)
+    if head.startswith(OLE_MAGIC):
+        # 复合文档无法从文件头区分 doc/xls/ppt，只有 doc 有解析方式
+        return ext if ext in (".xls", ".ppt") else ".doc"
+    if head.startswith(b"%PDF"):
+        return ".pdf"
+    if head.startswith(b"PK"):
+        import zipfile
+        try:
+            with zipfile.ZipFile(path) as z:
+                names = z.namelist()
+        except zipfile.BadZipFile:
+            names = []
+        if any(name.startswith("xl/") for name in names):
+            return ".xlsx"
+        if any(name.startswith("word/") for name in names):
+            return ".docx"
+        return ext or ".zip"
+    return ext or ".txt"
+
+
+def is_binary(path: str) -> bool:
+    """
+    按文件开头判断是否为二进制内容：含 NUL 字节或控制字符占比过高
+    """
+    with open(path, "rb") as f:
+        sample = f.read(8192)
+    if b"\x00" in sample:
+        return True
+    control = sum(1 for byte in sample if byte < 32 and byte not in (8, 9, 10, 12, 13, 27))
+    return bool(sample) and control / len(sample) > 0.1
+
+
+def _open_text(path: str):
+    """
+    以 utf-8 打开文本，解码失败时回退为 gb18030（兼容 GBK 编码的中文文档）
+    """
+    with open(path, "rb") as f:
+        sample = f.read(64 * 1024)
+    try:
+        sample.decode("utf-8")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # 采样边界可能截断多字节字符
+        encoding = "utf-8-sig" if e.start >= len(sample) - 3 else "gb18030"
+    return open(path, "r", encoding=encoding, errors="replace")
+
+
+def _iter_text(path: str) -> Iterator[str]:
+    """
+    逐行读取，按空行切分段落
+    """
+    with _open_text(path) as f:
+        lines: List[str] = []
+        size = 0
+        for line in f:
+            if not line.strip():
+                if lines:
+                    yield "".join(lines)
+                    lines, size = [], 0
+                continue
+            lines.append(line)
+            size += len(line)
+            if size >= MAX_SEGMENT_CHARS:
+                yield "".join(lines)
+                lines, size = [], 0
+        if lines:
+            yield "".join(lines)
+
+
+def _iter_json(path: str) -> Iterator[str]:
+    """
+    JSON 文档（如作业任务步骤）：按叶子节点输出“键路径：值”，同一对象的字段合并为一段
+    """
+    with _open_text(path) as f:
+        data = json.load(f)
+
+    def _walk(node: Any, prefix: str) -> Iterator[str]:
+        if isinstance(node, dict):
+            fields = [f"{key}：{value}" for key, value in node.items()
+                      if isinstance(value, (str, int, float)) and not isinstance(value, bool) and str(value).strip()]
+            if fields:
+                yield (f"{prefix}\n" if prefix else "") + "\n".join(fields)
+            for key, value in node.items():
+                if isinstance(value, (dict, list)):
+                    yield from _walk(value, f"{prefix}/{key}" if prefix else key)
+        elif isinstance(node, list):
+            strings = [str(item) for item in node if isinstance(item, str) and item.strip()]
+            if strings:
+                yield f"{prefix}：" + "；".join(strings)
+            for item in node:
+                if isinstance(item, (dict, list)):
+                    yield from _walk(item, prefix)
+
+    yield from _walk(data, "")
+
+
+def _iter_xlsx(path: str) -> Iterator[str]:
+    """
+    Excel 只读模式逐行读取：第一行作为表头，每行输出为“表头：值”
+    """
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise UnsupportedFormat("解析 xlsx 需要安装 openpyxl")
+    # 传入文件对象：存储中的文件没有扩展名，openpyxl 按路径打开时会校验扩展名
+    with open(path, "rb") as f:
+        workbook = load_workbook(f, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                header: Optional[List[str]] = None
+                for row in sheet.iter_rows(values_only=True):
+                    values = ["" if value is None else str(value).strip() for value in row]
+                    if not any(values):
+                        continue
+                    if header is None:
+                        header = values
+                        continue
+                    fields = [f"{header[i] if i < len(header) and header[i] else f'列{i + 1}'}：{value}"
+                              for i, value in enumerate(values) if value]
+                    yield f"{sheet.title}\n" + "\n".join(fields)
+        finally:
+            workbook.close()
+
+
+def _iter_docx(path: str) -> Iterator[str]:
+    try:
+        import docx
+    except ImportError:
+        raise UnsupportedFormat("解析 docx 需要安装 python-docx")
+    document = docx.Document(path)
+    for paragraph in document.paragraphs:
+        if paragraph.text.strip():
+            yield paragraph.text
+    for table in document.tables:
+        for row in table.rows:
+            cells = [cell.text.strip() for cell in row.cells]
+            if any(cells):
+                yield " | ".join(cells)
+
+
+def _iter_doc(path: str) -> Iterator[str]:
+    """
+    旧版 Word（OLE 复合文档）：用 antiword 或 LibreOffice 转为纯文本后按段落读取
+    """
+    antiword = shutil.which("antiword")
+    soffice = shutil.which("soffice") or shutil.which("libreoffice")
+    if not antiword and not soffice:
+        raise UnsupportedFormat("解析 doc 需要安装 antiword 或 LibreOffice")
+    with tempfile.TemporaryDirectory(prefix="doc-") as tmp:
+        output = os.path.join(tmp, "document.txt")
+        try:
+            if antiword:
+                with open(output, "wb") as f:
+                    subprocess.run([antiword, "-m", "UTF-8.txt", "-w", "0", path], stdout=f,
+                                   stderr=subprocess.PIPE, timeout=CONVERT_TIMEOUT, check=True)
+            else:
+                # LibreOffice 按扩展名识别输入格式，存储中的文件没有扩展名
+                source = os.path.join(tmp, "document.doc")
+                shutil.copyfile(path, source)
+                subprocess.run([soffice, "--headless", "--convert-to", "txt:Text (encoded):UTF8", "--outdir", tmp, source],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=CONVERT_TIMEOUT, check=True)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            stderr = (getattr(e, "stderr", None) or b"").decode("utf-8", "replace").strip()
+            raise UnsupportedFormat(f"doc 转换失败: {stderr or str(e)}")
+        if not os.path.exists(output):
+            raise UnsupportedFormat("doc 转换失败: 没有输出文本")
+        yield from _iter_text(output)
+
+
+def _iter_pdf(path: str) -> Iterator[str]:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise UnsupportedFormat("解析 pdf 需要安装 pypdf")
+    reader = PdfReader(path)
+    for page in reader.pages:
+        text = page.extract_text() or ""
+        if text.strip():
+            yield text
+
+
+EXTRACTORS = {
+    ".json": _iter_json,
+    ".xlsx": _iter_xlsx,
+    ".xlsm": _iter_xlsx,
+    ".docx": _iter_docx,
+    ".doc": _iter_doc,
+    ".pdf": _iter_pdf,
+}
+
+
+def iter_segments(path: str, title: str = "") -> Iterator[str]:
+    """
+    按格式逐段抽取文本（段落、表格行、页面），不一次性读入整个文档
+    """
+    fmt = detect_format(path, title)
+    extractor = EXTRACTORS.get(fmt)
+    if extractor is None:
+        # 无法识别的二进制文件按文本读取只会得到乱码分块
+        if is_binary(path):
+            raise UnsupportedFormat(f"不支持的二进制格式 {fmt}: {title or path}")
+        if fmt not in TEXT_FORMATS:
+            logger.warning(f"未知格式 {fmt}，按纯文本解析: {title or path}")
+        extractor = _iter_text
+    return extractor(path)
+
+
+def split_sentences(text: str) -> Iterator[str]:
+    """
+    中文感知的分句：在句末标点（。！？；等）、英文句点后的空白和换行处切分
+    """
+    for match in _SENTENCE.finditer(text):
+        sentence = match.group()
+        if sentence.strip():
+            yield sentence
+
+
+def chunk_segments(segments: Iterator[str], size: int = 500, overlap: int = 50) -> Iterator[str]:
+    """
+    把句子累积为不超过 size 个字符的分块，相邻分块重叠末尾不超过 overlap 个字符的完整句子；
+    超长句子按 size 硬切。只保留当前分块的句子，内存占用与文档大小无关
+    """
+    overlap = min(max(overlap, 0), size // 2)
+    window: List[str] = []
+    length = 0
+    fresh = False # 窗口中是否有未输出过的句子
+
+    def _emit() -> str:
+        nonlocal window, length, fresh
+        chunk = "".join(window).strip()
+        # 保留末尾句子作为下一块的开头
+        tail: List[str] = []
+        tail_length = 0
+        for sentence in reversed(window):
+            if tail_length + len(sentence) > overlap:
+                break
+            tail.insert(0, sentence)
+            tail_length += len(sentence)
+        window, length, fresh = tail, tail_length, False
+        return chunk
+
+    for segment in segments:
+        # 段落之间保留换行，避免相邻段落的文字粘连
+        if not segment.endswith("\n"):
+            segment += "\n"
+        for sentence in split_sentences(segment):
+            while len(sentence) > size:
+                if fresh:
+                    yield _emit()
+                window, length = [], 0
+                yield sentence[:size]
+                sentence = sentence[size - overlap:] if overlap else sentence[size:]
+            if length + len(sentence) > size:
+                if fresh:
+                    yield _emit()
+                if length + len(sentence) > size:
+                    window, length = [], 0
+            window.append(sentence)
+            length += len(sentence)
+            fresh = True
+    if fresh:
+        yield _emit()
+
+
+def iter_chunks(path: str, title: str = "", size: Optional[int] = None, overlap: Optional[int] = None) -> Iterator[str]:
+    """
+    文档分块流水线：抽取 -> 分句 -> 分块，惰性产出
+    """
+    return chunk_segments(
+        iter_segments(path, title),
+        size=config.CHUNK_SIZE if size is None else size,
+        overlap=config.CHUNK_OVERLAP if overlap is None else overlap
+    )
+
+
+def chunk_to_db(db_path: str, path: str, title: str, hash_code: str, size: int, overlap: int) -> Tuple[int, int]:
+    """
+    分块并分批写入 doc_chunks（按文件 hash 存储，相同内容的文档共享分块），返回 (分块数, 字符数)
+    在解析进程中执行，分块不经进程间传递。
+    解析期间不持有写锁：分块先以临时键每批一个短事务写入，解析完成后在一个短事务中替换旧分块
+    """
+    from src.utils.sqlite_utils import SQLiteUtils
+    db = SQLiteUtils(db_path)
+    sql = "INSERT INTO doc_chunks (hash_code, seq, content, text_hash) VALUES (?, ?, ?, ?)"
+    # 临时键对检索和向量化不可见；同一内容并发解析时各自使用不同的键
+    staging = f"{hash_code}#{uuid.uuid4().hex}"
+    count = chars = 0
+    batch: List[Tuple[str, int, str, str]] = []
+    try:
+        for chunk in iter_chunks(path, title, size, overlap):
+            # 分块文本哈希用于关联向量缓存，未修改的分块在文档更新后可复用向量
+            batch.append((staging, count, chunk, hashlib.sha256(chunk.encode("utf-8")).hexdigest()))
+            count += 1
+            chars += len(chunk)
+            if len(batch) >= INSERT_BATCH:
+                db.executemany(sql, batch)
+                batch = []
+        if batch:
+            db.executemany(sql, batch)
+        with db.transaction() as conn:
+            conn.execute("DELETE FROM doc_chunks WHERE hash_code=?", (hash_code,))
+            conn.execute("UPDATE doc_chunks SET hash_code=? WHERE hash_code=?", (hash_code, staging))
+    except BaseException:
+        db.execute("DELETE FROM doc_chunks WHERE hash_code=?", (staging,))
+        raise
+    return count, chars
+
+
+def chunk_document(path: str, title: str, hash_code: str) -> Tuple[int, int]:
+    """
+    在任务管理器的 cpu 进程池中对文档分块并入库，返回 (分块数, 字符数)
+    """
+    args = (config.DB_PATH, path, title, hash_code, config.CHUNK_SIZE, config.CHUNK_OVERLAP)
+    return task_manager().run(chunk_to_db, *args, kind="cpu", name=f"parse:{title}")
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+#项目库
+from src.config import config
+
+logger = logging.getLogger(__name__)
+
+# 文档的最终状态，订阅的文档都到达最终状态后状态流结束
+FINAL_STATUSES = ("ok", "failed")
+
+
+class Subscription:
+    """
+    一个订阅者：事件通过所属事件循环投递到有界队列，队列满时丢弃最旧的事件
+    （丢弃的状态由订阅方的数据库兜底轮询补上）
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, uids: Optional[Iterable[str]], maxsize: int):
+        self.loop = loop
+        self.uids = set(uids) if uids else None
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def wants(self, event: Dict[str, Any]) -> bool:
+        return self.uids is None or event["docid"] in self.uids
+
+    def _deliver(self, event: Dict[str, Any]):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class DocumentEventBus:
+    """
+    进程内的文档状态变更发布/订阅：处理线程在状态写入数据库后发布事件，
+    通过 call_soon_threadsafe 投递到各订阅者的事件循环，不阻塞发布线程。
+    只能收到本进程内的状态变更，多进程部署时由订阅方定期查询数据库兜底
+    """
+    def __init__(self, queue_size: int = 1000):
+        self.queue_size = queue_size
+        self._subscribers: List[Subscription] = []
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, uids: Optional[Iterable[str]] = None) -> Subscription:
+        """
+        在事件循环中调用，uids 为空时订阅全部文档
+        """
+        subscription = Subscription(asyncio.get_running_loop(), uids, self.queue_size)
+        with self._lock:
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def publish(self, docid: str, status: str, message: Optional[str] = None, attempts: Optional[int] = None):
+        """
+        发布状态变更（任意线程可调用）
+        """
+        event = {"docid": docid, "status": status, "message": message, "attempts": attempts, "time": time.time()}
+        with self._lock:
+            self.published += 1
+            subscribers = [subscription for subscription in self._subscribers if subscription.wants(event)]
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._deliver, event)
+            except RuntimeError:
+                # 事件循环已关闭（应用退出中）
+                self.unsubscribe(subscription)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "published": self.published,
+                "dropped": sum(subscription.dropped for subscription in self._subscribers),
+            }
+
+
+_document_events: Optional[DocumentEventBus] = None
+_events_lock = threading.Lock()
+def document_events() -> DocumentEventBus:
+    """
+    获取全局的文档状态事件总线
+    """
+    global _document_events
+    with _events_lock:
+        if _document_events is None:
+            _document_events = DocumentEventBus(queue_size=config.DOC_EVENTS_QUEUE)
+        return _document_events
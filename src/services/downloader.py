@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from typing import NamedTuple, Optional
+
+import httpx
+
+#项目库
+from src.config import config
+
+logger = logging.getLogger(__name__)
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+
+
+class DownloadError(Exception):
+    """
+    下载失败（HTTP 错误状态或多次断点续传后仍未完成）
+    """
+
+
+class DownloadResult(NamedTuple):
+    path: str
+    hash_code: str # 文件内容 md5
+    file_size: int
+
+
+def download_client() -> httpx.Client:
+    """
+    获取共享的下载连接池（线程安全，供各文档处理线程复用连接）
+    """
+    global _client
+    with _client_lock:
+        if _client is None or _client.is_closed:
+            _client = httpx.Client(
+                timeout=httpx.Timeout(
+                    connect=config.DOWNLOAD_CONNECT_TIMEOUT,
+                    read=config.DOWNLOAD_READ_TIMEOUT,
+                    write=config.DOWNLOAD_CONNECT_TIMEOUT,
+                    pool=config.DOWNLOAD_READ_TIMEOUT
+                ),
+                follow_redirects=True,
+                transport=httpx.HTTPTransport(
+                    limits=httpx.Limits(
+                        max_connections=config.DOWNLOAD_MAX_CONNECTIONS,
+                        max_keepalive_connections=config.DOWNLOAD_MAX_CONNECTIONS
+                    ),
+                    retries=config.DOWNLOAD_RETRIES
+                )
+            )
+        return _client
+
+
+def close_download_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def _hash_existing(part_path: str, hasher) -> int:
+    """
+    断点续传时把已下载部分计入哈希，返回已下载字节数
+    """
+    size = 0
+    with open(part_path, "rb") as f:
+        while True:
+            block = f.read(config.DOWNLOAD_CHUNK_SIZE)
+            if not block:
+                return size
+            hasher.update(block)
+            size += len(block)
+
+
+def _download_once(url: str, part_path: str) -> DownloadResult:
+    """
+    下载一次：临时文件已存在时用 Range 续传，服务端不支持续传时从头下载；边写边计算 md5 和大小
+    """
+    hasher = hashlib.md5()
+    offset = _hash_existing(part_path, hasher) if os.path.exists(part_path) else 0
+    # 禁用压缩传输，保证 Range 偏移和 Content-Length 都对应文件原始字节
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    with download_client().stream("GET", url, headers=headers) as response:
+        if response.status_code == 416 and offset:
+            # 临时文件异常（比源文件还大），删除后重新下载
+            os.remove(part_path)
+            raise httpx.TransportError("续传范围无效，重新下载")
+        if response.status_code not in (200, 206):
+            raise DownloadError(f"下载失败：HTTP {response.status_code} - URL: {url}")
+        total = None
+        if response.status_code == 206:
+            match = _CONTENT_RANGE.match(response.headers.get("content-range", ""))
+            if not match or int(match.group(1)) != offset:
+                os.remove(part_path)
+                raise httpx.TransportError("续传范围与临时文件不一致，重新下载")
+            if match.group(3) != "*":
+                total = int(match.group(3))
+            mode = "ab"
+        else:
+            # 服务端不支持 Range，从头下载
+            hasher, offset, mode = hashlib.md5(), 0, "wb"
+            if "content-length" in response.headers:
+                total = int(response.headers["content-length"])
+        size = offset
+        with open(part_path, mode) as f:
+            for chunk in response.iter_bytes(config.DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                hasher.update(chunk)
+                size += len(chunk)
+        if total is not None and size != total:
+            raise httpx.TransportError(f"连接提前断开：已下载 {size}/{total} 字节")
+    return DownloadResult(part_path, hasher.hexdigest(), size)
+
+
+def download(url: str, dest_path: str) -> DownloadResult:
+    """
+    流式下载到 dest_path.part，网络中断时按 Range 续传，完成后原子重命名为 dest_path
+    内存占用与文件大小无关，文件内容只读取一次（哈希与写盘同时进行）
+    """
+    part_path = dest_path + ".part"
+    os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+    attempts = max(config.DOWNLOAD_RETRIES, 0) + 1
+    for attempt in range(1, attempts + 1):
+        try:
+            result = _download_once(url, part_path)
+            break
+        except httpx.TransportError as e:
+            if attempt >= attempts:
+                raise DownloadError(f"下载失败：{str(e) or e.__class__.__name__} - URL: {url}") from e
+            logger.warning(f"下载中断，第 {attempt} 次续传: {url} {str(e)}")
+            time.sleep(min(2 ** (attempt - 1), 10))
+    os.replace(part_path, dest_path)
+    return DownloadResult(dest_path, result.hash_code, result.file_size)
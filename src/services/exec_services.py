@@ -1,25 +1,300 @@
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
-
-executer = ThreadPoolExecutor(max_workers=10)
-
-def run_async(func, *args):
-    try:
-        loop = asyncio.get_event_loop()
-        loop.run_in_executor(executer, func, *args)
-    except Exception as e:
-        print(e)
-
-def run_async2(func, *args):
-    try:
-        executer.submit(func, *args)
-    except Exception as e:
-        print(e)
-
-def close_executer():
-    try:
-        executer.shutdown(wait=True)
-    except Exception as e:
-        print(e)
-    
+import logging
+import multiprocessing
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
 
+#项目库
+from src.config import config
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("reject", "block", "caller_runs")
+
+
+class TaskRejected(Exception):
+    """
+    任务池已满（运行中 + 排队数达到上限）且拒绝策略为 reject
+    """
+
+
+class TaskManagerClosed(RuntimeError):
+    """
+    任务管理器已关闭（应用关闭中），不再接收任务
+    """
+
+
+class TaskInfo:
+    """
+    任务记录：status 为 queued / running / done / failed / cancelled / rejected
+    """
+    def __init__(self, task_id: str, name: str, kind: str):
+        self.id = task_id
+        self.name = name
+        self.kind = kind
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.traceback: Optional[str] = None
+        self.future: Optional[Future] = None
+
+    def to_dict(self, with_traceback: bool = False) -> Dict[str, Any]:
+        status = self.status
+        # 进程池中的任务无法回报开始时间，以 Future 的状态为准
+        if status == "queued" and self.future is not None and self.future.running():
+            status = "running"
+        data = {
+            "id": self.id,
+            "name": self.name,
+            "kind": self.kind,
+            "status": status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+        if with_traceback:
+            data["traceback"] = self.traceback
+        return data
+
+
+class _Pool:
+    """
+    有界任务池：运行中 + 排队的任务数不超过 workers + max_queue
+    """
+    def __init__(self, kind: str, executor: Optional[Executor], workers: int, max_queue: int):
+        self.kind = kind
+        self.executor = executor
+        self.workers = workers
+        self.capacity = workers + max_queue
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.active = 0
+
+
+class TaskManager:
+    """
+    后台任务管理：io 线程池执行下载等 I/O 密集任务，cpu 进程池执行文档解析等 CPU 密集任务（spawn 启动，
+    避免 fork 继承父进程的 SQLite 连接和线程锁；进程数为 0 时在调用线程中执行）。
+    每个任务有ID，可查询状态和异常信息；队列满时按拒绝策略处理：
+    reject 抛出 TaskRejected，block 等待空位，caller_runs 在提交线程中直接执行
+    """
+    def __init__(self, io_workers: int = 16, io_queue: int = 256, cpu_workers: int = 2, cpu_queue: int = 64,
+                 policy: str = "reject", history: int = 1000):
+        if policy not in POLICIES:
+            raise ValueError(f"不支持的拒绝策略: {policy}")
+        self.policy = policy
+        self.history = history
+        self._pools = {
+            "io": _Pool("io", ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="task-io"), io_workers, io_queue),
+            "cpu": _Pool(
+                "cpu",
+                ProcessPoolExecutor(max_workers=cpu_workers, mp_context=multiprocessing.get_context("spawn"))
+                if cpu_workers > 0 else None,
+                max(cpu_workers, 1),
+                cpu_queue
+            ),
+        }
+        self._tasks: "OrderedDict[str, TaskInfo]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.counts = {"submitted": 0, "done": 0, "failed": 0, "cancelled": 0, "rejected": 0}
+
+    def submit(self, func: Callable, *args, kind: str = "io", name: Optional[str] = None,
+               policy: Optional[str] = None, **kwargs) -> TaskInfo:
+        """
+        提交任务，返回任务记录（task.future 可等待结果）；cpu 任务的函数和参数需要可序列化
+        """
+        pool = self._pools[kind]
+        policy = policy or self.policy
+        task = TaskInfo(uuid.uuid4().hex, name or getattr(func, "__name__", "task"), kind)
+        if self._closed:
+            raise TaskManagerClosed("任务管理器已关闭")
+        if not pool.slots.acquire(blocking=(policy == "block")):
+            if policy == "reject":
+                task.status = "rejected"
+                task.finished_at = time.time()
+                self._record(task, "rejected")
+                raise TaskRejected(f"{kind} 任务池已满（{pool.capacity}），任务 {task.name} 被拒绝")
+            # caller_runs：在提交线程中执行，提交方自然被减速
+            self._record(task, "submitted")
+            task.future = Future()
+            self._run_inline(task, func, args, kwargs)
+            return task
+        if self._closed:
+            # 等待空位期间任务管理器被关闭
+            pool.slots.release()
+            raise TaskManagerClosed("任务管理器已关闭")
+        self._record(task, "submitted")
+        with self._lock:
+            pool.active += 1
+        try:
+            if pool.executor is None:
+                task.future = Future()
+                self._run_inline(task, func, args, kwargs)
+                self._release(pool)
+                return task
+            if kind == "io":
+                task.future = pool.executor.submit(self._run_thread, task, func, args, kwargs)
+            else:
+                task.future = pool.executor.submit(func, *args, **kwargs)
+        except RuntimeError as e:
+            self._release(pool)
+            if self._closed:
+                # 线程池/进程池已关闭（cannot schedule new futures after shutdown）
+                raise TaskManagerClosed("任务管理器已关闭") from e
+            raise
+        except Exception:
+            self._release(pool)
+            raise
+        task.future.add_done_callback(lambda future: self._finish(pool, task, future))
+        return task
+
+    def run(self, func: Callable, *args, kind: str = "io", name: Optional[str] = None, **kwargs) -> Any:
+        """
+        提交任务并等待结果（阻塞等待空位），供处理线程把下载、解析交给对应的任务池
+        """
+        return self.submit(func, *args, kind=kind, name=name, policy="block", **kwargs).future.result()
+
+    def _run_thread(self, task: TaskInfo, func: Callable, args: tuple, kwargs: dict) -> Any:
+        task.status = "running"
+        task.started_at = time.time()
+        return func(*args, **kwargs)
+
+    def _run_inline(self, task: TaskInfo, func: Callable, args: tuple, kwargs: dict):
+        task.future.set_running_or_notify_cancel()
+        try:
+            task.future.set_result(self._run_thread(task, func, args, kwargs))
+        except BaseException as e:
+            task.future.set_exception(e)
+        self._finish(None, task, task.future)
+
+    def _finish(self, pool: Optional[_Pool], task: TaskInfo, future: Future):
+        task.finished_at = time.time()
+        if future.cancelled():
+            task.status = "cancelled"
+        elif future.exception() is not None:
+            error = future.exception()
+            task.status = "failed"
+            task.error = f"{error.__class__.__name__}: {str(error)}"
+            task.traceback = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+            logger.error(f"任务 {task.name}（{task.id}）执行失败: {task.error}")
+        else:
+            task.status = "done"
+        self._record(task, task.status)
+        if pool is not None:
+            self._release(pool)
+
+    def _release(self, pool: _Pool):
+        with self._lock:
+            pool.active -= 1
+        pool.slots.release()
+
+    def _record(self, task: TaskInfo, event: str):
+        with self._lock:
+            self.counts[event] += 1
+            self._tasks[task.id] = task
+            self._tasks.move_to_end(task.id)
+            # 只保留最近的记录，未结束的任务不淘汰
+            while len(self._tasks) > self.history:
+                oldest = next(iter(self._tasks.values()))
+                if oldest.finished_at is None:
+                    break
+                self._tasks.popitem(last=False)
+
+    def get(self, task_id: str) -> Optional[TaskInfo]:
+        with self._lock:
+            return self._tasks.get(task_id)
+
+    def list(self, status: Optional[str] = None, kind: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        最近的任务（新的在前）
+        """
+        with self._lock:
+            tasks = list(reversed(self._tasks.values()))
+        result = []
+        for task in tasks:
+            data = task.to_dict()
+            if (status and data["status"] != status) or (kind and task.kind != kind):
+                continue
+            result.append(data)
+            if len(result) >= limit:
+                break
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "pools": {
+                    kind: {
+                        "workers": pool.workers,
+                        "capacity": pool.capacity,
+                        "active": pool.active, # 运行中 + 排队中
+                        "queued": max(pool.active - pool.workers, 0),
+                    }
+                    for kind, pool in self._pools.items()
+                },
+                **self.counts,
+            }
+
+    def shutdown(self, wait: bool = True):
+        """
+        停止接收新任务，取消排队中的任务，等待运行中的任务结束
+        """
+        self._closed = True
+        for pool in self._pools.values():
+            if pool.executor is not None:
+                pool.executor.shutdown(wait=wait, cancel_futures=True)
+
+    @classmethod
+    def from_config(cls) -> "TaskManager":
+        return cls(
+            io_workers=config.TASK_IO_WORKERS,
+            io_queue=config.TASK_IO_QUEUE,
+            cpu_workers=config.PARSE_PROCESSES,
+            cpu_queue=config.TASK_CPU_QUEUE,
+            policy=config.TASK_REJECT_POLICY,
+            history=config.TASK_HISTORY
+        )
+
+
+_task_manager: Optional[TaskManager] = None
+_task_closed = False
+_task_lock = threading.Lock()
+def task_manager() -> TaskManager:
+    """
+    获取全局的后台任务管理器，关闭后抛出 TaskManagerClosed（不在关闭过程中重新创建线程池和进程池）
+    """
+    global _task_manager
+    with _task_lock:
+        if _task_closed:
+            raise TaskManagerClosed("任务管理器已关闭")
+        if _task_manager is None:
+            _task_manager = TaskManager.from_config()
+        return _task_manager
+
+
+def close_task_manager():
+    """
+    应用关闭时调用
+    """
+    global _task_manager, _task_closed
+    with _task_lock:
+        _task_closed = True
+        manager, _task_manager = _task_manager, None
+    # 在锁外等待运行中的任务，期间调用 task_manager() 的线程立即得到 TaskManagerClosed
+    if manager is not None:
+        manager.shutdown(wait=True)
+
+
+def run_async(func, *args) -> str:
+    """
+    在 io 任务池中执行 func(*args)，返回任务ID（异常记录在任务状态中，可通过 /tasks 查询）
+    """
+    return task_manager().submit(func, *args, kind="io").id
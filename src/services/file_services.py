@@ -1,140 +1,195 @@
+import logging
 import os
 import sys
-import threading
-from typing import Any, Dict
-import requests
+import time
+from concurrent.futures import CancelledError
+from typing import Any, Dict, Optional, Tuple
 import hashlib
 import os
 
 #项目包
 from src.config import config
 from src.utils.sqlite_utils import SQLiteUtils
+from src.services.ingest_queue import DocumentQueue, IngestWorkerPool, Lease
+from src.services.downloader import DownloadError, DownloadResult, download
+from src.services.blob_store import BlobStore
+from src.services.doc_chunker import UnsupportedFormat, chunk_document
+from src.services.exec_services import TaskManagerClosed, task_manager
+from src.services.ai.embedding import EmbeddingClosed, embedding_service
+from src.services.ai.retrieval import retriever
+from src.services.notifier import notification_dispatcher
+from src.services.scheduler import AdaptivePoll, Scheduler
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = config.DB_PATH
 db = SQLiteUtils(DB_PATH)
 
-def download_file(download_url: str, uid: str, title: str) -> Any:
+def download_file(download_url: str, uid: str, title: str) -> DownloadResult:
     """
-    下载文件
+    流式下载文件到 DOC_PATH/incoming，同时计算 md5 和文件大小，失败抛出 DownloadError
     """
-    # 获取文件名
-    file_name = str(uid) + "_" + title
-    # 获取文件路径
-    file_path = os.path.join(config.DOC_PATH, file_name)
-    # 如果文件存在，则删除
-    if os.path.exists(file_path):
-        os.remove(file_path)
-    # 下载文件
-    response = requests.get(download_url)
-    if response.status_code != 200:
-        _message = f"下载失败：HTTP {response.status_code} - URL: {download_url}"
-        print(_message)
-        return False, _message
-    
-    # 保存文件
-    with open(file_path, "wb") as f:
-        f.write(response.content)
-    return True, file_path
-
-def vectorize_file(file_path: str, doc_id: str, finish_url: str) -> Any:
+    # 临时文件按文档ID命名，失败重试时断点续传；下载完成后移入内容寻址存储
+    file_path = os.path.join(config.DOC_PATH, "incoming", str(uid))
+    try:
+        # 在任务管理器的 io 线程池中下载，下载并发由 TASK_IO_WORKERS 统一限制
+        return task_manager().run(download, download_url, file_path, kind="io", name=f"download:{title}")
+    except DownloadError as e:
+        print(str(e))
+        raise
+
+def vectorize_file(file_path: str, title: str, hash_code: str, lease: Optional[Lease] = None) -> Any:
     """
-    向量化文件
+    向量化文件：在解析进程中抽取文本并分块，分块按 hash 写入 doc_chunks，再对分块向量化
     """
-    # # 读取文件
-    # with open(file_path, "r") as f:
-    #     content = f.read()
-    # # 向量化文件
-    # vector = vectorize_document(content)
-    return [131, 33, 12]
-
-def vectorize_document(content: str) -> Any:
+    # 重新分块会替换分块ID，先删除旧分块在向量库中的向量
+    retriever().remove_document(hash_code)
+    chunks, chars = chunk_document(file_path, title, hash_code)
+    logger.info(f"文件 {title} 分块完成: {chunks} 块，{chars} 字符")
+    if lease is not None:
+        lease.check()
+    return vectorize_document(hash_code)
+
+def vectorize_document(hash_code: str) -> Any:
     """
-    调用 langchain 对文档内容进行向量化
-    这里仅作示例，实际请替换为 langchain 的调用
+    对文件的分块批量向量化，已缓存的分块文本不再请求向量化服务，向量写入本地向量库供检索
     """
-    # TODO: 替换为实际的 langchain 向量化代码
-    vector = [0.1, 0.2, 0.3]  # 示例向量
-    return vector
+    result = embedding_service().embed_document(hash_code)
+    result["indexed"] = retriever().index_document(hash_code)
+    logger.info(f"文件 {hash_code} 向量化完成: {result}")
+    return result
 
 
-def vectorize_document_by_doc(doc: Dict):
+def vectorize_document_by_doc(doc: Dict, lease: Optional[Lease] = None) -> Tuple[str, str, int]:
+    """
+    处理一个已认领的文档：下载、计算hash、向量化，返回 (本地路径, hash值, 文件大小)，失败抛出异常
+    状态更新和完成通知由任务队列负责，各阶段之间检查认领是否仍然有效
+    """
     doc_id = doc["id"] # 文档ID
     title = doc["title"]
-    # 根据 finish_url 下载文件
+    # 根据 download_url 下载文件
     download_url = doc["download_url"]
-    finish_url = doc["finish_url"]
-    # 更新状态为 doing
-    db.execute(
-        "UPDATE documents SET status='doing' WHERE id=?",
-        (doc_id,)
-    )
-    # 下载文件
-    success, message = download_file(download_url, doc_id, title)
-    if success:
-        file_path = message
-        # 计算文件hash值
-        hash_code = hashlib.md5(open(file_path, "rb").read()).hexdigest()
-        # 向量化文件
-        vector = vectorize_file(file_path, doc_id, finish_url)
-        print(f"正在向量化文档ID: {doc_id}")
-        # 读取文件大小
-        file_size = os.path.getsize(file_path)
-        # 更新向量和状态
-        db.execute(
-            "UPDATE documents SET status='ok', local_path=?, hash_code=?, file_size=? WHERE id=?",
-            (file_path, hash_code, file_size, doc_id)
+    # 下载文件（边下载边计算hash值和文件大小）
+    downloaded = download_file(download_url, doc_id, title)
+    if lease is not None:
+        lease.check()
+    # 移入内容寻址存储，相同内容只保存一份
+    store = blob_store()
+    blob = store.put(downloaded.path, downloaded.hash_code, downloaded.file_size)
+    file_path, hash_code, file_size = blob.path, blob.hash_code, blob.file_size
+    if blob.vectorized:
+        # 相同内容已向量化，直接复用已有分块和向量
+        store.record_reuse(hash_code)
+        print(f"文档ID {doc_id} 与已处理文件内容相同，复用向量化结果。")
+        return file_path, hash_code, file_size
+    # 向量化文件
+    print(f"正在向量化文档ID: {doc_id}")
+    vectorize_file(file_path, title, hash_code, lease)
+    store.mark_vectorized(hash_code)
+    print(f"文档ID {doc_id} 向量化完成。")
+    return file_path, hash_code, file_size
+
+_blob_store = None
+def blob_store() -> BlobStore:
+    """
+    获取全局的内容寻址文件存储
+    """
+    global _blob_store
+    if _blob_store is None:
+        _blob_store = BlobStore.from_config(db)
+    return _blob_store
+
+_ingest_pool = None
+def ingest_pool() -> IngestWorkerPool:
+    """
+    获取全局的文档处理线程池
+    """
+    global _ingest_pool
+    if _ingest_pool is None:
+        _ingest_pool = IngestWorkerPool(
+            DocumentQueue.from_config(db),
+            handler=vectorize_document_by_doc,
+            # 向 finish_url 发送的处理结果通知与文档状态在同一事务中写入发件箱，异步投递并在失败时重试
+            notifier=notification_dispatcher(),
+            workers=config.INGEST_WORKERS,
+            poll_interval=config.INGEST_POLL_INTERVAL,
+            idle_poll=config.SCHEDULER_POLL_MAX,
+            permanent_errors=(UnsupportedFormat,),
+            # 应用关闭时被取消的下载、解析、向量化不算失败
+            requeue_errors=(CancelledError, TaskManagerClosed, EmbeddingClosed)
         )
-        # 向 finish_url 发送通知
-        requests.get(finish_url, params={"success": success, "message": "OK"})
-        print(f"文档ID {doc_id} 向量化完成。")
-        return True
-
-    # 更新向量和状态
-    db.execute(
-        "UPDATE documents SET status='failed', status_message=? WHERE id=?",
-        (message, doc_id)
-    )
-    # 向 finish_url 发送通知
-    requests.get(finish_url, params={"success": success, "message": message})
-    print(f"文档ID {doc_id} 向量化失败。")
-    
-    return success
+    return _ingest_pool
 
 def vectorize_document_by_uid(uid: str):
-    # 查询 status=0 的文档
-    docs = db.fetchall("SELECT id, uid, title,  download_url, finish_url FROM documents WHERE status='init' and UID=? ", (uid,))
+    """
+    立即认领并处理指定 UID 的文档（已被其它线程认领时跳过）
+    """
+    pool = ingest_pool()
+    worker = f"uid@{os.getpid()}"
+    docs = pool.queue.claim(worker, uid=uid)
     if not docs:
         print("没有需要向量化的文档。")
         return
 
     for doc in docs:
-        vectorize_document_by_doc(doc)
+        pool.process(doc, worker)
 
 async def vectorize_document_by_uid_async(uid: str):
     vectorize_document_by_uid(uid) 
 
 def vectorize_documents():
-    db = SQLiteUtils(DB_PATH)
-    # 查询 status=0 的文档 仅读取 100条
-    docs = db.fetchall("SELECT id, download_url, finish_url FROM documents WHERE status='init' limit 100")
-    if not docs:
-        print("没有需要向量化的文档。")
-        return
-
-    for doc in docs:
-        vectorize_document_by_doc(doc)
-
-
-def schedule_task(interval: int = 300):
     """
-    定时任务，每 interval 秒执行一次
+    逐个认领并处理待处理文档，最多 100 个（手工批量执行使用，与工作线程池通过认领互斥）
+    """
+    pool = ingest_pool()
+    worker = f"batch@{os.getpid()}"
+    pool.recover()
+    for _ in range(100):
+        docs = pool.queue.claim(worker)
+        if not docs:
+            break
+        for doc in docs:
+            pool.process(doc, worker)
+
+_ingest_poll = AdaptivePoll(config.SCHEDULER_POLL_MIN, config.SCHEDULER_POLL_MAX)
+def poll_documents() -> float:
     """
-    def _task():
-        vectorize_documents()
-        # 下讯下载执行
-        threading.Timer(interval, _task).start()
-    _task()
+    调度任务（主节点执行）：回收过期租约，有可执行文档时唤醒处理线程，返回下次轮询间隔
+    队列持续为空时间隔逐步加倍；有退避等待中的文档时在其可执行时间准时唤醒
+    """
+    pool = ingest_pool()
+    pool.recover()
+    depth = pool.queue.depth()
+    if depth["ready"]:
+        pool.wake()
+    delay = _ingest_poll.next(busy=depth["ready"] > 0 or depth["running"] > 0)
+    next_run_at = pool.queue.next_run_at()
+    if next_run_at is not None:
+        delay = min(delay, max(next_run_at - time.time(), 0))
+    return delay
+
+def _gc_blobs():
+    blob_store().gc()
+
+_scheduler: Optional[Scheduler] = None
+def job_scheduler() -> Scheduler:
+    """
+    获取全局的定时任务调度器（文档队列轮询、无引用文件清理）
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler.from_config(db)
+        _scheduler.add_job("ingest", poll_documents, config.SCHEDULER_POLL_MIN)
+        _scheduler.add_job("blob_gc", _gc_blobs, config.BLOB_GC_INTERVAL)
+    return _scheduler
+
+def wake_ingest():
+    """
+    登记新文档后调用：唤醒本进程的处理线程；本进程是调度主节点时同时重置队列轮询间隔
+    （唤醒不跨进程，其它进程的空闲处理线程最迟 SCHEDULER_POLL_MAX 秒后自行认领）
+    """
+    ingest_pool().wake()
+    job_scheduler().wake("ingest")
 
 def task():
     vectorize_documents()
-
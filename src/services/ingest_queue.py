@@ -0,0 +1,395 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+#项目库
+from src.config import config
+from src.data.db.sqlinit import PENDING_FILTER
+from src.utils.sqlite_utils import SQLiteUtils
+from src.services.doc_events import document_events
+
+logger = logging.getLogger(__name__)
+
+CLAIM_COLUMNS = "id, UID, title, download_url, finish_url, attempts"
+
+
+class LeaseLost(Exception):
+    """
+    文档的认领已失效（租约过期后被回收，或已被其它工作线程重新认领），应停止处理
+    """
+
+
+class DocumentQueue:
+    """
+    基于 documents 表的任务队列：
+    init（可执行时间已到）-> 认领为 doing（带租约）-> ok / 退避后回到 init / 超过最大尝试次数为 failed，
+    租约过期的 doing 视为工作线程崩溃，重新回到 init；
+    状态写入数据库后调用 listener(UID, 新状态, 状态信息, 尝试次数) 发布状态变更
+    """
+    def __init__(self, db: SQLiteUtils, lease_seconds: float = 600, max_attempts: int = 5,
+                 retry_base: float = 30, retry_max: float = 3600,
+                 listener: Optional[Callable[[str, str, Optional[str], Optional[int]], None]] = None):
+        self.db = db
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.listener = listener
+
+    def _publish(self, uid: str, status: str, message: Optional[str] = None, attempts: Optional[int] = None):
+        if self.listener is None:
+            return
+        try:
+            self.listener(uid, status, message, attempts)
+        except Exception as e:
+            logger.error(f"发布文档 {uid} 状态变更失败: {str(e)}")
+
+    def claim(self, worker: str, limit: int = 1, uid: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        原子认领待处理文档（UPDATE ... RETURNING），指定 uid 时忽略退避时间立即认领该文档
+        """
+        now = time.time()
+        if uid is None:
+            where, params = "(next_run_at IS NULL OR next_run_at<=?) ORDER BY id LIMIT ?", (now, limit)
+        else:
+            where, params = "UID=?", (uid,)
+        docs = self.db.fetchall(
+            f"""UPDATE documents SET status='doing', attempts=attempts+1, lease_until=?, claimed_by=?,
+                updated_at=datetime('now', 'localtime')
+            WHERE id IN (SELECT id FROM documents WHERE {PENDING_FILTER} AND status='init' AND {where})
+            RETURNING {CLAIM_COLUMNS}""",
+            (now + self.lease_seconds, worker) + params
+        )
+        for doc in docs:
+            self._publish(doc["UID"], "doing", None, doc["attempts"])
+        return docs
+
+    def complete(self, doc_id: int, worker: str, local_path: str, hash_code: str, file_size: int,
+                 outbox: Optional[Callable[[sqlite3.Connection], Any]] = None) -> bool:
+        """
+        标记完成并增加内容文件的引用计数；租约已过期并被其他工作线程重新认领时返回 False
+        outbox(conn) 在同一事务中执行（登记完成通知），状态和通知同时提交或同时回滚
+        """
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                """UPDATE documents SET status='ok', local_path=?, hash_code=?, file_size=?, status_message=NULL,
+                    lease_until=NULL, next_run_at=NULL, claimed_by=NULL, updated_at=datetime('now', 'localtime')
+                WHERE id=? AND status='doing' AND claimed_by=?
+                RETURNING UID, attempts""",
+                (local_path, hash_code, file_size, doc_id, worker)
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE blobs SET refcount=refcount+1, updated_at=? WHERE hash_code=?", (time.time(), hash_code))
+                if outbox is not None:
+                    outbox(conn)
+        if row:
+            self._publish(row["UID"], "ok", None, row["attempts"])
+        return row is not None
+
+    def renew(self, doc_id: int, worker: str) -> bool:
+        """
+        续期认领租约，认领已失效时返回 False
+        """
+        return self.db.execute(
+            "UPDATE documents SET lease_until=? WHERE id=? AND status='doing' AND claimed_by=?",
+            (time.time() + self.lease_seconds, doc_id, worker)
+        ) > 0
+
+    def requeue(self, doc: Dict[str, Any], worker: str, message: str) -> bool:
+        """
+        放回队列且不计入尝试次数（处理被取消，如应用关闭），认领已失效时返回 False
+        """
+        updated = self.db.execute(
+            """UPDATE documents SET status='init', attempts=max(attempts-1, 0), status_message=?, next_run_at=NULL,
+                lease_until=NULL, claimed_by=NULL, updated_at=datetime('now', 'localtime')
+            WHERE id=? AND status='doing' AND claimed_by=?""",
+            (message, doc["id"], worker)
+        ) > 0
+        if updated:
+            self._publish(doc["UID"], "init", message, max(doc["attempts"] - 1, 0))
+        return updated
+
+    def retry_delay(self, attempts: int) -> float:
+        return min(self.retry_base * (2 ** max(attempts - 1, 0)), self.retry_max)
+
+    def fail(self, doc: Dict[str, Any], worker: str, message: str, retry: bool = True,
+             outbox: Optional[Callable[[sqlite3.Connection], Any]] = None) -> Optional[str]:
+        """
+        记录失败：未超过最大尝试次数时按指数退避重新入队，返回新状态（init/failed），认领已失效时返回 None
+        retry=False 表示重试也不会成功（如不支持的文件格式），直接标记为 failed；
+        标记为 failed 时 outbox(conn) 在同一事务中执行（登记完成通知）
+        """
+        if retry and doc["attempts"] < self.max_attempts:
+            status, next_run_at = "init", time.time() + self.retry_delay(doc["attempts"])
+        else:
+            status, next_run_at = "failed", None
+        with self.db.transaction() as conn:
+            updated = conn.execute(
+                """UPDATE documents SET status=?, status_message=?, next_run_at=?, lease_until=NULL, claimed_by=NULL,
+                    updated_at=datetime('now', 'localtime')
+                WHERE id=? AND status='doing' AND claimed_by=?""",
+                (status, message, next_run_at, doc["id"], worker)
+            ).rowcount
+            if updated and status == "failed" and outbox is not None:
+                outbox(conn)
+        if not updated:
+            return None
+        self._publish(doc["UID"], status, message, doc["attempts"])
+        return status
+
+    def recover_expired(self) -> int:
+        """
+        回收租约过期的文档（工作线程崩溃或进程退出），返回回收数量
+        """
+        docs = self.db.fetchall(
+            f"""UPDATE documents SET status='init', lease_until=NULL, claimed_by=NULL,
+                status_message='租约过期，重新入队', updated_at=datetime('now', 'localtime')
+            WHERE {PENDING_FILTER} AND status='doing' AND lease_until<?
+            RETURNING UID, attempts, status_message""",
+            (time.time(),)
+        )
+        for doc in docs:
+            self._publish(doc["UID"], "init", doc["status_message"], doc["attempts"])
+        return len(docs)
+
+    def next_run_at(self) -> Optional[float]:
+        """
+        退避等待中的文档最早的可执行时间
+        """
+        row = self.db.fetchone(
+            f"SELECT min(next_run_at) AS next_run_at FROM documents WHERE {PENDING_FILTER} AND status='init' AND next_run_at>?",
+            (time.time(),)
+        )
+        return row["next_run_at"] if row else None
+
+    def depth(self) -> Dict[str, int]:
+        """
+        队列深度：ready 可立即执行，delayed 退避等待中，running 处理中
+        """
+        row = self.db.fetchone(
+            f"""SELECT
+                sum(status='init' AND (next_run_at IS NULL OR next_run_at<=?)) AS ready,
+                sum(status='init' AND next_run_at>?) AS delayed,
+                sum(status='doing') AS running
+            FROM documents WHERE {PENDING_FILTER}""",
+            (time.time(), time.time())
+        )
+        return {key: int(value or 0) for key, value in row.items()}
+
+    @classmethod
+    def from_config(cls, db: SQLiteUtils) -> "DocumentQueue":
+        return cls(
+            db,
+            lease_seconds=config.INGEST_LEASE_SECONDS,
+            max_attempts=config.INGEST_MAX_ATTEMPTS,
+            retry_base=config.INGEST_RETRY_BASE,
+            retry_max=config.INGEST_RETRY_MAX,
+            listener=document_events().publish
+        )
+
+
+class Lease:
+    """
+    处理期间的租约心跳：每三分之一租约时长续期一次，续期未更新任何行时标记为失效，
+    处理流程在下载、解析、向量化等阶段之间调用 check()，认领失效后及时停止，避免与重新认领的线程重复处理
+    """
+    def __init__(self, queue: DocumentQueue, doc: Dict[str, Any], worker: str):
+        self.queue = queue
+        self.doc = doc
+        self.worker = worker
+        self.lost = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{doc['id']}", daemon=True)
+
+    def __enter__(self) -> "Lease":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.queue.lease_seconds / 3):
+            try:
+                if not self.queue.renew(self.doc["id"], self.worker):
+                    self.lost = True
+                    logger.warning(f"文档ID {self.doc['id']} 的认领已失效，停止处理")
+                    return
+            except Exception as e:
+                # 数据库暂时不可用时下个周期再试，租约在三分之一时长内还不会过期
+                logger.error(f"续期文档ID {self.doc['id']} 的租约失败: {str(e)}")
+
+    def check(self):
+        if self.lost:
+            raise LeaseLost(f"文档ID {self.doc['id']} 的认领已失效")
+
+
+class IngestWorkerPool:
+    """
+    文档处理工作线程池：每个线程循环认领一个文档并处理，队列为空时等待唤醒
+    （登记接口在本进程登记新文档时，或调度主节点轮询到可执行的文档时），最多等待 idle_poll 秒后重新认领
+    handler(doc, lease) 返回 (local_path, hash_code, file_size)，失败抛出异常，permanent_errors 中的异常不再重试，
+    requeue_errors 中的异常（处理被取消）放回队列且不计入尝试次数，
+    处理期间由 lease 续期租约，handler 在各阶段之间调用 lease.check()；
+    文档最终完成或失败时，notifier.enqueue(doc, success, message, conn) 在更新状态的同一事务中登记完成通知，
+    提交后调用 notifier.wake() 立即投递（进程在两者之间崩溃也不会丢失通知）
+    """
+    def __init__(self, queue: DocumentQueue, handler: Callable[[Dict[str, Any], Lease], Tuple[str, str, int]],
+                 notifier: Any, workers: int = 4, poll_interval: float = 5, idle_poll: float = 60,
+                 permanent_errors: Tuple[type, ...] = (), requeue_errors: Tuple[type, ...] = ()):
+        self.queue = queue
+        self.handler = handler
+        self.notifier = notifier
+        self.permanent_errors = permanent_errors
+        self.requeue_errors = requeue_errors
+        self.workers = max(workers, 1)
+        self.poll_interval = poll_interval
+        self.idle_poll = idle_poll
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._finished: "deque[float]" = deque() # 最近一分钟内完成的时间点
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.recovered = 0
+        self.abandoned = 0
+        self.requeued = 0
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(f"ingest-{i}",), name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"文档处理线程池已启动，线程数: {self.workers}")
+
+    def stop(self, timeout: Optional[float] = None) -> int:
+        """
+        停止认领新文档，等待处理中的文档完成（最多 timeout 秒），返回超时仍未完成的文档数，
+        这些文档保持 doing 状态，租约到期后由其它进程重新处理
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        self._threads = []
+        if self.busy:
+            logger.warning(f"关闭时仍有 {self.busy} 个文档在处理中，将在租约到期后重新处理")
+        return self.busy
+
+    def wake(self):
+        """
+        有新文档登记时唤醒空闲线程
+        """
+        self._wakeup.set()
+
+    def recover(self) -> int:
+        """
+        回收租约过期的文档并计数（由调度主节点定期调用）
+        """
+        recovered = self.queue.recover_expired()
+        if recovered:
+            self._count("recovered", recovered)
+            logger.warning(f"回收了 {recovered} 个租约过期的文档")
+        return recovered
+
+    def _run(self, name: str):
+        # 进程 ID 区分多进程部署下的同名线程
+        worker = f"{name}@{os.getpid()}"
+        while not self._stopping.is_set():
+            try:
+                docs = self.queue.claim(worker)
+                if not docs:
+                    # 唤醒只在本进程内有效，其它进程登记的文档和到期的重试最迟 idle_poll 秒后自行认领
+                    self._wakeup.wait(self.idle_poll)
+                    self._wakeup.clear()
+                    continue
+                for doc in docs:
+                    self.process(doc, worker)
+            except Exception as e:
+                logger.error(f"文档处理线程 {worker} 异常: {str(e)}")
+                self._stopping.wait(self.poll_interval)
+
+    def process(self, doc: Dict[str, Any], worker: str) -> bool:
+        """
+        处理一个已认领的文档并更新状态
+        """
+        with self._lock:
+            self.busy += 1
+        try:
+            try:
+                with Lease(self.queue, doc, worker) as lease:
+                    local_path, hash_code, file_size = self.handler(doc, lease)
+            except LeaseLost:
+                # 文档已回到队列或被其它线程认领，不记录失败
+                self._count("abandoned")
+                logger.warning(f"文档ID {doc['id']} 的认领已失效，放弃处理")
+                return False
+            except self.requeue_errors as e:
+                message = f"处理被取消，重新入队: {str(e) or e.__class__.__name__}"
+                if self.queue.requeue(doc, worker, message):
+                    self._count("requeued")
+                    logger.warning(f"文档ID {doc['id']} {message}")
+                return False
+            except Exception as e:
+                message = str(e) or e.__class__.__name__
+                status = self.queue.fail(doc, worker, message, retry=not isinstance(e, self.permanent_errors),
+                                         outbox=lambda conn: self.notifier.enqueue(doc, False, message, conn))
+                if status == "init":
+                    self._count("retried")
+                    logger.warning(f"文档ID {doc['id']} 第 {doc['attempts']} 次处理失败，"
+                                   f"{self.queue.retry_delay(doc['attempts']):.0f}s 后重试: {message}")
+                elif status == "failed":
+                    self._count("failed")
+                    logger.error(f"文档ID {doc['id']} 处理失败: {message}")
+                    self.notifier.wake()
+                return False
+            if self.queue.complete(doc["id"], worker, local_path, hash_code, file_size,
+                                   outbox=lambda conn: self.notifier.enqueue(doc, True, "OK", conn)):
+                self._count("completed")
+                self.notifier.wake()
+                return True
+            logger.warning(f"文档ID {doc['id']} 的租约已失效，处理结果被丢弃")
+            return False
+        finally:
+            with self._lock:
+                self.busy -= 1
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+            if name == "completed":
+                self._finished.append(time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        吞吐指标：最近一分钟完成的文档数（docs/min）、队列深度、各类计数
+        """
+        with self._lock:
+            cutoff = time.monotonic() - 60
+            while self._finished and self._finished[0] < cutoff:
+                self._finished.popleft()
+            stats = {
+                "workers": self.workers,
+                "busy": self.busy,
+                "docs_per_minute": len(self._finished),
+                "completed": self.completed,
+                "failed": self.failed,
+                "retried": self.retried,
+                "recovered": self.recovered,
+                "abandoned": self.abandoned,
+                "requeued": self.requeued,
+            }
+        stats["queue"] = self.queue.depth()
+        return stats
@@ -0,0 +1,337 @@
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+
+import httpx
+
+#项目库
+from src.config import config
+from src.data.db.sqlinit import OUTBOX_PENDING_FILTER
+from src.services.db_services import database
+from src.utils.async_sqlite_utils import AsyncSQLiteUtils
+from src.utils.sqlite_utils import SQLiteUtils
+
+logger = logging.getLogger(__name__)
+
+# 保留最近多少次投递的耗时用于计算分位数
+_LATENCY_SAMPLES = 1000
+# 清理已投递通知的间隔（秒）
+_PURGE_INTERVAL = 3600
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+class NotificationDispatcher:
+    """
+    完成通知发件箱：enqueue 把回调写入 notifications 表后立即返回（可在任意线程、任意进程调用），
+    投递在事件循环中异步进行：按租约认领到期通知，每个主机最多认领到剩余的并发名额（认领后立即投递，
+    不在本地排队，避免排队超过租约后被重复认领），共享连接池发送，
+    主机连接失败或超时时暂停该主机的投递，失败按指数退避加随机抖动重试，超过最大次数标记为 dead
+    """
+    def __init__(self, db: SQLiteUtils, adb: Optional[AsyncSQLiteUtils] = None, concurrency: int = 32, per_host: int = 4,
+                 batch_size: int = 100, timeout: float = 10, max_attempts: int = 10, retry_base: float = 5,
+                 retry_max: float = 1800, poll_interval: float = 5, retention: float = 7 * 86400):
+        self.db = db
+        self.adb = adb
+        self.concurrency = max(concurrency, 1)
+        self.per_host = max(per_host, 1)
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self.retention = retention
+        # 认领租约覆盖一次请求和结果写入的时间，进程崩溃后租约到期的通知由其它进程重新认领
+        self.lease_seconds = max(timeout * 6, 60)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Set[asyncio.Task] = set()
+        self._host_inflight: Dict[str, int] = {} # 主机 -> 投递中的通知数
+        self._host_blocked: Dict[str, float] = {} # 主机 -> 暂停投递到期时间
+        self._host_failures: Dict[str, int] = {} # 主机 -> 连续连接失败次数
+        self._stopping = False
+        self._delivery_latency: "deque[float]" = deque(maxlen=_LATENCY_SAMPLES) # 登记到投递成功
+        self._request_latency: "deque[float]" = deque(maxlen=_LATENCY_SAMPLES) # 单次回调请求
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self.postponed = 0
+
+    def enqueue(self, doc: Dict[str, Any], success: bool, message: str,
+                conn: Optional[sqlite3.Connection] = None) -> Optional[int]:
+        """
+        登记一条完成通知，返回通知ID（文档没有 finish_url 时返回 None）
+        传入 conn 时在调用方的事务中写入（与文档状态一起提交），提交后由调用方调用 wake()
+        """
+        url = doc.get("finish_url")
+        if not url:
+            return None
+        now = time.time()
+        # 参数与原 requests.get(params=...) 的序列化保持一致
+        params = json.dumps({"success": str(success), "message": message}, ensure_ascii=False)
+        sql = "INSERT INTO notifications (doc_id, url, params, host, next_run_at, created_at) VALUES (?, ?, ?, ?, ?, ?) RETURNING id"
+        values = (doc.get("id"), url, params, urlsplit(url).netloc or "-", now, now)
+        if conn is not None:
+            return conn.execute(sql, values).fetchone()[0]
+        rows = self.db.fetchall(sql, values)
+        self.wake()
+        return rows[0]["id"]
+
+    def wake(self):
+        """
+        唤醒投递循环（线程安全，投递循环未在本进程运行时忽略）
+        """
+        loop = self._loop
+        if loop is not None and self._wakeup is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def retry_delay(self, attempts: int) -> float:
+        """
+        指数退避加随机抖动：取退避时间的一半加上 [0, 一半) 的随机值，避免大量通知在同一时刻重试
+        """
+        delay = min(self.retry_base * (2 ** max(attempts - 1, 0)), self.retry_max)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def start(self):
+        if self._runner is not None:
+            return
+        self.adb = self.adb or database()
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        )
+        self._runner = asyncio.create_task(self._run())
+        logger.info(f"完成通知投递已启动，并发: {self.concurrency}，单主机并发: {self.per_host}")
+
+    async def stop(self):
+        """
+        停止认领新通知，等待投递中的通知完成（最多一个超时周期），未完成的由租约到期后重新投递
+        """
+        if self._runner is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._runner
+        if self._inflight:
+            _, pending = await asyncio.wait(self._inflight, timeout=self.timeout + 1)
+            for task in pending:
+                task.cancel()
+        await self._client.aclose()
+        self._runner = self._client = self._loop = None
+
+    async def _run(self):
+        last_purge = 0.0
+        while not self._stopping:
+            try:
+                if time.time() - last_purge >= _PURGE_INTERVAL:
+                    last_purge = time.time()
+                    await self.purge()
+                free = self.concurrency - len(self._inflight)
+                batch = await self._claim(min(free, self.batch_size)) if free > 0 else []
+                for item in batch:
+                    task = asyncio.create_task(self._deliver(item))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._on_done)
+                # 没有到期通知或名额已满时，等待新通知登记、投递完成或轮询间隔
+                if not batch or len(batch) >= free:
+                    await self._wait(self.poll_interval)
+            except Exception as e:
+                logger.error(f"完成通知投递循环异常: {str(e)}")
+                await self._wait(self.poll_interval)
+
+    def _on_done(self, task: asyncio.Task):
+        self._inflight.discard(task)
+        self._wakeup.set()
+
+    async def _wait(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _claim(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        认领到期的待投递通知：跳过暂停投递的主机，每个主机按到期顺序最多认领 per_host 减去投递中的数量
+        """
+        now = time.time()
+        blocked = [host for host, until in self._host_blocked.items() if until > now]
+        host_filter = f"AND host NOT IN ({','.join('?' * len(blocked))})" if blocked else ""
+        inflight = json.dumps({host: count for host, count in self._host_inflight.items() if count > 0}, ensure_ascii=False)
+        rows = await self.adb.fetch_write(
+            f"""UPDATE notifications SET lease_until=?
+            WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, host, next_run_at, row_number() OVER (PARTITION BY host ORDER BY next_run_at) AS host_rank
+                    FROM notifications WHERE {OUTBOX_PENDING_FILTER} AND next_run_at<=?
+                        AND (lease_until IS NULL OR lease_until<?) {host_filter}
+                ) AS due
+                WHERE host_rank <= ? - coalesce((SELECT value FROM json_each(?) WHERE key=due.host), 0)
+                ORDER BY next_run_at LIMIT ?)
+            RETURNING id, url, params, host, attempts, created_at""",
+            (now + self.lease_seconds, now, now, *blocked, self.per_host, inflight, limit)
+        )
+        for item in rows:
+            self._host_inflight[item["host"]] = self._host_inflight.get(item["host"], 0) + 1
+        return rows
+
+    async def _deliver(self, item: Dict[str, Any]):
+        host = item["host"]
+        try:
+            # 认领后该主机的其它请求连接失败而被暂停时，不计入尝试次数，顺延到暂停结束
+            blocked_until = self._host_blocked.get(host, 0)
+            if blocked_until > time.time():
+                self.postponed += 1
+                await self.adb.execute(
+                    "UPDATE notifications SET next_run_at=?, lease_until=NULL WHERE id=?", (blocked_until, item["id"])
+                )
+                return
+            start = time.perf_counter()
+            try:
+                response = await self._client.get(item["url"], params=json.loads(item["params"] or "{}"))
+            except httpx.TransportError as e:
+                self._block_host(host)
+                await self._failed(item, f"{e.__class__.__name__}: {str(e)}")
+                return
+            except Exception as e:
+                await self._failed(item, str(e) or e.__class__.__name__)
+                return
+            finally:
+                self._request_latency.append(time.perf_counter() - start)
+            self._host_failures.pop(host, None)
+            self._host_blocked.pop(host, None)
+            if response.status_code < 400:
+                await self._succeeded(item)
+            else:
+                # 4xx 中只有超时和限流值得重试，其余为永久失败
+                permanent = response.status_code < 500 and response.status_code not in (408, 429)
+                await self._failed(item, f"HTTP {response.status_code}", permanent)
+        finally:
+            self._host_inflight[host] -= 1
+            if not self._host_inflight[host]:
+                del self._host_inflight[host]
+
+    def _block_host(self, host: str):
+        """
+        主机连接失败或超时：按连续失败次数退避暂停该主机，避免其余通知继续占用连接等待超时
+        """
+        failures = self._host_failures.get(host, 0) + 1
+        self._host_failures[host] = failures
+        self._host_blocked[host] = time.time() + self.retry_delay(failures)
+
+    async def _succeeded(self, item: Dict[str, Any]):
+        now = time.time()
+        await self.adb.execute(
+            """UPDATE notifications SET status='sent', attempts=attempts+1, sent_at=?, lease_until=NULL, last_error=NULL
+            WHERE id=?""",
+            (now, item["id"])
+        )
+        self.sent += 1
+        self._delivery_latency.append(now - item["created_at"])
+
+    async def _failed(self, item: Dict[str, Any], error: str, permanent: bool = False):
+        attempts = item["attempts"] + 1
+        if permanent or attempts >= self.max_attempts:
+            self.dead += 1
+            logger.error(f"完成通知 {item['id']} 投递失败（{attempts} 次），不再重试: {item['url']} {error}")
+            await self.adb.execute(
+                "UPDATE notifications SET status='dead', attempts=?, last_error=?, lease_until=NULL WHERE id=?",
+                (attempts, error, item["id"])
+            )
+            return
+        delay = self.retry_delay(attempts)
+        self.retried += 1
+        logger.warning(f"完成通知 {item['id']} 第 {attempts} 次投递失败，{delay:.0f}s 后重试: {item['host']} {error}")
+        await self.adb.execute(
+            "UPDATE notifications SET attempts=?, last_error=?, next_run_at=?, lease_until=NULL WHERE id=?",
+            (attempts, error, time.time() + delay, item["id"])
+        )
+
+    async def purge(self) -> int:
+        """
+        删除超过保留期的已投递通知（dead 通知保留，便于排查后手工重投）
+        """
+        removed = await self.adb.execute(
+            "DELETE FROM notifications WHERE status='sent' AND created_at<?", (time.time() - self.retention,)
+        )
+        if removed:
+            logger.info(f"清理了 {removed} 条已投递的完成通知")
+        return removed
+
+    async def stats(self) -> Dict[str, Any]:
+        """
+        积压和投递指标：pending 待投递（due 已到期），oldest_pending_seconds 最早待投递通知的等待时长，
+        delivery_* 为登记到投递成功的耗时，request_* 为单次回调请求耗时
+        """
+        now = time.time()
+        db = self.adb or database()
+        row = await db.fetchone(
+            f"""SELECT count(*) AS pending, coalesce(sum(next_run_at<=?), 0) AS due, min(created_at) AS oldest
+            FROM notifications WHERE {OUTBOX_PENDING_FILTER}""",
+            (now,)
+        )
+        dead = await db.fetchone("SELECT count(*) AS dead FROM notifications WHERE status='dead'")
+        delivery, request = list(self._delivery_latency), list(self._request_latency)
+        return {
+            "pending": row["pending"],
+            "due": row["due"],
+            "dead": dead["dead"],
+            "oldest_pending_seconds": round(now - row["oldest"], 1) if row["oldest"] else 0,
+            "inflight": len(self._inflight),
+            "blocked_hosts": sorted(host for host, until in self._host_blocked.items() if until > now),
+            "sent": self.sent,
+            "retried": self.retried,
+            "dead_total": self.dead,
+            "postponed": self.postponed,
+            "delivery_p50_ms": round(_percentile(delivery, 0.5) * 1000, 1),
+            "delivery_p95_ms": round(_percentile(delivery, 0.95) * 1000, 1),
+            "request_p50_ms": round(_percentile(request, 0.5) * 1000, 1),
+            "request_p95_ms": round(_percentile(request, 0.95) * 1000, 1),
+        }
+
+    @classmethod
+    def from_config(cls, db: SQLiteUtils) -> "NotificationDispatcher":
+        return cls(
+            db,
+            concurrency=config.NOTIFY_CONCURRENCY,
+            per_host=config.NOTIFY_PER_HOST,
+            batch_size=config.NOTIFY_BATCH_SIZE,
+            timeout=config.NOTIFY_TIMEOUT,
+            max_attempts=config.NOTIFY_MAX_ATTEMPTS,
+            retry_base=config.NOTIFY_RETRY_BASE,
+            retry_max=config.NOTIFY_RETRY_MAX,
+            poll_interval=config.NOTIFY_POLL_INTERVAL,
+            retention=config.NOTIFY_RETENTION
+        )
+
+
+_dispatcher: Optional[NotificationDispatcher] = None
+_dispatcher_lock = threading.Lock()
+def notification_dispatcher() -> NotificationDispatcher:
+    """
+    获取全局的完成通知发件箱
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher.from_config(SQLiteUtils(config.DB_PATH))
+        return _dispatcher
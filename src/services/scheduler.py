@@ -0,0 +1,218 @@
+import logging
+import os
+import socket
+import itertools
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+#项目库
+from src.config import config
+from src.utils.sqlite_utils import SQLiteUtils
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """
+    基于 leader_locks 表的租约锁：持有者定期续期，租约过期后其它进程可以抢占
+    """
+    def __init__(self, db: SQLiteUtils, name: str, owner: str, ttl: float = 30):
+        self.db = db
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+
+    def acquire(self) -> bool:
+        """
+        获取或续期锁，返回当前是否持有
+        """
+        now = time.time()
+        return self.db.execute(
+            """INSERT INTO leader_locks (name, owner, expires_at, acquired_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at,
+                acquired_at=CASE WHEN leader_locks.owner=excluded.owner THEN leader_locks.acquired_at ELSE excluded.acquired_at END
+            WHERE leader_locks.owner=excluded.owner OR leader_locks.expires_at<?""",
+            (self.name, self.owner, now + self.ttl, now, now)
+        ) > 0
+
+    def release(self):
+        self.db.execute("DELETE FROM leader_locks WHERE name=? AND owner=?", (self.name, self.owner))
+
+    def holder(self) -> Optional[Dict[str, Any]]:
+        return self.db.fetchone("SELECT owner, expires_at, acquired_at FROM leader_locks WHERE name=?", (self.name,))
+
+
+class Job:
+    """
+    定时任务：func() 返回下次执行的间隔（秒），返回 None 时使用固定的 interval
+    """
+    def __init__(self, name: str, func: Callable[[], Optional[float]], interval: float, leader_only: bool = True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.leader_only = leader_only
+        self.next_run = 0.0
+        self.woken = 0 # 最近一次唤醒的序号，执行期间被唤醒时结束后立即再执行
+        self.last_delay = interval
+        self.runs = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+
+class Scheduler:
+    """
+    定时任务调度线程，随应用生命周期启动和停止：
+    只有持有主节点锁的进程执行 leader_only 任务（多个 uvicorn worker 中只有一个轮询），
+    主节点锁由单独的线程续期，耗时超过租约的任务（如无引用文件清理）不会导致锁过期被其它进程抢占；
+    任务可返回自适应的下次执行间隔，wake(name) 让本进程的任务立即执行
+    """
+    def __init__(self, lock: LeaderLock):
+        self.lock = lock
+        self.is_leader = False
+        self._jobs: Dict[str, Job] = {}
+        self._wake_seq = itertools.count(1)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock_thread: Optional[threading.Thread] = None
+
+    def add_job(self, name: str, func: Callable[[], Optional[float]], interval: float, leader_only: bool = True):
+        self._jobs[name] = Job(name, func, interval, leader_only)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._lock_thread = threading.Thread(target=self._hold_lock, name="scheduler-lock", daemon=True)
+        self._lock_thread.start()
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"定时任务调度已启动: {self.lock.owner}")
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        停止调度（等待正在执行的任务结束），释放主节点锁以便其它进程立即接管
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in (self._thread, self._lock_thread):
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        self._thread = self._lock_thread = None
+        if self.is_leader:
+            try:
+                self.lock.release()
+            except Exception as e:
+                logger.error(f"释放主节点锁失败: {str(e)}")
+            self.is_leader = False
+
+    def wake(self, name: Optional[str] = None):
+        """
+        让指定任务（或全部任务）立即执行
+        """
+        for job in self._jobs.values():
+            if name is None or job.name == name:
+                self._wake_job(job)
+        self._wakeup.set()
+
+    def _wake_job(self, job: Job):
+        job.woken = next(self._wake_seq)
+        job.next_run = 0.0
+
+    def _hold_lock(self):
+        # 在租约的三分之一处续期；非主节点按同样间隔尝试接管
+        while not self._stopping.is_set():
+            self._renew_lock()
+            self._stopping.wait(self.lock.ttl / 3)
+
+    def _renew_lock(self):
+        try:
+            leader = self.lock.acquire()
+        except Exception as e:
+            # 数据库暂时不可用时放弃主节点身份，避免租约过期后出现两个主节点
+            logger.error(f"续期主节点锁失败: {str(e)}")
+            leader = False
+        if leader != self.is_leader:
+            logger.info(f"{self.lock.owner} {'成为' if leader else '不再是'}定时任务主节点")
+            if leader:
+                # 新主节点立即执行一轮任务
+                for job in self._jobs.values():
+                    self._wake_job(job)
+        self.is_leader = leader
+        if leader:
+            self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            now = time.monotonic()
+            for job in self._jobs.values():
+                if self._stopping.is_set():
+                    break
+                if job.leader_only and not self.is_leader:
+                    continue
+                if job.next_run > now:
+                    continue
+                self._run_job(job)
+                now = time.monotonic()
+            runnable = [job.next_run for job in self._jobs.values() if self.is_leader or not job.leader_only]
+            # 没有可执行的任务时（非主节点）等待成为主节点或停止
+            wait = min(runnable) - time.monotonic() if runnable else None
+            if wait is None or wait > 0:
+                self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+    def _run_job(self, job: Job):
+        woken = job.woken
+        try:
+            delay = job.func()
+            job.last_error = None
+        except Exception as e:
+            delay = None
+            job.errors += 1
+            job.last_error = str(e)
+            logger.error(f"定时任务 {job.name} 执行失败: {str(e)}")
+        job.runs += 1
+        job.last_delay = job.interval if delay is None else max(delay, 0)
+        # 执行期间被唤醒（如轮询时登记了新文档）时不覆盖唤醒，下一轮立即再执行
+        job.next_run = 0.0 if job.woken != woken else time.monotonic() + job.last_delay
+
+    @classmethod
+    def from_config(cls, db: SQLiteUtils) -> "Scheduler":
+        # 主机名 + 进程ID 区分多进程部署的调度实例
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+        return cls(LeaderLock(db, "scheduler", owner, ttl=config.SCHEDULER_LOCK_TTL))
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "owner": self.lock.owner,
+            "leader": self.is_leader,
+            "jobs": [
+                {
+                    "name": job.name,
+                    "runs": job.runs,
+                    "errors": job.errors,
+                    "last_error": job.last_error,
+                    "interval": round(job.last_delay, 2),
+                    "next_run_in": round(max(job.next_run - now, 0), 2) if self.is_leader or not job.leader_only else None,
+                }
+                for job in self._jobs.values()
+            ],
+        }
+
+
+class AdaptivePoll:
+    """
+    自适应轮询间隔：有工作时使用最小间隔，连续空闲时逐次加倍到最大间隔
+    """
+    def __init__(self, minimum: float, maximum: float):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.current = minimum
+
+    def next(self, busy: bool) -> float:
+        self.current = self.minimum if busy else min(self.current * 2, self.maximum)
+        return self.current
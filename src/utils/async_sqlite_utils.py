@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+#项目库
+from src.utils.sqlite_utils import SQLiteUtils
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSQLiteUtils:
+    """
+    SQLiteUtils 的异步封装，接口与 SQLiteUtils 一致：
+    查询在读线程池中执行（WAL 模式下可并发读），写入统一交给单个写线程，
+    写线程把队列中积压的写操作合并到一个事务里提交（每个操作用 SAVEPOINT 隔离，单个失败不影响其它）
+    """
+    def __init__(self, db_path: str, read_threads: int = 4, write_batch: int = 64):
+        self.db_path = db_path
+        self.write_batch = max(write_batch, 1)
+        self._db = SQLiteUtils(db_path)
+        self._readers = ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix="sqlite-read")
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="sqlite-write", daemon=True)
+        self._writer.start()
+        self.commits = 0
+        self.writes = 0
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            # 合并队列中已积压的写操作
+            while len(batch) < self.write_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch: List[tuple]):
+        results = []
+        try:
+            with self._db.transaction() as conn:
+                for func, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.execute("SAVEPOINT batch_item")
+                    try:
+                        results.append((future, func(conn), None))
+                        conn.execute("RELEASE batch_item")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO batch_item")
+                        conn.execute("RELEASE batch_item")
+                        results.append((future, None, e))
+        except Exception as e:
+            # 提交失败：整批写入都未生效
+            logger.error(f"数据库批量写入提交失败: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.commits += 1
+        self.writes += len(results)
+        # 提交成功后再通知调用方，保证随后的查询能读到写入结果
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    async def write(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """
+        在写线程的事务中执行 func(conn)，返回其结果
+        """
+        if not self._writer.is_alive():
+            raise RuntimeError("数据库写线程已关闭")
+        future: Future = Future()
+        self._queue.put((func, future))
+        return await asyncio.wrap_future(future)
+
+    async def execute(self, sql: str, params: Optional[Tuple[Any, ...]] = None) -> int:
+        """
+        执行单条写入语句，返回受影响的行数
+        """
+        return await self.write(lambda conn: conn.execute(sql, params or ()).rowcount)
+
+    async def executemany(self, sql: str, param_list: List[Tuple[Any, ...]]) -> int:
+        return await self.write(lambda conn: conn.executemany(sql, param_list).rowcount)
+
+    async def fetch_write(self, sql: str, params: Optional[Tuple[Any, ...]] = None) -> List[Dict[str, Any]]:
+        """
+        在写线程执行带 RETURNING 的写入语句，返回记录列表
+        """
+        return await self.write(lambda conn: [dict(row) for row in conn.execute(sql, params or ()).fetchall()])
+
+    async def _read(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._readers, func, *args)
+
+    async def fetchone(self, sql: str, params: Optional[Tuple[Any, ...]] = None) -> Optional[Dict[str, Any]]:
+        return await self._read(self._db.fetchone, sql, params)
+
+    async def fetchall(self, sql: str, params: Optional[Tuple[Any, ...]] = None) -> List[Dict[str, Any]]:
+        return await self._read(self._db.fetchall, sql, params)
+
+    async def table_exists(self, table_name: str) -> bool:
+        return await self._read(self._db.table_exists, table_name)
+
+    async def close(self):
+        """
+        处理完已排队的写入后停止写线程和读线程池
+        """
+        if self._writer.is_alive():
+            self._queue.put(None)
+            await asyncio.to_thread(self._writer.join)
+        self._readers.shutdown(wait=True)
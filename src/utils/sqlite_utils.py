@@ -1,42 +1,120 @@
+import os
 import sqlite3
-from typing import Any, List, Tuple, Dict, Optional
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class _ConnectionPool:
+    """
+    按线程复用的连接池：每个线程持有一个长连接（WAL 模式、synchronous=NORMAL、忙等待超时、语句缓存），
+    同一数据库文件的所有 SQLiteUtils 实例共享一个连接池
+    """
+    def __init__(self, db_path: str, busy_timeout: float = 30.0, cached_statements: int = 256):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._conns: Dict[int, sqlite3.Connection] = {}
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            isolation_level=None, # 自动提交，事务由 transaction() 显式控制
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        return conn
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                # 清理已退出线程遗留的连接
+                alive = {t.ident for t in threading.enumerate()}
+                for ident in [i for i in self._conns if i not in alive]:
+                    self._conns.pop(ident).close()
+                self._conns[threading.get_ident()] = conn
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._conns.values():
+                conn.close()
+            self._conns.clear()
+        self._local = threading.local()
+
 
 class SQLiteUtils:
+    _pools: Dict[str, _ConnectionPool] = {}
+    _pools_lock = threading.Lock()
+
     def __init__(self, db_path: str):
         """
         初始化数据库工具类
         :param db_path: 数据库文件路径
         """
         self.db_path = db_path
+        key = os.path.abspath(db_path)
+        with SQLiteUtils._pools_lock:
+            pool = SQLiteUtils._pools.get(key)
+            if pool is None:
+                pool = SQLiteUtils._pools[key] = _ConnectionPool(db_path)
+        self._pool = pool
+
+    def _get_conn(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接（复用）"""
+        return self._pool.get()
 
-    def _get_conn(self):
-        """获取数据库连接"""
-        return sqlite3.connect(self.db_path)
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        显式事务：以 BEGIN IMMEDIATE 开始（提前获取写锁，避免并发写入时升级锁失败），
+        正常结束提交，异常回滚；嵌套调用时并入外层事务
+        """
+        conn = self._get_conn()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            # COMMIT 失败（如延迟外键约束）时事务仍未结束，必须回滚，否则该线程的连接一直处于事务中；
+            # SQLite 已自动回滚的错误（如 SQLITE_FULL）不再回滚，保留原始异常
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
 
-    def execute(self, sql: str, params: Optional[Tuple[Any, ...]] = None) -> None:
+    def execute(self, sql: str, params: Optional[Tuple[Any, ...]] = None) -> int:
         """
         执行单条SQL语句（无返回结果，如建表、插入、更新、删除）
         :param sql: SQL语句
         :param params: 参数元组
+        :return: 受影响的行数
         """
-        with self._get_conn() as conn:
-            cursor = conn.cursor()
-            if params:
-                cursor.execute(sql, params)
-            else:
-                cursor.execute(sql)
-            conn.commit()
+        cursor = self._get_conn().execute(sql, params or ())
+        return cursor.rowcount
 
-    def executemany(self, sql: str, param_list: List[Tuple[Any, ...]]) -> None:
+    def executemany(self, sql: str, param_list: List[Tuple[Any, ...]]) -> int:
         """
-        批量执行SQL语句
+        批量执行SQL语句（单个事务内完成）
         :param sql: SQL语句
         :param param_list: 参数列表
+        :return: 受影响的行数
         """
-        with self._get_conn() as conn:
-            cursor = conn.cursor()
-            cursor.executemany(sql, param_list)
-            conn.commit()
+        with self.transaction() as conn:
+            cursor = conn.executemany(sql, param_list)
+            return cursor.rowcount
 
     def fetchone(self, sql: str, params: Optional[Tuple[Any, ...]] = None) -> Optional[Dict[str, Any]]:
         """
@@ -45,26 +123,22 @@ class SQLiteUtils:
         :param params: 参数元组
         :return: 单条记录（字典），无结果返回None
         """
-        with self._get_conn() as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute(sql, params or ())
+        cursor = self._get_conn().execute(sql, params or ())
+        try:
             row = cursor.fetchone()
-            return dict(row) if row else None
+        finally:
+            cursor.close()
+        return dict(row) if row else None
 
     def fetchall(self, sql: str, params: Optional[Tuple[Any, ...]] = None) -> List[Dict[str, Any]]:
         """
-        查询多条记录
+        查询多条记录（也可用于 UPDATE ... RETURNING）
         :param sql: SQL语句
         :param params: 参数元组
         :return: 记录列表（每条为字典）
         """
-        with self._get_conn() as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute(sql, params or ())
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+        rows = self._get_conn().execute(sql, params or ()).fetchall()
+        return [dict(row) for row in rows]
 
     def table_exists(self, table_name: str) -> bool:
         """
@@ -75,3 +149,46 @@ class SQLiteUtils:
         sql = "SELECT count(*) FROM sqlite_master WHERE type='table' AND name=?"
         result = self.fetchone(sql, (table_name,))
         return result is not None and list(result.values())[0] > 0
+
+    def close(self):
+        """
+        关闭该数据库文件的所有连接（应用退出时调用）
+        """
+        self._pool.close()
+
+
+def benchmark(db_path: str, ops: int = 5000, threads: int = 4):
+    """
+    对比每次操作新建连接与连接池的写入/查询吞吐
+    """
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    db = SQLiteUtils(db_path)
+    db.execute("CREATE TABLE IF NOT EXISTS bench (id INTEGER PRIMARY KEY, status TEXT)")
+    db.executemany("INSERT OR REPLACE INTO bench (id, status) VALUES (?, ?)", [(i, "init") for i in range(ops)])
+
+    def _legacy(i: int):
+        with sqlite3.connect(db_path, timeout=30) as conn:
+            conn.execute("UPDATE bench SET status=? WHERE id=?", ("doing", i))
+            conn.commit()
+            conn.execute("SELECT * FROM bench WHERE id=?", (i,)).fetchone()
+
+    def _pooled(i: int):
+        db.execute("UPDATE bench SET status=? WHERE id=?", ("ok", i))
+        db.fetchone("SELECT * FROM bench WHERE id=?", (i,))
+
+    for name, func in (("每次新建连接", _legacy), ("连接池", _pooled)):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(func, range(ops)))
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {ops / elapsed:.0f} ops/s（{threads} 线程，每次操作 1 次更新 + 1 次查询）")
+    db.execute("DROP TABLE bench")
+    db.close()
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else os.path.join(tempfile.mkdtemp(), "bench.db"))
@@ -0,0 +1,407 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+
+class _Segment:
+    """
+    一个只追加的向量段：<name>.f32 为 float32 矩阵（行数 x 维度），<name>.ids 为 int64 外部ID
+    """
+    def __init__(self, root: str, name: str, dim: int, rows: int):
+        self.root = root
+        self.name = name
+        self.dim = dim
+        self.rows = rows
+        self._vectors: Optional[np.ndarray] = None
+        self._ids: Optional[np.ndarray] = None
+
+    @property
+    def vector_path(self) -> str:
+        return os.path.join(self.root, f"{self.name}.f32")
+
+    @property
+    def ids_path(self) -> str:
+        return os.path.join(self.root, f"{self.name}.ids")
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray):
+        # 上次写入中途崩溃时文件尾部可能有清单未记录的数据，先截断
+        for path, width in ((self.vector_path, self.dim * 4), (self.ids_path, 8)):
+            if os.path.exists(path) and os.path.getsize(path) != self.rows * width:
+                os.truncate(path, self.rows * width)
+        with open(self.vector_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.ids_path, "ab") as f:
+            f.write(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+        self.rows += len(ids)
+        # 行数变化后重新映射
+        self._vectors = self._ids = None
+
+    @property
+    def vectors(self) -> np.ndarray:
+        if self._vectors is None:
+            if self.rows == 0:
+                self._vectors = np.empty((0, self.dim), dtype=np.float32)
+            else:
+                self._vectors = np.memmap(self.vector_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+        return self._vectors
+
+    @property
+    def ids(self) -> np.ndarray:
+        if self._ids is None:
+            if self.rows == 0:
+                self._ids = np.empty(0, dtype=np.int64)
+            else:
+                self._ids = np.fromfile(self.ids_path, dtype=np.int64, count=self.rows)
+        return self._ids
+
+
+class _IVFIndex:
+    """
+    倒排文件索引：k-means 聚类中心 + 每个簇的全局行号列表，查询时只扫描最相近的 nprobe 个簇
+    构建之后追加的行（covered 之后）不在索引中，查询时全量扫描
+    """
+    def __init__(self, centroids: np.ndarray, lists: List[np.ndarray], covered: int):
+        self.centroids = centroids
+        self.lists = lists
+        self.covered = covered
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, nlist: int, iterations: int = 10, sample: int = 100000, seed: int = 0) -> "_IVFIndex":
+        rng = np.random.default_rng(seed)
+        rows = len(vectors)
+        nlist = max(1, min(nlist, rows))
+        train = np.asarray(vectors[np.sort(rng.choice(rows, min(sample, rows), replace=False))])
+        centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, train)
+            # 空簇保留原中心
+            filled = np.bincount(assign, minlength=nlist) > 0
+            norms = np.linalg.norm(sums[filled], axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids[filled] = sums[filled] / norms
+        # 分批分配全部向量，避免一次生成 rows x nlist 的大矩阵
+        assign = np.empty(rows, dtype=np.int32)
+        for start in range(0, rows, 65536):
+            assign[start:start + 65536] = np.argmax(np.asarray(vectors[start:start + 65536]) @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        lists = [order[bounds[c]:bounds[c + 1]].astype(np.int64) for c in range(nlist)]
+        return cls(centroids.astype(np.float32), lists, rows)
+
+    def save(self, root: str):
+        np.save(os.path.join(root, "ivf_centroids.npy"), self.centroids)
+        offsets = np.cumsum([0] + [len(items) for items in self.lists]).astype(np.int64)
+        np.save(os.path.join(root, "ivf_offsets.npy"), offsets)
+        np.save(os.path.join(root, "ivf_rows.npy"), np.concatenate(self.lists) if self.lists else np.empty(0, np.int64))
+
+    @classmethod
+    def load(cls, root: str, covered: int) -> Optional["_IVFIndex"]:
+        path = os.path.join(root, "ivf_centroids.npy")
+        if not os.path.exists(path):
+            return None
+        offsets = np.load(os.path.join(root, "ivf_offsets.npy"))
+        rows = np.load(os.path.join(root, "ivf_rows.npy"))
+        lists = [rows[offsets[c]:offsets[c + 1]] for c in range(len(offsets) - 1)]
+        return cls(np.load(path), lists, covered)
+
+
+class VectorStore:
+    """
+    本地向量库：float32 矩阵按段只追加写入并以内存映射读取，删除用位图标记，
+    查询为分段矩阵乘 + argpartition 取 top-k；metric 为 cosine 时写入前归一化，查询等价于内积
+    可选构建 IVF 索引加速大规模查询
+    """
+    def __init__(self, root: str, dim: Optional[int] = None, metric: str = "cosine", segment_rows: int = 262144):
+        self.root = root
+        self.segment_rows = segment_rows
+        self._lock = threading.RLock()
+        os.makedirs(root, exist_ok=True)
+        manifest_path = os.path.join(root, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            self.dim = manifest["dim"]
+            self.metric = manifest["metric"]
+            self._segments = [_Segment(root, s["name"], self.dim, s["rows"]) for s in manifest["segments"]]
+            self._ivf_covered = manifest.get("ivf_covered", 0)
+        else:
+            self.dim = dim
+            self.metric = metric
+            self._segments: List[_Segment] = []
+            self._ivf_covered = 0
+        if self.metric not in ("cosine", "ip"):
+            raise ValueError(f"不支持的相似度: {self.metric}")
+        self._deleted = self._load_deleted()
+        self._ivf = _IVFIndex.load(root, self._ivf_covered) if self._ivf_covered else None
+        self._id_rows: Optional[Dict[int, int]] = None
+
+    # ---------- 持久化 ----------
+
+    def _save_manifest(self):
+        manifest = {
+            "dim": self.dim,
+            "metric": self.metric,
+            "segments": [{"name": s.name, "rows": s.rows} for s in self._segments],
+            "ivf_covered": self._ivf.covered if self._ivf else 0,
+        }
+        tmp = os.path.join(self.root, MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.root, MANIFEST))
+
+    def _load_deleted(self) -> np.ndarray:
+        path = os.path.join(self.root, "deleted.bits")
+        total = self.rows
+        bits = np.zeros(total, dtype=bool)
+        if os.path.exists(path):
+            packed = np.fromfile(path, dtype=np.uint8)
+            saved = np.unpackbits(packed)[:total].astype(bool)
+            bits[:len(saved)] = saved
+        return bits
+
+    def _save_deleted(self):
+        tmp = os.path.join(self.root, "deleted.bits.tmp")
+        np.packbits(self._deleted).tofile(tmp)
+        os.replace(tmp, os.path.join(self.root, "deleted.bits"))
+
+    # ---------- 写入 ----------
+
+    @property
+    def rows(self) -> int:
+        return sum(s.rows for s in self._segments)
+
+    def __len__(self) -> int:
+        return self.rows - int(self._deleted.sum())
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        if self.metric == "cosine":
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors = vectors / norms
+        return vectors
+
+    def _rows_of(self, ids: Sequence[int]) -> np.ndarray:
+        """
+        外部ID -> 未删除的全局行号
+        """
+        if self._id_rows is None:
+            self._id_rows = {}
+            offset = 0
+            for segment in self._segments:
+                for row, vid in enumerate(segment.ids.tolist()):
+                    if not self._deleted[offset + row]:
+                        self._id_rows[vid] = offset + row
+                offset += segment.rows
+        rows = [self._id_rows[i] for i in ids if i in self._id_rows]
+        return np.asarray(rows, dtype=np.int64)
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray):
+        """
+        追加向量；已存在的ID先标记删除（即更新）
+        """
+        if not len(ids):
+            return
+        with self._lock:
+            vectors = self._normalize(vectors)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度不一致：库为 {self.dim}，写入为 {vectors.shape[1]}")
+            self._mark_deleted(ids)
+            ids = np.asarray(ids, dtype=np.int64)
+            start = 0
+            while start < len(ids):
+                if not self._segments or self._segments[-1].rows >= self.segment_rows:
+                    self._segments.append(_Segment(self.root, f"seg_{len(self._segments):05d}", self.dim, 0))
+                segment = self._segments[-1]
+                take = min(self.segment_rows - segment.rows, len(ids) - start)
+                first_row = self.rows
+                segment.append(ids[start:start + take], vectors[start:start + take])
+                if self._id_rows is not None:
+                    for offset, vid in enumerate(ids[start:start + take].tolist()):
+                        self._id_rows[vid] = first_row + offset
+                start += take
+            self._deleted = np.concatenate([self._deleted, np.zeros(self.rows - len(self._deleted), dtype=bool)])
+            self._save_deleted()
+            self._save_manifest()
+
+    def _mark_deleted(self, ids: Sequence[int]) -> int:
+        rows = self._rows_of(ids)
+        if len(rows):
+            self._deleted[rows] = True
+            for i in ids:
+                self._id_rows.pop(i, None)
+        return len(rows)
+
+    def delete(self, ids: Sequence[int]) -> int:
+        with self._lock:
+            removed = self._mark_deleted(ids)
+            if removed:
+                self._save_deleted()
+            return removed
+
+    # ---------- 查询 ----------
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        if len(scores) <= k:
+            return np.argsort(-scores)
+        part = np.argpartition(-scores, k)[:k]
+        return part[np.argsort(-scores[part])]
+
+    def _gather(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按全局行号取向量和ID
+        """
+        rows = np.sort(rows)
+        vectors = np.empty((len(rows), self.dim), dtype=np.float32)
+        ids = np.empty(len(rows), dtype=np.int64)
+        offset = 0
+        for segment in self._segments:
+            lo, hi = np.searchsorted(rows, [offset, offset + segment.rows])
+            if hi > lo:
+                local = rows[lo:hi] - offset
+                vectors[lo:hi] = segment.vectors[local]
+                ids[lo:hi] = segment.ids[local]
+            offset += segment.rows
+        return vectors, ids
+
+    def search(self, query: np.ndarray, k: int = 10, ids: Optional[Sequence[int]] = None,
+               nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        返回 [(ID, 相似度)]；ids 限定候选范围（只计算这些向量），nprobe 指定时使用 IVF 索引
+        """
+        with self._lock:
+            if self.dim is None or self.rows == 0:
+                return []
+            q = self._normalize(query)[0]
+            if ids is not None:
+                return self._search_rows(q, self._rows_of(ids), k)
+            if nprobe and self._ivf is not None:
+                probe = self._top_k(self._ivf.centroids @ q, nprobe)
+                rows = [self._ivf.lists[c] for c in probe]
+                # 索引构建之后追加的行全部参与计算
+                rows.append(np.arange(self._ivf.covered, self.rows, dtype=np.int64))
+                return self._search_rows(q, np.concatenate(rows), k)
+            best_scores: List[np.ndarray] = []
+            best_ids: List[np.ndarray] = []
+            offset = 0
+            for segment in self._segments:
+                scores = segment.vectors @ q
+                scores[self._deleted[offset:offset + segment.rows]] = -np.inf
+                top = self._top_k(scores, k)
+                best_scores.append(scores[top])
+                best_ids.append(segment.ids[top])
+                offset += segment.rows
+            scores, found = np.concatenate(best_scores), np.concatenate(best_ids)
+            top = self._top_k(scores, k)
+            return [(int(found[i]), float(scores[i])) for i in top if scores[i] > -np.inf]
+
+    def _search_rows(self, q: np.ndarray, rows: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        rows = rows[~self._deleted[rows]] if len(rows) else rows
+        if not len(rows):
+            return []
+        vectors, found = self._gather(rows)
+        scores = vectors @ q
+        top = self._top_k(scores, k)
+        return [(int(found[i]), float(scores[i])) for i in top]
+
+    # ---------- 索引 ----------
+
+    def build_ivf(self, nlist: Optional[int] = None, iterations: int = 10) -> int:
+        """
+        对当前全部向量构建 IVF 索引（默认 nlist = sqrt(行数)），返回簇数
+        构建过程不持有锁，期间的查询继续使用旧索引，新追加的行由查询时全量扫描覆盖
+        """
+        with self._lock:
+            segments = [(s.vectors, s.rows) for s in self._segments]
+        rows = sum(count for _, count in segments)
+        if rows == 0:
+            return 0
+        vectors = np.concatenate([v for v, _ in segments]) if len(segments) > 1 else segments[0][0]
+        nlist = nlist or max(int(np.sqrt(rows)), 1)
+        start = time.perf_counter()
+        ivf = _IVFIndex.build(vectors, nlist, iterations)
+        with self._lock:
+            self._ivf = ivf
+            ivf.save(self.root)
+            self._save_manifest()
+        logger.info(f"IVF 索引构建完成: {rows} 行，{nlist} 簇，耗时 {time.perf_counter() - start:.1f}s")
+        return nlist
+
+    def needs_ivf(self, min_rows: int, stale_ratio: float = 0.2) -> bool:
+        """
+        行数达到 min_rows 且尚无索引，或索引之后追加的行超过 stale_ratio 时需要（重新）构建
+        """
+        rows = self.rows
+        if rows < min_rows:
+            return False
+        return self._ivf is None or rows - self._ivf.covered > rows * stale_ratio
+
+    @property
+    def has_ivf(self) -> bool:
+        return self._ivf is not None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "dim": self.dim or 0,
+            "rows": self.rows,
+            "live": len(self),
+            "segments": len(self._segments),
+            "ivf_lists": len(self._ivf.lists) if self._ivf else 0,
+            "ivf_unindexed": self.rows - self._ivf.covered if self._ivf else self.rows,
+        }
+
+
+def benchmark(root: str, sizes: Sequence[int] = (100000, 1000000), dim: int = 128, queries: int = 200, k: int = 10):
+    """
+    在聚类分布的随机向量上测试暴力检索和 IVF 检索的 QPS 及 recall@k（以暴力检索结果为基准）
+    """
+    rng = np.random.default_rng(42)
+    for size in sizes:
+        path = os.path.join(root, f"bench_{size}")
+        store = VectorStore(path, dim=dim)
+        centers = rng.standard_normal((2048, dim)).astype(np.float32)
+        start = time.perf_counter()
+        for begin in range(0, size, 100000):
+            count = min(100000, size - begin)
+            data = centers[rng.integers(0, len(centers), count)] + 1.0 * rng.standard_normal((count, dim)).astype(np.float32)
+            store.add(np.arange(begin, begin + count), data)
+        print(f"[{size} 条 x {dim} 维] 写入 {time.perf_counter() - start:.1f}s")
+        query_vectors = centers[rng.integers(0, len(centers), queries)] + 1.0 * rng.standard_normal((queries, dim)).astype(np.float32)
+
+        start = time.perf_counter()
+        truth = [set(i for i, _ in store.search(q, k)) for q in query_vectors]
+        elapsed = time.perf_counter() - start
+        print(f"  暴力检索: {queries / elapsed:.1f} QPS")
+
+        store.build_ivf()
+        for nprobe in (4, 16, 32):
+            start = time.perf_counter()
+            results = [set(i for i, _ in store.search(q, k, nprobe=nprobe)) for q in query_vectors]
+            elapsed = time.perf_counter() - start
+            recall = np.mean([len(r & t) / k for r, t in zip(results, truth)])
+            print(f"  IVF nprobe={nprobe}: {queries / elapsed:.1f} QPS，recall@{k}={recall:.3f}")
+        del store
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    logging.basicConfig(level=logging.INFO)
+    sizes = [int(s) for s in sys.argv[1:]] or [100000, 1000000]
+    benchmark(tempfile.mkdtemp(), sizes=sizes)
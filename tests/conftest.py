@@ -0,0 +1,29 @@
+import pytest
+
+#项目库
+from src.data.db.sqlinit import migrate
+from src.utils.sqlite_utils import SQLiteUtils
+
+
+@pytest.fixture
+def db(tmp_path):
+    """
+    迁移到最新版本的临时数据库
+    """
+    db = SQLiteUtils(str(tmp_path / "test.db"))
+    migrate(db)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def add_document(db):
+    """
+    登记一个待处理文档，返回文档ID
+    """
+    def _add(uid: str, finish_url: str = "") -> int:
+        return db.fetchall(
+            "INSERT INTO documents (UID, title, download_url, finish_url, status) VALUES (?, ?, ?, ?, 'init') RETURNING id",
+            (uid, f"{uid}.txt", f"http://files.test/{uid}.txt", finish_url)
+        )[0]["id"]
+    return _add
@@ -0,0 +1,199 @@
+import json
+import time
+
+import pytest
+
+#项目库
+from src.services.ingest_queue import DocumentQueue, IngestWorkerPool
+from src.services.notifier import NotificationDispatcher
+
+
+def _status(db, doc_id: int):
+    return db.fetchone(
+        "SELECT status, attempts, status_message, next_run_at, lease_until, claimed_by FROM documents WHERE id=?",
+        (doc_id,)
+    )
+
+
+def _notifications(db):
+    return db.fetchall("SELECT doc_id, url, params, status FROM notifications ORDER BY id")
+
+
+class UnsupportedError(Exception):
+    pass
+
+
+def test_claim_takes_each_document_once(db, add_document):
+    queue = DocumentQueue(db, lease_seconds=60)
+    first, second = add_document("a"), add_document("b")
+    docs = queue.claim("w1", limit=1)
+    assert [doc["id"] for doc in docs] == [first]
+    assert docs[0]["attempts"] == 1
+    assert [doc["id"] for doc in queue.claim("w2", limit=10)] == [second]
+    assert queue.claim("w3", limit=10) == []
+    row = _status(db, first)
+    assert row["status"] == "doing" and row["claimed_by"] == "w1" and row["lease_until"] > time.time()
+
+
+def test_recover_expired_returns_document_to_queue(db, add_document):
+    queue = DocumentQueue(db, lease_seconds=0.05)
+    doc_id = add_document("a")
+    queue.claim("w1")
+    assert queue.recover_expired() == 0
+    time.sleep(0.1)
+    assert queue.recover_expired() == 1
+    row = _status(db, doc_id)
+    assert row["status"] == "init" and row["claimed_by"] is None and row["lease_until"] is None
+    # 重新认领计入一次新的尝试
+    assert queue.claim("w2")[0]["attempts"] == 2
+
+
+def test_complete_from_stale_worker_returns_false(db, add_document):
+    queue = DocumentQueue(db, lease_seconds=0.05)
+    doc_id = add_document("a")
+    db.execute("INSERT INTO blobs (hash_code, file_size, updated_at) VALUES ('h1', 10, ?)", (time.time(),))
+    queue.claim("w1")
+    time.sleep(0.1)
+    queue.recover_expired()
+    queue.claim("w2")
+    assert not queue.renew(doc_id, "w1")
+    assert queue.complete(doc_id, "w1", "/blobs/h1", "h1", 10) is False
+    assert _status(db, doc_id)["claimed_by"] == "w2"
+    assert queue.complete(doc_id, "w2", "/blobs/h1", "h1", 10) is True
+    assert _status(db, doc_id)["status"] == "ok"
+    assert db.fetchone("SELECT refcount FROM blobs WHERE hash_code='h1'")["refcount"] == 1
+
+
+def test_fail_backs_off_until_max_attempts(db, add_document):
+    queue = DocumentQueue(db, lease_seconds=60, max_attempts=2, retry_base=30, retry_max=3600)
+    doc_id = add_document("a")
+    doc = queue.claim("w1")[0]
+    assert queue.fail(doc, "w1", "下载失败") == "init"
+    row = _status(db, doc_id)
+    assert row["status_message"] == "下载失败"
+    assert row["next_run_at"] == pytest.approx(time.time() + 30, abs=5)
+    # 退避期间不会被认领，也计入延迟队列
+    assert queue.claim("w1") == []
+    assert queue.depth() == {"ready": 0, "delayed": 1, "running": 0}
+    assert queue.next_run_at() == row["next_run_at"]
+    doc = queue.claim("w1", uid="a")[0]
+    assert doc["attempts"] == 2
+    assert queue.fail(doc, "w1", "下载失败") == "failed"
+    row = _status(db, doc_id)
+    assert row["status"] == "failed" and row["next_run_at"] is None
+    # 认领已失效时不再修改状态
+    assert queue.fail(doc, "w1", "下载失败") is None
+
+
+def test_retry_delay_doubles_up_to_max(db):
+    queue = DocumentQueue(db, retry_base=30, retry_max=100)
+    assert [queue.retry_delay(attempts) for attempts in (1, 2, 3, 4)] == [30, 60, 100, 100]
+
+
+def test_fail_without_retry_is_final(db, add_document):
+    queue = DocumentQueue(db, lease_seconds=60, max_attempts=5)
+    doc_id = add_document("a")
+    doc = queue.claim("w1")[0]
+    assert queue.fail(doc, "w1", "不支持的格式", retry=False) == "failed"
+    assert _status(db, doc_id)["status"] == "failed"
+
+
+def test_requeue_does_not_consume_attempt(db, add_document):
+    queue = DocumentQueue(db, lease_seconds=60)
+    doc_id = add_document("a")
+    doc = queue.claim("w1")[0]
+    assert queue.requeue(doc, "w1", "处理被取消")
+    row = _status(db, doc_id)
+    assert row["status"] == "init" and row["attempts"] == 0 and row["next_run_at"] is None
+    assert not queue.requeue(doc, "w1", "处理被取消")
+    assert queue.claim("w1")[0]["attempts"] == 1
+
+
+def test_complete_and_notification_commit_together(db, add_document):
+    queue = DocumentQueue(db, lease_seconds=60)
+    doc_id = add_document("a", finish_url="http://callback.test/done")
+    queue.claim("w1")
+
+    def broken_outbox(conn):
+        conn.execute("INSERT INTO notifications (url, host, next_run_at, created_at) VALUES ('x', 'x', 0, 0)")
+        raise RuntimeError("写入通知失败")
+
+    with pytest.raises(RuntimeError):
+        queue.complete(doc_id, "w1", "/blobs/h1", "h1", 10, outbox=broken_outbox)
+    assert _status(db, doc_id)["status"] == "doing"
+    assert _notifications(db) == []
+
+
+def _pool(db, handler, **kwargs) -> IngestWorkerPool:
+    queue = DocumentQueue(db, lease_seconds=kwargs.pop("lease_seconds", 60), max_attempts=kwargs.pop("max_attempts", 5))
+    return IngestWorkerPool(queue, handler, NotificationDispatcher(db), workers=1, **kwargs)
+
+
+def test_pool_completes_and_enqueues_notification(db, add_document):
+    doc_id = add_document("a", finish_url="http://callback.test/done")
+    db.execute("INSERT INTO blobs (hash_code, file_size, updated_at) VALUES ('h1', 10, ?)", (time.time(),))
+    pool = _pool(db, lambda doc, lease: ("/blobs/h1", "h1", 10))
+    assert pool.process(pool.queue.claim("w1")[0], "w1")
+    assert _status(db, doc_id)["status"] == "ok"
+    notifications = _notifications(db)
+    assert [(n["doc_id"], n["url"], n["status"]) for n in notifications] == [(doc_id, "http://callback.test/done", "pending")]
+    assert json.loads(notifications[0]["params"]) == {"success": "True", "message": "OK"}
+    assert pool.stats()["completed"] == 1
+
+
+def test_pool_notifies_only_final_failure(db, add_document):
+    doc_id = add_document("a", finish_url="http://callback.test/done")
+
+    def handler(doc, lease):
+        raise UnsupportedError("不支持的格式")
+
+    pool = _pool(db, handler, permanent_errors=(UnsupportedError,))
+    assert not pool.process(pool.queue.claim("w1")[0], "w1")
+    assert _status(db, doc_id)["status"] == "failed"
+    assert json.loads(_notifications(db)[0]["params"]) == {"success": "False", "message": "不支持的格式"}
+
+
+def test_pool_retry_does_not_notify(db, add_document):
+    doc_id = add_document("a", finish_url="http://callback.test/done")
+
+    def handler(doc, lease):
+        raise ConnectionError("连接失败")
+
+    pool = _pool(db, handler)
+    pool.process(pool.queue.claim("w1")[0], "w1")
+    assert _status(db, doc_id)["status"] == "init"
+    assert _notifications(db) == []
+    assert pool.stats()["retried"] == 1
+
+
+def test_pool_requeues_cancelled_work(db, add_document):
+    doc_id = add_document("a")
+
+    def handler(doc, lease):
+        raise InterruptedError("应用关闭")
+
+    pool = _pool(db, handler, requeue_errors=(InterruptedError,))
+    pool.process(pool.queue.claim("w1")[0], "w1")
+    row = _status(db, doc_id)
+    assert row["status"] == "init" and row["attempts"] == 0
+    assert pool.stats()["requeued"] == 1
+
+
+def test_pool_abandons_document_when_lease_is_lost(db, add_document):
+    doc_id = add_document("a")
+
+    def handler(doc, lease):
+        # 模拟租约过期后被其它工作线程重新认领
+        db.execute("UPDATE documents SET claimed_by='w2' WHERE id=?", (doc["id"],))
+        deadline = time.monotonic() + 5
+        while not lease.lost and time.monotonic() < deadline:
+            time.sleep(0.01)
+        lease.check()
+        return "/blobs/h1", "h1", 10
+
+    pool = _pool(db, handler, lease_seconds=0.15)
+    assert not pool.process(pool.queue.claim("w1")[0], "w1")
+    row = _status(db, doc_id)
+    assert row["status"] == "doing" and row["claimed_by"] == "w2"
+    assert pool.stats()["abandoned"] == 1
+
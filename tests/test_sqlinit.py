@@ -0,0 +1,78 @@
+import os
+import shutil
+
+#项目库
+from src.data.db.sqlinit import MIGRATIONS, migrate, schema_version
+from src.utils.sqlite_utils import SQLiteUtils
+
+SHIPPED_DB = os.path.join(os.path.dirname(__file__), "..", "src", "data", "db", "sqlite.db")
+LATEST = MIGRATIONS[-1][0]
+
+
+def _tables(db):
+    return {row["name"] for row in db.fetchall("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+def _columns(db, table):
+    return {row["name"] for row in db.fetchall(f"PRAGMA table_info({table})")}
+
+
+def test_migrate_shipped_database(tmp_path):
+    """
+    随代码发布的旧库（含重复登记的 UID）迁移到最新版本，数据不丢失
+    """
+    path = str(tmp_path / "sqlite.db")
+    shutil.copyfile(SHIPPED_DB, path)
+    db = SQLiteUtils(path)
+    try:
+        version = schema_version(db)
+        assert version < LATEST
+        db.executemany(
+            "INSERT INTO documents (UID, title, status, local_path, hash_code) VALUES (?, ?, ?, ?, ?)",
+            [
+                ("a", "a.txt", "ok", "/docs/a.txt", "h1"),
+                ("b", "b.txt", "init", None, None),
+                ("a", "a-again.txt", "ok", "/docs/a2.txt", "h2"),
+                ("c", "c.txt", "doing", None, None),
+            ]
+        )
+        assert migrate(db) == LATEST
+        assert schema_version(db) == LATEST
+        assert {"documents", "documents_duplicates", "blobs", "doc_chunks", "embedding_cache",
+                "notifications", "leader_locks"} <= _tables(db)
+        assert {"status_message", "attempts", "lease_until", "next_run_at", "claimed_by", "change_seq"} <= _columns(db, "documents")
+        # 重复的 UID 保留最早的一条，其余原样移入 documents_duplicates
+        rows = db.fetchall("SELECT UID, title, status, change_seq FROM documents ORDER BY id")
+        assert [(row["UID"], row["title"], row["status"]) for row in rows] == [
+            ("a", "a.txt", "ok"), ("b", "b.txt", "init"), ("c", "c.txt", "doing")
+        ]
+        assert all(row["change_seq"] is not None for row in rows)
+        duplicates = db.fetchall("SELECT UID, title, local_path, hash_code FROM documents_duplicates")
+        assert duplicates == [{"UID": "a", "title": "a-again.txt", "local_path": "/docs/a2.txt", "hash_code": "h2"}]
+        # 再次执行不做任何修改
+        assert migrate(db) == LATEST
+    finally:
+        db.close()
+
+
+def test_migrate_empty_database_step_by_step(tmp_path):
+    db = SQLiteUtils(str(tmp_path / "new.db"))
+    try:
+        for number, _ in MIGRATIONS:
+            assert migrate(db, target=number) == number
+        assert schema_version(db) == LATEST
+    finally:
+        db.close()
+
+
+def test_change_seq_follows_status_changes(db):
+    db.execute("INSERT INTO documents (UID, title) VALUES ('a', 'a.txt')")
+    db.execute("INSERT INTO documents (UID, title) VALUES ('b', 'b.txt')")
+    before = {row["UID"]: row["change_seq"] for row in db.fetchall("SELECT UID, change_seq FROM documents")}
+    assert before["b"] > before["a"]
+    db.execute("UPDATE documents SET status='doing' WHERE UID='a'")
+    after = db.fetchone("SELECT change_seq FROM documents WHERE UID='a'")["change_seq"]
+    assert after > before["b"]
+    # 只更新租约时不产生变更
+    db.execute("UPDATE documents SET lease_until=1 WHERE UID='a'")
+    assert db.fetchone("SELECT change_seq FROM documents WHERE UID='a'")["change_seq"] == after